@@ -0,0 +1,6 @@
+"""
+Benchmarks reproducibles de la API
+
+    python -m bench run --size 10k --out results.json
+    python -m bench compare base.json results.json
+"""
@@ -0,0 +1,148 @@
+"""
+Línea de comandos de los benchmarks
+
+    python -m bench run --size 10k --out results.json
+    python -m bench run --size 1m --db /tmp/bench-1m.db --scenarios search
+    python -m bench run --size 100k --db /tmp/bench-100k.db --scenarios responses --repeats 50
+    python -m bench compare base.json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _run(args, corpus):
+    # Se importa después de fijar EMAILS_DATABASE_URL: la app crea el engine al importarse
+    import main
+    from bench import scenarios
+
+    results = {}
+    async with main.app.router.lifespan_context(main.app):
+        async with scenarios.client(main.app) as http:
+            await scenarios.setup_companies(http, corpus)
+
+            # La carga inicial es el escenario de ingesta (se omite si la BD ya tiene el corpus)
+            load_rows = int(corpus.rows * (1 - args.mixed_reserve))
+            loaded = _count_rows(args.db)
+            if "ingest" in args.scenarios or loaded < load_rows:
+                results["ingest"] = await scenarios.ingest(http, corpus, args.batch_size, loaded, load_rows)
+            if "search" in args.scenarios:
+                results["search"] = await scenarios.search(http, corpus, args.repeats)
+            if "responses" in args.scenarios:
+                results["responses"] = await scenarios.responses(http, corpus, args.repeats)
+            if "mixed" in args.scenarios:
+                results["mixed"] = await scenarios.mixed(http, corpus, args.mixed_seconds, args.readers, args.batch_size, load_rows)
+    return results
+
+
+def _count_rows(db_path: str) -> int:
+    try:
+        return sqlite3.connect(db_path).execute("SELECT count(*) FROM emails WHERE smtp_code LIKE 'BENCH-%'").fetchone()[0]
+    except sqlite3.Error:
+        return 0
+
+
+def run(args):
+    from bench.corpus import Corpus, parse_size
+
+    if args.db is None:
+        args.db = os.path.join(tempfile.mkdtemp(prefix="emails-bench-"), "emails.db")
+    os.environ["EMAILS_DATABASE_URL"] = f"sqlite:///{args.db}"
+    if not args.cache:
+        os.environ["EMAILS_SEARCH_CACHE_MAX_BYTES"] = "0"
+
+    corpus = Corpus(parse_size(args.size), seed=args.seed)
+    started = time.time()
+    results = asyncio.run(_run(args, corpus))
+
+    import settings
+    output = {
+        "meta": {
+            "size": args.size,
+            "rows": corpus.rows,
+            "seed": args.seed,
+            "scenarios": args.scenarios,
+            "db": args.db,
+            "storage_profile": settings.STORAGE_PROFILE,
+            "search_cache": args.cache,
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "started_at": started,
+            "seconds": round(time.time() - started, 1),
+        },
+        "results": results,
+    }
+    text = json.dumps(output, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = _flatten("", json.load(f)["results"], {})
+    with open(args.other) as f:
+        other = _flatten("", json.load(f)["results"], {})
+    print(f"{'métrica':60} {'base':>12} {'nuevo':>12} {'cambio':>8}")
+    for key in sorted(base.keys() & other.keys()):
+        before, after = base[key], other[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+        print(f"{key:60} {before:>12} {after:>12} {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmarks de Email Filter API")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Ejecutar escenarios")
+    run_parser.add_argument("--size", default="10k", help="10k, 100k, 1m, 10m o un número de filas")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--scenarios", default="ingest,search,mixed", type=lambda s: s.split(","))
+    run_parser.add_argument("--db", default=None, help="Archivo SQLite a usar (se reutiliza si ya tiene el corpus)")
+    run_parser.add_argument("--batch-size", type=int, default=5000)
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--readers", type=int, default=4)
+    run_parser.add_argument("--mixed-seconds", type=float, default=10)
+    run_parser.add_argument("--mixed-reserve", type=float, default=0.1, help="Fracción del corpus reservada para el escritor del escenario mixto")
+    run_parser.add_argument("--cache", action="store_true", help="Mantener la caché de búsquedas activa")
+    run_parser.add_argument("--out", default=None, help="Archivo JSON de resultados")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = sub.add_parser("compare", help="Comparar dos archivos de resultados")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("other")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
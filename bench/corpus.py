@@ -0,0 +1,118 @@
+"""
+Generador determinista de buzones sintéticos
+
+Con la misma semilla y tamaño siempre genera los mismos emails. Empresas, emisores,
+destinatarios y palabras siguen distribuciones Zipf (pocos valores concentran la mayoría).
+"""
+
+import bisect
+import itertools
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List
+
+# Tamaños predefinidos
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+
+_SYLLABLES = ["ba", "co", "de", "fa", "go", "hi", "ja", "ke", "lo", "ma", "ne", "po", "qui", "ra", "se", "ti", "vu", "xa", "yo", "zu"]
+_SENDER_ROLES = ["ventas", "soporte", "facturacion", "notificaciones", "no-reply", "marketing", "seguridad", "rrhh"]
+_TEMPLATES = [
+    "Su factura {n} por {m} USD está disponible en el portal",
+    "Detectamos un inicio de sesión nuevo en su cuenta desde {w}",
+    "Su pedido {n} fue enviado y llegará en {m} días",
+    "Recordatorio: su póliza {n} vence el próximo mes",
+]
+
+
+def parse_size(size: str) -> int:
+    size = size.lower()
+    return SIZES[size] if size in SIZES else int(size)
+
+
+def _zipf_cum_weights(n: int, s: float) -> List[float]:
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+class _Zipf:
+    """Muestreo Zipf sobre una lista fija de valores"""
+
+    def __init__(self, values: List, s: float):
+        self.values = values
+        self.cum = _zipf_cum_weights(len(values), s)
+        self.total = self.cum[-1]
+
+    def sample(self, rng: random.Random):
+        return self.values[bisect.bisect_left(self.cum, rng.random() * self.total)]
+
+
+class Corpus:
+    def __init__(
+        self,
+        rows: int,
+        seed: int = 42,
+        companies: int = 50,
+        vocabulary: int = 5000,
+        words_per_email: int = 40,
+        template_ratio: float = 0.3,
+        days: int = 730,
+        zipf_s: float = 1.1
+    ):
+        self.rows = rows
+        self.seed = seed
+        self.words_per_email = words_per_email
+        self.template_ratio = template_ratio
+        self.start = datetime(2023, 1, 1)
+        self.seconds = days * 86400
+
+        rng = random.Random(seed)
+        self.vocabulary = self._make_vocabulary(rng, vocabulary)
+        self.company_names = [f"Empresa {i:04d} {self._word(rng, 2).title()}" for i in range(companies)]
+        self._companies = _Zipf(list(range(companies)), zipf_s)
+        self._domains = [name.split()[-1].lower() + ".com" for name in self.company_names]
+        self._roles = _Zipf(_SENDER_ROLES, zipf_s)
+        self._recipients = _Zipf([f"{self._word(rng, 3)}{i}@correo.com" for i in range(max(rows // 20, 10))], zipf_s)
+        self._words = _Zipf(self.vocabulary, zipf_s)
+
+    @staticmethod
+    def _word(rng: random.Random, syllables: int) -> str:
+        return "".join(rng.choice(_SYLLABLES) for _ in range(syllables))
+
+    def _make_vocabulary(self, rng: random.Random, size: int) -> List[str]:
+        words = set()
+        while len(words) < size:
+            words.add(self._word(rng, rng.randint(2, 4)))
+        words = sorted(words)
+        rng.shuffle(words)
+        return words
+
+    def companies(self) -> List[Dict]:
+        return [{"name": name, "client_id": f"cliente_{i:04d}"} for i, name in enumerate(self.company_names)]
+
+    def word_by_rank(self, rank: int) -> str:
+        """Palabra del vocabulario por frecuencia (0 = la más común)"""
+        return self.vocabulary[rank]
+
+    def emails(self, start: int = 0, stop: int = None) -> Iterator[Dict]:
+        """Genera los emails [start, stop) como dicts de EmailCreate"""
+        stop = self.rows if stop is None else min(stop, self.rows)
+        for i in range(start, stop):
+            # Una semilla por fila: cualquier rango se puede regenerar igual
+            rng = random.Random(self.seed * 1_000_003 + i)
+            company = self._companies.sample(rng)
+            if rng.random() < self.template_ratio:
+                content = rng.choice(_TEMPLATES).format(n=rng.randint(1000, 9999), m=rng.randint(1, 500), w=self._words.sample(rng))
+            else:
+                content = " ".join(self._words.sample(rng) for _ in range(rng.randint(self.words_per_email // 2, self.words_per_email * 2)))
+            yield {
+                "recipient": self._recipients.sample(rng),
+                "sender": f"{self._roles.sample(rng)}@{self._domains[company]}",
+                "date": (self.start + timedelta(seconds=rng.randrange(self.seconds))).isoformat(),
+                "company_name": self.company_names[company],
+                "smtp_code": f"BENCH-{self.seed}-{i:010d}",
+                "content": content,
+            }
+
+    def batches(self, size: int, start: int = 0, stop: int = None) -> Iterator[List[Dict]]:
+        stop = self.rows if stop is None else min(stop, self.rows)
+        for offset in range(start, stop, size):
+            yield list(self.emails(offset, min(offset + size, stop)))
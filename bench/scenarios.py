@@ -0,0 +1,198 @@
+"""
+Escenarios de benchmark ejecutados contra la app ASGI en el mismo proceso (httpx.ASGITransport)
+"""
+
+import asyncio
+import random
+import resource
+import statistics
+import time
+from datetime import timedelta
+from typing import Dict, List
+
+import httpx
+
+from bench.corpus import Corpus
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/max en milisegundos"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss está en KiB en Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None)
+
+
+async def _check(response: httpx.Response):
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.method} {response.request.url} -> {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def setup_companies(http: httpx.AsyncClient, corpus: Corpus):
+    for company in corpus.companies():
+        response = await http.post("/api/companies", json=company)
+        if response.status_code not in (201, 400):  # 400 = ya existe
+            await _check(response)
+
+
+# ============== ESCENARIOS ==============
+async def ingest(http: httpx.AsyncClient, corpus: Corpus, batch_size: int, start: int = 0, stop: int = None) -> Dict:
+    """Carga el corpus por /api/emails/bulk y mide filas/s y latencia por lote"""
+    latencies = []
+    rows = 0
+    failed = 0
+    began = time.perf_counter()
+    for batch in corpus.batches(batch_size, start, stop):
+        t0 = time.perf_counter()
+        response = await _check(await http.post("/api/emails/bulk", json={"emails": batch}))
+        latencies.append(time.perf_counter() - t0)
+        report = response.json()
+        rows += report["success"]
+        failed += report["failed"]
+    elapsed = time.perf_counter() - began
+    return {
+        "rows": rows,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+        "batch_latency": percentiles(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def search_cases(corpus: Corpus) -> Dict[str, Dict]:
+    """Búsquedas de distinta selectividad (palabra común / media / rara) y filtros"""
+    common, medium, rare = corpus.word_by_rank(0), corpus.word_by_rank(100), corpus.word_by_rank(len(corpus.vocabulary) - 1)
+    window_from = corpus.start + timedelta(days=300)
+    return {
+        "common": {"content": common},
+        "medium": {"content": medium},
+        "rare": {"content": rare},
+        "template": {"content": "factura"},
+        "common+company": {"content": common, "company_name": corpus.company_names[0]},
+        "common+sender": {"content": common, "sender": "soporte@"},
+        "common+7days": {"content": common, "date_from": window_from.isoformat(), "date_to": (window_from + timedelta(days=7)).isoformat()},
+        "medium+fts": {"content": medium, "mode": "token"},
+    }
+
+
+async def search(http: httpx.AsyncClient, corpus: Corpus, repeats: int, pages=(1, 10, 100), page_size: int = 20) -> Dict:
+    """Latencia de búsqueda por caso y profundidad de página (offset y cursor)"""
+    results = {}
+    for name, params in search_cases(corpus).items():
+        for page in pages:
+            samples = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                await _check(await http.get("/api/emails/search", params={**params, "page": page, "page_size": page_size}))
+                samples.append(time.perf_counter() - t0)
+            results[f"{name}/page{page}"] = percentiles(samples)
+
+        # Cursor: recorrer las mismas páginas siguiendo next_cursor
+        samples = []
+        for _ in range(repeats):
+            cursor = ""
+            for _page in range(max(pages)):
+                t0 = time.perf_counter()
+                response = await _check(await http.get("/api/emails/search", params={**params, "cursor": cursor, "page_size": page_size}))
+                samples.append(time.perf_counter() - t0)
+                cursor = response.json()["next_cursor"]
+                if cursor is None:
+                    break
+        results[f"{name}/cursor"] = percentiles(samples)
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+async def mixed(http: httpx.AsyncClient, corpus: Corpus, seconds: float, readers: int, batch_size: int, start: int) -> Dict:
+    """Lectores concurrentes buscando mientras un escritor carga lotes nuevos"""
+    deadline = time.perf_counter() + seconds
+    cases = list(search_cases(corpus).values())
+    read_samples = []
+    write = {"rows": 0, "batches": 0}
+
+    async def reader(seed: int):
+        rng = random.Random(seed)
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            await _check(await http.get("/api/emails/search", params={**rng.choice(cases), "page": rng.randint(1, 5)}))
+            read_samples.append(time.perf_counter() - t0)
+
+    async def writer():
+        offset = start
+        while time.perf_counter() < deadline and offset < corpus.rows:
+            batch = list(corpus.emails(offset, offset + batch_size))
+            offset += batch_size
+            response = await _check(await http.post("/api/emails/bulk", json={"emails": batch}))
+            write["rows"] += response.json()["success"]
+            write["batches"] += 1
+
+    began = time.perf_counter()
+    await asyncio.gather(writer(), *(reader(i) for i in range(readers)))
+    elapsed = time.perf_counter() - began
+    return {
+        "seconds": round(elapsed, 3),
+        "readers": readers,
+        "reads_per_s": round(len(read_samples) / elapsed, 1),
+        "read_latency": percentiles(read_samples),
+        "write_rows_per_s": round(write["rows"] / elapsed, 1),
+        "write_batches": write["batches"],
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+async def responses(http: httpx.AsyncClient, corpus: Corpus, repeats: int) -> Dict:
+    """Bytes por respuesta y CPU por request de las lecturas grandes: sin comprimir, gzip, br y 304"""
+    common = corpus.word_by_rank(0)
+    cases = {
+        "search/page100": ("/api/emails/search", {"content": common, "page_size": 100}),
+        "search/snippet": ("/api/emails/search", {"content": common, "page_size": 100, "snippet": "true"}),
+        "companies": ("/api/companies", {}),
+    }
+    results = {}
+    for name, (url, params) in cases.items():
+        for encoding in ("identity", "gzip", "br"):
+            cpu = time.process_time()
+            for _ in range(repeats):
+                response = await _check(await http.get(url, params=params, headers={"Accept-Encoding": encoding}))
+            # process_time cuenta todos los hilos del proceso (también el cliente httpx)
+            results[f"{name}/{encoding}"] = {
+                "bytes": response.num_bytes_downloaded,
+                "content_encoding": response.headers.get("content-encoding", "identity"),
+                "cpu_ms": round((time.process_time() - cpu) / repeats * 1000, 3),
+            }
+
+        # Revalidación con el ETag de la respuesta anterior
+        tag = response.headers.get("etag")
+        not_modified = 0
+        cpu = time.process_time()
+        for _ in range(repeats):
+            response = await http.get(url, params=params, headers={"If-None-Match": tag} if tag else {})
+            not_modified += response.status_code == 304
+        results[f"{name}/if-none-match"] = {
+            "bytes": response.num_bytes_downloaded,
+            "not_modified": not_modified,
+            "cpu_ms": round((time.process_time() - cpu) / repeats * 1000, 3),
+        }
+    return results
@@ -0,0 +1,243 @@
+"""
+Almacenamiento de los cuerpos de email por contenido
+
+Cada contenido distinto se guarda una sola vez en email_bodies (clave: sha256 del texto),
+comprimido con zlib; la tabla emails solo guarda body_id. El texto se descomprime
+únicamente cuando se devuelve (crud.rows_to_dicts), hasta donde hace falta para un
+fragmento (snippet), se indexa o se busca por subcadena (función SQL inflate, registrada
+en cada conexión por database.py). Con EMAILS_BODY_TRIGRAM_INDEX=1 la subcadena usa el
+índice de trigramas de los cuerpos (fts.py) en vez de descomprimirlos.
+
+Uso por consola:
+    python bodies.py migrate   # BD con la columna emails.content -> email_bodies
+    python bodies.py prune     # borrar cuerpos que ya ningún email usa
+"""
+
+import codecs
+import hashlib
+import re
+import zlib
+from sqlalchemy import Text, func, inspect, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Sequence
+import fts
+import models
+import partitions
+import settings
+
+# Máximo de parámetros por consulta IN (...)
+IN_CHUNK_SIZE = 500
+
+# Bytes descomprimidos por paso al armar un fragmento
+SNIPPET_CHUNK_SIZE = 16 * 1024
+# Una coincidencia a menos de esto del final de lo descomprimido puede seguir en el próximo bloque
+_SNIPPET_GUARD = 256
+
+
+'sha256 del contenido sin comprimir'
+def content_hash(content: str) -> bytes:
+    return hashlib.sha256(content.encode("utf-8")).digest()
+
+
+def compress(content: str) -> bytes:
+    return zlib.compress(content.encode("utf-8"), settings.BODY_COMPRESSION_LEVEL)
+
+
+'descomprimir un cuerpo (también registrada como función SQL inflate)'
+def inflate(data: Optional[bytes]) -> Optional[str]:
+    if data is None:
+        return None
+    return zlib.decompress(data).decode("utf-8")
+
+
+'fragmentos del cuerpo alrededor de las primeras `matches` coincidencias, retorna [{offset, text, highlights}]'
+def snippet(data: Optional[bytes], pattern: re.Pattern, matches: int, size: int) -> List[dict]:
+    """
+    Descomprime por bloques y se detiene apenas tiene las coincidencias pedidas y el
+    contexto de la última: de un cuerpo largo solo se descomprime hasta ahí. Cada
+    fragmento tiene hasta `size` caracteres de contexto; offset es su posición en el
+    cuerpo y highlights las posiciones [inicio, fin) de cada coincidencia en text.
+    Sin coincidencias (p. ej. por acentos en los modos FTS) devuelve el inicio del cuerpo.
+    """
+    if data is None:
+        return []
+    half = size // 2
+    decompressor = zlib.decompressobj()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = data
+    text = ""
+    found = []
+    position = 0
+    finished = False
+    while not finished:
+        raw = decompressor.decompress(pending, SNIPPET_CHUNK_SIZE)
+        pending = decompressor.unconsumed_tail
+        finished = decompressor.eof or not (raw or pending)
+        text += decoder.decode(raw, final=finished)
+        end = len(text) if finished else max(len(text) - _SNIPPET_GUARD, position)
+        for match in pattern.finditer(text, position, end):
+            if match.end() == match.start():
+                continue
+            found.append((match.start(), match.end()))
+            position = match.end()
+            if len(found) == matches:
+                break
+        if len(found) == matches and len(text) >= found[-1][1] + half:
+            break
+
+    if not found:
+        return [{"offset": 0, "text": text[:size], "highlights": []}]
+    # Ventanas alrededor de cada coincidencia; las que se tocan van en un solo fragmento
+    fragments = []
+    for start, stop in found:
+        window_start, window_end = max(0, start - half), min(len(text), stop + half)
+        if fragments and window_start <= fragments[-1][1]:
+            fragments[-1][1] = window_end
+            fragments[-1][2].append((start, stop))
+        else:
+            fragments.append([window_start, window_end, [(start, stop)]])
+    return [
+        {
+            "offset": window_start,
+            "text": text[window_start:window_end],
+            "highlights": [[start - window_start, stop - window_start] for start, stop in spans],
+        }
+        for window_start, window_end, spans in fragments
+    ]
+
+
+def _ids_by_hash(db: Session, hashes: Sequence[bytes]) -> Dict[bytes, int]:
+    found = {}
+    for start in range(0, len(hashes), IN_CHUNK_SIZE):
+        chunk = hashes[start:start + IN_CHUNK_SIZE]
+        rows = db.execute(select(models.EmailBody.hash, models.EmailBody.id).where(models.EmailBody.hash.in_(chunk)))
+        found.update((body_hash, body_id) for body_hash, body_id in rows)
+    return found
+
+
+'guardar los contenidos que aún no existen (dentro de la transacción de db), retorna {contenido: body_id}'
+def store(db: Session, contents: Iterable[str]) -> Dict[str, int]:
+    by_hash = {content_hash(content): content for content in set(contents)}
+    ids = _ids_by_hash(db, list(by_hash))
+    missing = [body_hash for body_hash in by_hash if body_hash not in ids]
+    if missing:
+        # Otro escritor pudo guardar el mismo cuerpo: el conflicto se ignora y se relee el id
+        db.execute(
+            sqlite_insert(models.EmailBody).on_conflict_do_nothing(index_elements=["hash"]),
+            [
+                {"hash": body_hash, "data": compress(by_hash[body_hash]), "size": len(by_hash[body_hash].encode("utf-8"))}
+                for body_hash in missing
+            ]
+        )
+        ids.update(_ids_by_hash(db, missing))
+    return {by_hash[body_hash]: body_id for body_hash, body_id in ids.items()}
+
+
+'subconsulta con los ids de los cuerpos que contienen el texto'
+def matching(term: str):
+    # Con el índice de trigramas, desde 3 caracteres responde el índice (un phrase de trigramas es una subcadena exacta)
+    if settings.BODY_TRIGRAM_INDEX and len(term) >= fts.MIN_TRIGRAM_LENGTH:
+        return fts.body_candidates(term)
+    # Si no: se descomprime cada cuerpo distinto una vez
+    return select(models.EmailBody.id).where(func.inflate(models.EmailBody.data, type_=Text).contains(term))
+
+
+'borrar los cuerpos que ningún email referencia, retorna cuántos se borraron'
+def prune(db: Session) -> int:
+    # Se revisa la tabla emails y cada partición mensual
+    unused = " AND ".join(
+        f"NOT EXISTS (SELECT 1 FROM {table.name} WHERE {table.name}.body_id = email_bodies.id)"
+        for table in partitions.registry.tables(db)
+    )
+    result = db.execute(text(f"DELETE FROM email_bodies WHERE {unused}"))
+    db.commit()
+    return result.rowcount
+
+
+# ============== MIGRACIÓN ==============
+'la tabla emails todavía tiene la columna content (BD anterior a email_bodies)'
+def needs_migration(engine: Engine) -> bool:
+    columns = {column["name"] for column in inspect(engine).get_columns("emails")}
+    return "content" in columns
+
+
+'mover emails.content a email_bodies, retorna un resumen con los tamaños antes y después'
+def migrate(engine: Engine, batch_size: Optional[int] = None, vacuum: bool = True) -> dict:
+    """
+    Se puede interrumpir y volver a ejecutar: cada bloque hace commit y solo se
+    procesan los emails con body_id vacío. Al final borra emails.content, recrea el
+    índice FTS sobre los cuerpos y (opcional) hace VACUUM para devolver el espacio.
+    La columna body_id agregada con ALTER TABLE queda sin NOT NULL a nivel de SQLite.
+    """
+    if batch_size is None:
+        batch_size = settings.BODY_MIGRATION_BATCH_SIZE
+    summary = {"emails": 0, "bodies": 0, "content_bytes": 0, "stored_bytes": 0}
+    if not needs_migration(engine):
+        return summary
+
+    with engine.begin() as conn:
+        # El índice FTS viejo (rowid = emails.id) y sus triggers leen emails.content
+        fts.drop_index(conn, fts.FTS_TABLE)
+        models.EmailBody.__table__.create(conn, checkfirst=True)
+        columns = {column["name"] for column in inspect(conn).get_columns("emails")}
+        if "body_id" not in columns:
+            conn.execute(text("ALTER TABLE emails ADD COLUMN body_id INTEGER REFERENCES email_bodies(id)"))
+
+    with Session(engine) as db:
+        last_id = 0
+        while True:
+            rows = db.execute(
+                text("SELECT id, content FROM emails WHERE body_id IS NULL AND id > :last ORDER BY id LIMIT :limit"),
+                {"last": last_id, "limit": batch_size}
+            ).all()
+            if not rows:
+                break
+            body_ids = store(db, (content for _, content in rows))
+            db.execute(
+                text("UPDATE emails SET body_id = :body_id WHERE id = :id"),
+                [{"body_id": body_ids[content], "id": email_id} for email_id, content in rows]
+            )
+            db.commit()
+            last_id = rows[-1][0]
+            summary["emails"] += len(rows)
+            summary["content_bytes"] += sum(len(content.encode("utf-8")) for _, content in rows)
+
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_emails_body_id ON emails (body_id)"))
+        conn.execute(text("ALTER TABLE emails DROP COLUMN content"))
+        summary["bodies"], summary["stored_bytes"] = conn.execute(
+            text("SELECT count(*), coalesce(sum(length(data)), 0) FROM email_bodies")
+        ).one()
+
+    fts.ensure_fts(engine)
+    if vacuum:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+    import shards
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Almacenamiento comprimido de los cuerpos de email")
+    parser.add_argument("command", choices=["migrate", "prune"])
+    parser.add_argument("--batch-size", type=int, default=None, help="Emails por transacción al migrar")
+    parser.add_argument("--no-vacuum", action="store_true", help="No compactar el archivo al terminar")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    if args.command == "migrate":
+        result = migrate(engine, batch_size=args.batch_size, vacuum=not args.no_vacuum)
+        print(
+            f"Emails migrados: {result['emails']}, cuerpos distintos: {result['bodies']}, "
+            f"bytes de contenido: {result['content_bytes']} -> {result['stored_bytes']}"
+        )
+    else:
+        # Con shards por empresa se revisa cada archivo
+        for target in [engine] + (shards.registry.engines() if shards.SHARDED else []):
+            with Session(target) as db:
+                print(f"{target.url.database}: cuerpos borrados: {prune(db)}")
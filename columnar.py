@@ -0,0 +1,126 @@
+"""
+Formato columnar del registro masivo (/api/emails/bulk/columnar)
+
+El lote llega por columnas, JSON {"recipient": [...], "sender": [...], ...} o CSV con
+encabezado, y cada columna se valida de una sola vez con un TypeAdapter armado desde los
+campos de schemas.EmailCreate (las mismas restricciones). No se crea un modelo por email:
+las filas válidas pasan como EmailRow (una tupla) directo a la ingesta por conjuntos.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Annotated, Dict, List, NamedTuple, Optional, Tuple
+from pydantic import TypeAdapter, ValidationError
+import schemas
+
+JSON_TYPES = ("application/json",)
+CSV_TYPES = ("text/csv", "application/csv")
+
+
+'un email del lote con los campos de EmailCreate, sin el costo de un modelo pydantic'
+class EmailRow(NamedTuple):
+    recipient: str
+    sender: str
+    date: datetime
+    company_name: str
+    smtp_code: str
+    content: str
+
+
+FIELDS = EmailRow._fields
+
+
+def _column_adapter(field) -> TypeAdapter:
+    item = Annotated[(field.annotation, *field.metadata)] if field.metadata else field.annotation
+    return TypeAdapter(List[item])
+
+
+# Un validador por columna con las restricciones del campo en EmailCreate
+_ADAPTERS = {name: _column_adapter(schemas.EmailCreate.model_fields[name]) for name in FIELDS}
+
+
+def _check_columns(columns) -> Dict[str, list]:
+    if not isinstance(columns, dict):
+        raise ValueError("Se espera un objeto JSON con una lista por columna")
+    missing = [name for name in FIELDS if name not in columns]
+    if missing:
+        raise ValueError(f"Faltan columnas: {', '.join(missing)}")
+    if not all(isinstance(columns[name], list) for name in FIELDS):
+        raise ValueError("Cada columna debe ser una lista")
+    lengths = {len(columns[name]) for name in FIELDS}
+    if len(lengths) != 1:
+        raise ValueError("Todas las columnas deben tener la misma cantidad de valores")
+    if lengths == {0}:
+        raise ValueError("El lote no tiene emails")
+    return columns
+
+
+'leer un lote JSON columnar, retorna {columna: valores}'
+def from_json(body: bytes) -> Dict[str, list]:
+    return _check_columns(json.loads(body))
+
+
+'leer un lote CSV con encabezado, retorna ({columna: valores}, {indice: error de la fila})'
+def from_csv(body: bytes) -> Tuple[Dict[str, list], Dict[int, str]]:
+    reader = csv.reader(io.StringIO(body.decode("utf-8-sig")))
+    header = [name.strip() for name in next(reader, [])]
+    if not header:
+        raise ValueError("CSV vacío: se espera una fila de encabezado")
+    records = []
+    malformed = {}
+    for record in reader:
+        if not record:
+            continue
+        if len(record) != len(header):
+            # La fila se conserva (con valores vacíos) para no correr los índices
+            malformed[len(records)] = f"La fila tiene {len(record)} campos, se esperaban {len(header)}"
+            record = [""] * len(header)
+        records.append(record)
+    columns = {name: list(values) for name, values in zip(header, zip(*records))} if records else {name: [] for name in header}
+    return _check_columns(columns), malformed
+
+
+def _validate_column(name: str, values: list, problems: Dict[int, List[str]]) -> list:
+    adapter = _ADAPTERS[name]
+    try:
+        return adapter.validate_python(values)
+    except ValidationError as e:
+        bad = set()
+        for error in e.errors():
+            index = error["loc"][0]
+            bad.add(index)
+            problems.setdefault(index, []).append(f"{name}: {error['msg']}")
+    # Solo si hubo errores: segunda pasada con los valores válidos de la columna
+    good = [index for index in range(len(values)) if index not in bad]
+    parsed = [None] * len(values)
+    for index, value in zip(good, adapter.validate_python([values[index] for index in good])):
+        parsed[index] = value
+    return parsed
+
+
+'validar las columnas, retorna ([(indice, EmailRow)] válidos, errores por fila)'
+def validate(columns: Dict[str, list], malformed: Optional[Dict[int, str]] = None) -> Tuple[List[tuple], List[dict]]:
+    malformed = malformed or {}
+    problems: Dict[int, List[str]] = {}
+    parsed = [_validate_column(name, columns[name], problems) for name in FIELDS]
+
+    items = []
+    errors = []
+    codes = columns["smtp_code"]
+    for index, values in enumerate(zip(*parsed)):
+        if index in malformed or index in problems:
+            smtp_code = codes[index] if isinstance(codes[index], str) and index not in malformed else None
+            message = malformed.get(index) or "; ".join(problems[index])
+            errors.append({"indice": index, "smtp_code": smtp_code, "error": message})
+        else:
+            items.append((index, EmailRow._make(values)))
+    return items, errors
+
+
+'leer y validar un lote según su Content-Type, retorna ([(indice, EmailRow)], errores por fila)'
+def parse(body: bytes, content_type: str) -> Tuple[List[tuple], List[dict]]:
+    if content_type in CSV_TYPES:
+        return validate(*from_csv(body))
+    return validate(from_json(body))
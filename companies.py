@@ -2,40 +2,78 @@
 Endpoints para manejar empresas (catálogo)
 """
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import schemas, models
-from database import get_db
+import company_cache
+import responses
+import shards
+import suggest
+from database import get_read_db, run_write
 
 router = APIRouter()
 
+# Listados ya serializados por (skip, limit), válidos mientras no cambie el catálogo
+_pages = responses.BodyCache()
+
+
+'listado de empresas con ETag por versión del catálogo: 304 o el JSON guardado sin consultar la BD'
+def catalog_response(request: Request, db: Session, skip: int = 0, limit: Optional[int] = None):
+    version = company_cache.catalog.version
+    tag = responses.etag("companies", version)
+    unchanged = responses.not_modified(request, tag)
+    if unchanged is not None:
+        return unchanged
+    body = _pages.get((skip, limit), version)
+    if body is None:
+        company = models.Company
+        query = select(company.id, company.name, company.client_id, company.created_at).order_by(company.id)
+        rows = db.execute(query.offset(skip).limit(limit)).all()
+        body = responses.dumps([row._asdict() for row in rows])
+        _pages.put((skip, limit), version, body)
+    return responses.encoded_response(body, etag=tag)
+
 
 @router.post("/api/companies", response_model=schemas.CompanyResponse, status_code=201)
-def create_company(company: schemas.CompanyCreate, db: Session = Depends(get_db)):
+def create_company(company: schemas.CompanyCreate):
   
-    # Verificar si ya existe
-    exists = db.query(models.Company).filter(models.Company.name == company.name).first()
-    if exists:
-        raise HTTPException(status_code=400, detail=f"La empresa '{company.name}' ya existe")
+    def write(db: Session) -> Optional[models.Company]:
+        # Verificar si ya existe
+        exists = db.query(models.Company).filter(models.Company.name == company.name).first()
+        if exists:
+            return None
+        
+        # Crear nueva empresa
+        new_company = models.Company(
+            name=company.name,
+            client_id=company.client_id
+        )
+        
+        db.add(new_company)
+        db.flush()
+        # Con shards por empresa su archivo de emails queda asignado en la misma transacción
+        shards.assign(db, new_company.id)
+        db.commit()
+        db.refresh(new_company)
+        return new_company
     
-    # Crear nueva empresa
-    new_company = models.Company(
-        name=company.name,
-        client_id=company.client_id
-    )
+    # En el escritor de la BD principal, como las demás escrituras
+    new_company = run_write(write)
+    if new_company is None:
+        raise HTTPException(status_code=400, detail=f"La empresa '{company.name}' ya existe")
     
-    db.add(new_company)
-    db.commit()
-    db.refresh(new_company)
+    # Publicar en el catálogo en memoria
+    company_cache.catalog.add(new_company.id, new_company.name)
+    suggest.index.add_company(new_company.name)
     
     return new_company
 
 
 @router.get("/api/companies", response_model=List[schemas.CompanyResponse])
-def list_companies(db: Session = Depends(get_db)):
+def list_companies(request: Request, db: Session = Depends(get_read_db)):
     """
     Lista todas las empresas registradas en el catálogo
     """
-    companies = db.query(models.Company).all()
-    return companies
+    return catalog_response(request, db)
@@ -0,0 +1,154 @@
+"""
+Caché en memoria del catálogo de empresas (nombre <-> id)
+
+El catálogo es chico y casi nunca cambia: se carga una vez al arrancar, se actualiza al crear
+una empresa por la API y un hilo opcional lo revalida por si otro proceso escribe en la tabla.
+Los diccionarios nunca se modifican: cada cambio publica copias nuevas (lecturas sin lock).
+Un id que no está (name_for, una vez por fila al armar resultados) revalida como mucho una
+vez por intervalo: una página con emails de una empresa nueva hace una sola consulta.
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import func, select
+import models
+from database import ReadSessionLocal
+import settings
+
+logger = logging.getLogger(__name__)
+
+# Mínimo entre revalidaciones por ids que faltan aunque el intervalo sea 0 (sin hilo)
+MIN_MISS_INTERVAL = 1.0
+
+
+class CompanyCatalog:
+    def __init__(self):
+        self._by_name: Dict[str, int] = {}
+        self._by_id: Dict[int, str] = {}
+        self._signature = None
+        self._loaded = False
+        self._version = 0  # sube con cada cambio publicado (ETag de /api/companies)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._miss_interval = max(settings.COMPANY_CACHE_REVALIDATE_SECONDS, MIN_MISS_INTERVAL)
+        self._miss_checked_at = None
+
+    # ============== CARGA ==============
+    def _read_signature(self, db):
+        # Cambia si se agrega o borra una empresa
+        return tuple(db.execute(select(func.count(models.Company.id), func.max(models.Company.id))).one())
+
+    def load(self):
+        """Lee todo el catálogo y lo publica de una vez"""
+        db = ReadSessionLocal()
+        try:
+            signature = self._read_signature(db)
+            rows = db.execute(select(models.Company.id, models.Company.name)).all()
+        finally:
+            db.close()
+        with self._lock:
+            self._by_name = {name: company_id for company_id, name in rows}
+            self._by_id = {company_id: name for company_id, name in rows}
+            self._signature = signature
+            self._loaded = True
+            self._version += 1
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    def revalidate(self) -> bool:
+        """Recarga si la tabla cambió desde la última carga, retorna True si recargó"""
+        db = ReadSessionLocal()
+        try:
+            signature = self._read_signature(db)
+        finally:
+            db.close()
+        if signature == self._signature:
+            return False
+        self.load()
+        return True
+
+    def start(self, interval: float):
+        """Carga el catálogo y, si interval > 0, lo revalida en segundo plano"""
+        self._miss_interval = max(interval, MIN_MISS_INTERVAL)
+        self.load()
+        if interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._revalidate_loop, args=(interval,), name="company-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _revalidate_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.revalidate()
+            except Exception:
+                logger.exception("Error revalidando el catálogo de empresas")
+
+    # ============== ESCRITURA ==============
+    def add(self, company_id: int, name: str):
+        """Publicar una empresa recién creada"""
+        self._ensure_loaded()
+        with self._lock:
+            by_name = dict(self._by_name)
+            by_id = dict(self._by_id)
+            by_name[name] = company_id
+            by_id[company_id] = name
+            self._by_name, self._by_id = by_name, by_id
+            self._version += 1
+
+    # ============== LECTURA ==============
+    @property
+    def version(self) -> int:
+        """Versión de los datos publicados: cambia cuando se agrega o se recarga una empresa"""
+        self._ensure_loaded()
+        return self._version
+
+    def ids_by_name(self, names: Iterable[str]) -> Dict[str, int]:
+        """Resolver nombres exactos a ids; si falta alguno se revalida una vez (otro proceso pudo crearlo)"""
+        self._ensure_loaded()
+        names = set(names)
+        found = {name: self._by_name[name] for name in names if name in self._by_name}
+        if len(found) < len(names) and self.revalidate():
+            found = {name: self._by_name[name] for name in names if name in self._by_name}
+        return found
+
+    def _revalidate_miss(self) -> bool:
+        """Revalidar por un id que falta, como mucho una vez cada _miss_interval segundos"""
+        now = time.monotonic()
+        with self._lock:
+            checked_at = self._miss_checked_at
+            if checked_at is not None and now - checked_at < self._miss_interval:
+                return False
+            self._miss_checked_at = now
+        return self.revalidate()
+
+    def name_for(self, company_id: int) -> Optional[str]:
+        self._ensure_loaded()
+        name = self._by_id.get(company_id)
+        if name is None and self._revalidate_miss():
+            name = self._by_id.get(company_id)
+        return name
+
+    def names(self) -> List[str]:
+        self._ensure_loaded()
+        return list(self._by_name)
+
+    def ids_matching(self, text: str) -> List[int]:
+        """Ids de las empresas cuyo nombre contiene el texto (sin distinguir mayúsculas, como LIKE)"""
+        self._ensure_loaded()
+        text = text.lower()
+        return [company_id for name, company_id in self._by_name.items() if text in name.lower()]
+
+
+catalog = CompanyCatalog()
@@ -1,10 +1,25 @@
 
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, func, select, tuple_, union_all
 import models
 import schemas
-from typing import List, Optional
+import bodies
+import fts
+import company_cache
+import partitions
+import percolator
+import rollups
+import search_cache
+import settings
+import shards
+import slow_queries
+import smtp_filter
+import suggest
+from typing import Callable, Iterator, List, Optional, Tuple
+from itertools import islice
 from datetime import datetime
+import base64
+import heapq
 import math
 
 
@@ -16,8 +31,12 @@ def create_company(db: Session, company: schemas.CompanyCreate):
         client_id=company.client_id
     )
     db.add(db_company)
+    db.flush()
+    shards.assign(db, db_company.id)
     db.commit()
     db.refresh(db_company)
+    company_cache.catalog.add(db_company.id, db_company.name)
+    suggest.index.add_company(db_company.name)
     return db_company
 
 'buscar empresa por nombre, retorna empresa o None'
@@ -32,86 +51,531 @@ def get_companies(db: Session, skip: int = 0, limit: int = 100):
 # ============== OPERACIONES DE EMAILS ==============
 'crear email , datos de email y id de empresa emisora'
 def create_email(db: Session, email: schemas.EmailCreate, company_id: int):
-    db_email = models.Email(
-        recipient=email.recipient,
-        sender=email.sender,
-        date=email.date,
-        company_id=company_id,
-        smtp_code=email.smtp_code,
-        content=email.content
-    )
-    db.add(db_email)
+    if shards.SHARDED:
+        # Con shards el email se guarda en el archivo de su empresa
+        return shards.registry.write({company_id: email}, lambda shard_db, email: _insert_email(shard_db, email, company_id))[0]
+    return _insert_email(db, email, company_id)
+
+
+def _insert_email(db: Session, email: schemas.EmailCreate, company_id: int) -> dict:
+    body_id = bodies.store(db, [email.content])[email.content]
+    row = {
+        "recipient": email.recipient,
+        "sender": email.sender,
+        "date": partitions.naive_utc(email.date),
+        "company_id": company_id,
+        "smtp_code": email.smtp_code,
+        "body_id": body_id
+    }
+    # La fila va a la tabla emails o a la partición de su mes
+    partitions.insert_rows(db, [row])
+    rollups.add(db, [row])
+    smtp_filter.codes.add_many([email.smtp_code])
     db.commit()
-    db.refresh(db_email)
-    return db_email
+    suggest.index.add([row])
+    percolator.hub.submit([row], {email.smtp_code: email.content})
+    return row
 
-'buscar email por codigo smtp, retorna email o None'
+'buscar email por codigo smtp (en emails, cada partición y cada shard), retorna la fila o None'
 def get_email_by_smtp_code(db: Session, smtp_code: str):
-    return db.query(models.Email).filter(models.Email.smtp_code == smtp_code).first()
+    # Negativo seguro del filtro de Bloom: no se consulta la BD
+    if not smtp_filter.codes.candidates([smtp_code], db):
+        return None
+    if shards.SHARDED:
+        found = [row for row in shards.registry.scatter(None, lambda shard_db: _email_by_smtp_code(shard_db, smtp_code)) if row is not None]
+        row = found[0] if found else None
+    else:
+        row = _email_by_smtp_code(db, smtp_code)
+    smtp_filter.codes.record_confirmed(1, int(row is not None))
+    return row
 
 
-def search_emails(
+'buscar un email por id con todos sus campos (cuerpo completo), retorna el dict o None'
+def get_email(db: Session, email_id: int) -> Optional[dict]:
+    company_id = shards.company_for_id(email_id) if shards.SHARDED else None
+    if company_id is None:
+        return _email_by_id(db, email_id)
+    # El id dice en qué shard está
+    found = [email for email in shards.registry.scatter([company_id], lambda shard_db: _email_by_id(shard_db, email_id)) if email]
+    return found[0] if found else None
+
+
+def _email_by_id(db: Session, email_id: int) -> Optional[dict]:
+    names = list(EMAIL_COLUMNS)
+    for table in partitions.registry.tables(db):
+        columns = _email_columns(table)
+        row = db.execute(select(*(columns[name] for name in names)).where(table.c.id == email_id)).first()
+        if row is not None:
+            return rows_to_dicts(names, [row])[0]
+    return None
+
+
+def _email_by_smtp_code(db: Session, smtp_code: str):
+    for table in partitions.registry.tables(db):
+        row = db.execute(select(table).where(table.c.smtp_code == smtp_code)).first()
+        if row is not None:
+            return row
+    return None
+
+
+# ============== PAGINACIÓN POR CURSOR ==============
+'codificar la posición (fecha, id) del último email de la página'
+def encode_cursor(date: datetime, email_id: int) -> str:
+    raw = f"{date.isoformat()}|{email_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+'decodificar un cursor, lanza ValueError si no es válido'
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        date, email_id = raw.split("|")
+        return datetime.fromisoformat(date), int(email_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
+
+def _count_rows(db: Session, query, limit: Optional[int] = None) -> int:
+    query = query.order_by(None)
+    if limit is not None:
+        query = query.limit(limit)
+    return db.execute(select(func.count()).select_from(query.subquery())).scalar()
+
+
+def _count_plan(db: Session, queries: List, limit: Optional[int] = None) -> int:
+    """Filas de las consultas del plan (como máximo limit)"""
+    total = 0
+    for query in queries:
+        if limit is not None and total >= limit:
+            break
+        total += _count_rows(db, query, None if limit is None else limit - total)
+    return total
+
+
+def _count(count: Callable[[Optional[int]], int], with_total: schemas.TotalMode, filters_key: tuple, generation: int) -> Tuple[Optional[int], bool]:
+    """Retorna (total, es_estimado) según el modo pedido; count(limit) cuenta las filas del plan"""
+    if with_total == schemas.TotalMode.false:
+        return None, False
+    key = ("count", filters_key, with_total.value)
+    cached = search_cache.cache.get(key)
+    if cached is not None:
+        return cached
+    if with_total == schemas.TotalMode.exact:
+        result = count(None), False
+    else:
+        # Estimado: cuenta como máximo SEARCH_ESTIMATE_CAP filas (cota inferior)
+        total = count(settings.SEARCH_ESTIMATE_CAP)
+        result = total, total >= settings.SEARCH_ESTIMATE_CAP
+    search_cache.cache.put(key, result, 0, generation)
+    return result
+
+
+def _fetch_rows(db: Session, queries: List, offset: int, limit: int) -> list:
+    """Lee [offset, offset + limit) de la concatenación de las consultas del plan"""
+    rows = []
+    for query in queries:
+        if len(rows) >= limit:
+            break
+        chunk = db.execute(query.offset(offset).limit(limit - len(rows))).all()
+        if chunk or not offset:
+            offset = 0
+            rows.extend(chunk)
+        else:
+            # La página empieza en una partición más vieja: descontar las filas de esta
+            offset -= _count_rows(db, query, offset)
+    return rows
+
+
+def _fetch_page(fetch: Callable[[int, int], list], names: List[str], page: int, page_size: int, cursor: Optional[str], highlight: Optional[tuple] = None):
+    """Lee una página con fetch(offset, limit), retorna (emails, next_cursor)"""
+    next_cursor = None
+    if cursor is not None:
+        # Paginación por cursor (keyset): el plan ya filtra (fecha, id) < cursor
+        rows = fetch(0, page_size + 1)
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = encode_cursor(rows[-1].date, rows[-1].id)
+    else:
+        # Calcular paginación
+        skip = (page - 1) * page_size
+        
+        # Obtener emails de la página actual
+        rows = fetch(skip, page_size)
+    
+    return rows_to_dicts(names, rows, highlight), next_cursor
+
+
+# ============== SHARDS (EMAILS_SHARDING=company) ==============
+def _shard_company_ids(filters: dict) -> Optional[List[int]]:
+    # Con filtro de empresa solo se consultan los shards de las empresas que coinciden
+    company_name = filters.get("company_name")
+    return company_cache.catalog.ids_matching(company_name) if company_name else None
+
+
+def _count_shards(selected: List[str], filters: dict, limit: Optional[int]) -> int:
+    counts = shards.registry.scatter(
+        _shard_company_ids(filters),
+        lambda db: _count_plan(db, plan_search(db, selected, filters), limit)
+    )
+    return sum(counts)
+
+
+def _fetch_shards(selected: List[str], filters: dict, rank: bool, before, offset: int, limit: int) -> list:
+    """
+    Cada shard devuelve sus primeras offset + limit filas ya ordenadas y se mezclan por
+    (fecha, id) descendente, o por bm25 con rank (puntajes de cada shard, aproximado).
+    """
+    ranked = rank and filters.get("mode", schemas.SearchMode.substring) != schemas.SearchMode.substring
+    streams = shards.registry.scatter(
+        _shard_company_ids(filters),
+        lambda db: _fetch_rows(db, plan_search(db, selected, filters, rank, before, rank_column=ranked), 0, offset + limit)
+    )
+    if ranked:
+        merged = heapq.merge(*streams, key=lambda row: row.rank)
+    else:
+        merged = heapq.merge(*streams, key=lambda row: (row.date, row.id), reverse=True)
+    return list(islice(merged, offset, offset + limit))
+
+
+def _stream_rows(db: Session, queries: List, batch_size: int) -> Iterator:
+    for query in queries:
+        yield from db.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+
+
+def _iter_shards(selected: List[str], filters: dict, rank: bool, batch_size: int) -> Iterator[list]:
+    """Todas las filas de todos los shards mezcladas en orden, con un cursor del servidor por shard"""
+    ranked = rank and filters.get("mode", schemas.SearchMode.substring) != schemas.SearchMode.substring
+    sessions = [factory() for factory in shards.registry.targets(_shard_company_ids(filters))]
+    try:
+        streams = [
+            _stream_rows(db, plan_search(db, selected, filters, rank, rank_column=ranked), batch_size)
+            for db in sessions
+        ]
+        if ranked:
+            merged = heapq.merge(*streams, key=lambda row: row.rank)
+        else:
+            merged = heapq.merge(*streams, key=lambda row: (row.date, row.id), reverse=True)
+        while True:
+            rows = list(islice(merged, batch_size))
+            if not rows:
+                return
+            yield rows
+    finally:
+        for db in sessions:
+            db.close()
+
+
+'filas planas a dicts: sin objetos ORM ni modelos pydantic intermedios'
+def rows_to_dicts(names: List[str], rows, highlight: Optional[tuple] = None) -> List[dict]:
+    """highlight: (patrón, coincidencias, tamaño) para armar la columna snippet"""
+    emails = [dict(zip(names, row)) for row in rows]
+    if "content" in names:
+        # El cuerpo llega comprimido y solo se descomprime si se devuelve
+        for email in emails:
+            email["content"] = bodies.inflate(email["content"])
+    if "snippet" in names:
+        # Solo se descomprime hasta las coincidencias pedidas
+        for email in emails:
+            email["snippet"] = bodies.snippet(email["snippet"], *highlight)
+    if "company_name" in names:
+        for email in emails:
+            email["company_name"] = company_cache.catalog.name_for(email["company_name"])
+    return emails
+
+
+'recorrer todos los resultados de una búsqueda por bloques con un cursor del servidor por consulta del plan'
+def iter_search_results(
     db: Session,
+    fields: Optional[List[str]] = None,
+    batch_size: int = 1000,
+    rank: bool = False,
+    **filters
+) -> Iterator[List[dict]]:
+    names = resolve_fields(fields)
+    if shards.SHARDED:
+        # La mezcla entre shards ordena por fecha: se lee aunque no se exporte
+        selected = names if "date" in names else names + ["date"]
+        for rows in _iter_shards(selected, filters, rank, batch_size):
+            yield rows_to_dicts(names, rows)
+        return
+    for query in plan_search(db, names, filters, rank):
+        result = db.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+        for rows in result.partitions():
+            yield rows_to_dicts(names, rows)
+
+
+'columnas que puede devolver la búsqueda sobre una tabla de emails (emails o una partición)'
+def _email_columns(table) -> dict:
+    return {
+        "id": table.c.id,
+        "recipient": table.c.recipient,
+        "sender": table.c.sender,
+        "date": table.c.date,
+        # Se lee el id y el nombre sale del catálogo en memoria (sin JOIN)
+        "company_name": table.c.company_id.label("company_name"),
+        "smtp_code": table.c.smtp_code,
+        # Cuerpo comprimido de email_bodies (rows_to_dicts lo descomprime)
+        "content": _body_data(table).label("content"),
+        "created_at": table.c.created_at,
+        # Mismo cuerpo comprimido, del que rows_to_dicts saca solo los fragmentos
+        "snippet": _body_data(table).label("snippet"),
+    }
+
+
+def _body_data(table):
+    return select(models.EmailBody.data).where(models.EmailBody.id == table.c.body_id).scalar_subquery()
+
+
+# Columnas que puede devolver la búsqueda (parámetro fields; snippet se pide aparte)
+EMAIL_COLUMNS = {name: column for name, column in _email_columns(models.Email.__table__).items() if name != "snippet"}
+
+'validar los campos pedidos, retorna la lista en el orden de EmailResponse (id siempre incluido)'
+def resolve_fields(fields: Optional[List[str]] = None) -> List[str]:
+    if not fields:
+        return list(EMAIL_COLUMNS)
+    unknown = sorted(set(fields) - set(EMAIL_COLUMNS))
+    if unknown:
+        raise ValueError(f"Campos desconocidos: {', '.join(unknown)}")
+    return [name for name in EMAIL_COLUMNS if name in fields or name == "id"]
+
+
+'armar la consulta filtrada y ordenada de la búsqueda sobre una tabla de emails (emails o una partición)'
+def build_search_query(
+    table,
+    selected: List[str],
     content: str,
     recipient: Optional[str] = None,
     sender: Optional[str] = None,
     company_name: Optional[str] = None,
     date_from: Optional[datetime] = None,
     date_to: Optional[datetime] = None,
-    page: int = 1,
-    page_size: int = 10
+    mode: schemas.SearchMode = schemas.SearchMode.substring,
+    rank: bool = False,
+    before: Optional[Tuple[datetime, int]] = None,
+    body_matches=None
 ):
-    """Busca emails con filtros múltiples y paginación"""
-    # Query base: unir emails con companies
-    query = db.query(models.Email).join(models.Company)
+    """
+    before: posición (fecha, id) de un cursor, solo filas anteriores.
+    body_matches: CTE con los cuerpos que contienen content (modo substring), compartido
+    entre las particiones de un UNION ALL para resolverlo una sola vez.
+    """
+    columns = _email_columns(table)
+    # Query base: solo las columnas necesarias de la tabla, sin JOIN con companies
+    query = select(*(columns[name] for name in selected)).select_from(table)
     
     # FILTRO OBLIGATORIO: Contenido
-    # Busca el texto en cualquier parte del contenido
-    query = query.filter(models.Email.content.contains(content))
+    if mode == schemas.SearchMode.substring:
+        # Busca el texto en cualquier parte del contenido (cada cuerpo distinto se revisa una vez)
+        matches = select(body_matches.c.id) if body_matches is not None else bodies.matching(content)
+        query = query.where(table.c.body_id.in_(matches))
+    else:
+        # Usa el índice FTS5 (palabras, frase o prefijos), indexado por cuerpo
+        query = query.join(fts.emails_fts, fts.emails_fts.c.rowid == table.c.body_id)
+        query = query.where(fts.match(fts.build_match(content, mode)))
+        if rank:
+            query = query.order_by(fts.bm25())
     
     # FILTROS OPCIONALES
-    if recipient:
-        query = query.filter(models.Email.recipient.contains(recipient))
+    # Subcadenas de recipient/sender: candidatos desde el índice de trigramas de la tabla
+    candidates = fts.trigram_candidates({"recipient": recipient, "sender": sender}, table.name)
+    if candidates is not None:
+        query = query.where(table.c.id.in_(candidates))
+    
+    # Textos cortos (menos de 3 caracteres): LIKE sobre la columna
+    if recipient and len(recipient) < fts.MIN_TRIGRAM_LENGTH:
+        query = query.where(table.c.recipient.contains(recipient))
     
-    if sender:
-        query = query.filter(models.Email.sender.contains(sender))
+    if sender and len(sender) < fts.MIN_TRIGRAM_LENGTH:
+        query = query.where(table.c.sender.contains(sender))
     
     if company_name:
-        query = query.filter(models.Company.name.contains(company_name))
+        # Las empresas que coinciden se resuelven en el catálogo en memoria
+        company_ids = company_cache.catalog.ids_matching(company_name)
+        query = query.where(table.c.company_id.in_(company_ids))
     
     if date_from:
-        query = query.filter(models.Email.date >= date_from)
+        query = query.where(table.c.date >= date_from)
     
     if date_to:
-        query = query.filter(models.Email.date <= date_to)
-    
-    # Contar total de resultados
-    total = query.count()
-    
-    # Calcular paginación
-    total_pages = math.ceil(total / page_size) if total > 0 else 0
-    skip = (page - 1) * page_size
-    
-    # Obtener emails de la página actual
-    emails = query.offset(skip).limit(page_size).all()
-    
-    # Convertir a formato de respuesta con nombre de empresa
-    email_responses = []
-    for email in emails:
-        email_dict = {
-            "id": email.id,
-            "recipient": email.recipient,
-            "sender": email.sender,
-            "date": email.date,
-            "company_name": email.company.name,  
-            "smtp_code": email.smtp_code,
-            "content": email.content,
-            "created_at": email.created_at
+        query = query.where(table.c.date <= date_to)
+    
+    if before is not None:
+        query = query.where(tuple_(table.c.date, table.c.id) < tuple_(*before))
+    
+    # Orden estable (fecha, id) descendente
+    # En SQLite ix_emails_date ya es compuesto (date, rowid) porque id es el rowid
+    if not rank:
+        query = query.order_by(table.c.date.desc(), table.c.id.desc())
+    
+    return query
+
+
+'consultas cuyo resultado, concatenado en orden, es el resultado de la búsqueda'
+def plan_search(
+    db: Session,
+    selected: List[str],
+    filters: dict,
+    rank: bool = False,
+    before: Optional[Tuple[datetime, int]] = None,
+    rank_column: bool = False
+) -> List:
+    """
+    Solo entran las particiones que se cruzan con [date_from, date_to] (con cursor,
+    hasta la fecha del cursor). Como no se solapan, va una consulta por partición de
+    la más nueva a la más vieja y la paginación se detiene en cuanto llena la página.
+    Se mezclan en un solo UNION ALL si hay que ordenar por bm25, si entra la tabla
+    emails (sin rango) junto a particiones o en modo substring (un solo CTE de cuerpos).
+    rank_column agrega al final la columna rank (bm25) para mezclar resultados de varios shards.
+    """
+    # Las fechas con zona horaria se comparan como se guardan: sin zona, en UTC
+    filters = dict(
+        filters,
+        date_from=partitions.naive_utc(filters.get("date_from")),
+        date_to=partitions.naive_utc(filters.get("date_to"))
+    )
+    date_to = filters["date_to"]
+    if before is not None and (date_to is None or before[0] < date_to):
+        date_to = before[0]
+    selected_partitions = partitions.registry.for_search(db, filters.get("date_from"), date_to)
+    mode = filters.get("mode", schemas.SearchMode.substring)
+    
+    merge = len(selected_partitions) > 1 and (
+        rank
+        or mode == schemas.SearchMode.substring
+        or any(partition.start is None for partition in selected_partitions)
+    )
+    if not merge:
+        queries = [
+            build_search_query(partition.table, selected, rank=rank, before=before, **filters)
+            for partition in selected_partitions
+        ]
+        if rank_column:
+            queries = [query.add_columns(fts.bm25().label("rank")) for query in queries]
+        return queries
+    
+    # La fecha se lee en cada rama para ordenar el UNION ALL
+    branch_names = selected if "date" in selected else selected + ["date"]
+    body_matches = bodies.matching(filters["content"]).cte("body_matches") if mode == schemas.SearchMode.substring else None
+    branches = []
+    for partition in selected_partitions:
+        branch = build_search_query(
+            partition.table, branch_names, rank=rank, before=before, body_matches=body_matches, **filters
+        ).order_by(None)
+        if rank:
+            branch = branch.add_columns(fts.bm25().label("rank"))
+        branches.append(branch)
+    merged = union_all(*branches).subquery()
+    query = select(*(merged.c[name] for name in selected))
+    if rank:
+        if rank_column:
+            query = query.add_columns(merged.c.rank)
+        return [query.order_by(merged.c.rank)]
+    return [query.order_by(merged.c.date.desc(), merged.c.id.desc())]
+
+
+def search_emails(
+    db: Session,
+    content: str,
+    recipient: Optional[str] = None,
+    sender: Optional[str] = None,
+    company_name: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    page: int = 1,
+    page_size: int = 10,
+    mode: schemas.SearchMode = schemas.SearchMode.substring,
+    rank: bool = False,
+    cursor: Optional[str] = None,
+    with_total: schemas.TotalMode = schemas.TotalMode.exact,
+    fields: Optional[List[str]] = None,
+    snippet: bool = False,
+    snippet_matches: int = 3,
+    snippet_size: int = 160
+):
+    """
+    Busca emails con filtros múltiples y paginación.
+    Con cursor (aunque sea vacío) pagina por keyset (fecha, id) en vez de page/offset.
+    Solo lee las columnas pedidas en fields y retorna los emails como dicts planos.
+    Con snippet cada email trae fragmentos alrededor de las primeras snippet_matches
+    coincidencias en vez del cuerpo completo (salvo que fields pida content).
+    """
+    names = resolve_fields(fields)
+    highlight = None
+    if snippet:
+        names = [name for name in names if name != "content" or (fields and "content" in fields)] + ["snippet"]
+        highlight = (fts.highlight_pattern(content, mode), snippet_matches, snippet_size)
+    # La fecha se lee siempre en modo cursor (y para mezclar shards) aunque no se devuelva
+    selected = names + ["date"] if (cursor is not None or shards.SHARDED) and "date" not in names else names
+    
+    filters = {
+        "content": content,
+        "recipient": recipient,
+        "sender": sender,
+        "company_name": company_name,
+        "date_from": date_from,
+        "date_to": date_to,
+        "mode": mode
+    }
+    before = decode_cursor(cursor) if cursor else None
+    
+    # Los resultados se cachean por firma de filtros; el total se comparte entre páginas
+    generation = search_cache.cache.generation
+    filters_key = search_cache.signature(
+        content=content,
+        mode=mode.value,
+        recipient=recipient,
+        sender=sender,
+        company_name=company_name,
+        date_from=date_from,
+        date_to=date_to
+    )
+    
+    # Forma de los filtros (sin valores) para el registro de consultas lentas
+    filter_shape = slow_queries.shape(
+        mode=mode.value,
+        recipient=bool(recipient),
+        sender=bool(sender),
+        company_name=bool(company_name),
+        date_from=bool(date_from),
+        date_to=bool(date_to),
+        rank=rank,
+        paging="cursor" if cursor is not None else "offset",
+        total=with_total.value
+    )
+    with filter_shape:
+        if shards.SHARDED:
+            # Solo el shard de la empresa pedida, o todos en paralelo (scatter-gather)
+            count = lambda limit: _count_shards(selected, filters, limit)
+            fetch = lambda offset, limit: _fetch_shards(selected, filters, rank, before, offset, limit)
+        else:
+            count = lambda limit: _count_plan(db, plan_search(db, selected, filters, rank), limit)
+            fetch = lambda offset, limit: _fetch_rows(db, plan_search(db, selected, filters, rank, before), offset, limit)
+        
+        # Contar total de resultados (opcional)
+        total, total_estimated = _count(count, with_total, filters_key, generation)
+        
+        page_key = ("page", filters_key, rank, tuple(names), cursor, page, page_size, snippet_matches, snippet_size)
+        cached = search_cache.cache.get(page_key)
+        if cached is None:
+            cached = _fetch_page(fetch, names, page, page_size, cursor, highlight)
+            search_cache.cache.put(page_key, cached, search_cache.estimate_size(cached[0]), generation)
+        email_responses, next_cursor = cached
+    
+    if cursor is not None:
+        return {
+            "total": total,
+            "total_estimated": total_estimated,
+            "page_size": page_size,
+            "next_cursor": next_cursor,
+            "emails": email_responses
         }
-        email_responses.append(schemas.EmailResponse(**email_dict))
+    
+    total_pages = None
+    if total is not None:
+        total_pages = math.ceil(total / page_size) if total > 0 else 0
     
     return {
         "total": total,
+        "total_estimated": total_estimated,
         "page": page,
         "page_size": page_size,
         "total_pages": total_pages,
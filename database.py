@@ -1,22 +1,97 @@
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from concurrent.futures import Future
+import queue
+import threading
+import settings
 
 'Configuración de la base de datos SQLite'
 # URL de conexión a SQLite
 # El archivo se creará automáticamente en la carpeta del proyecto
-SQLALCHEMY_DATABASE_URL = "sqlite:///./emails.db"
+SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
+
+PRODUCTION = settings.STORAGE_PROFILE == "production"
 
 # Crear el motor de la base de datos
 # check_same_thread: False permite usar SQLite con FastAPI (múltiples hilos)
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, 
+    SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False}
 )
 
+
+# Función SQL inflate(blob): descomprime los cuerpos de email_bodies (subcadenas e índice FTS)
+def _register_functions(dbapi_connection, connection_record):
+    from bodies import inflate
+    dbapi_connection.create_function("inflate", 1, inflate, deterministic=True)
+
+
+event.listen(engine, "connect", _register_functions)
+
+
+# ============== PERFIL DE PRODUCCIÓN ==============
+def _apply_pragmas(dbapi_connection, connection_record, read_only=False):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={settings.SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT}")
+    if read_only:
+        cursor.execute("PRAGMA query_only=1")
+    cursor.close()
+
+
+def _read_only_url(url: str) -> str:
+    # Conexión URI de SQLite en modo solo lectura
+    path = make_url(url).database
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+
+if PRODUCTION:
+    event.listen(engine, "connect", _apply_pragmas)
+
+    # Conexión dedicada del hilo escritor (una sola)
+    writer_engine = create_engine(
+        SQLALCHEMY_DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=1,
+        max_overflow=0
+    )
+    event.listen(writer_engine, "connect", _apply_pragmas)
+    event.listen(writer_engine, "connect", _register_functions)
+
+    # Pool de conexiones de solo lectura: con WAL nunca esperan a un escritor
+    read_engine = create_engine(
+        _read_only_url(SQLALCHEMY_DATABASE_URL),
+        connect_args={"check_same_thread": False},
+        pool_size=settings.READ_POOL_SIZE,
+        max_overflow=0
+    )
+    event.listen(read_engine, "connect", lambda conn, record: _apply_pragmas(conn, record, read_only=True))
+    event.listen(read_engine, "connect", _register_functions)
+else:
+    writer_engine = engine
+    read_engine = engine
+
+
+'motor para otro archivo SQLite (shards por empresa) con las mismas funciones y pragmas que engine'
+def create_file_engine(url: str):
+    file_engine = create_engine(url, connect_args={"check_same_thread": False})
+    event.listen(file_engine, "connect", _register_functions)
+    if PRODUCTION:
+        event.listen(file_engine, "connect", _apply_pragmas)
+    return file_engine
+
+
 # Crear una sesión local
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+WriterSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=writer_engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 
 # Base para los modelos
 # Todos los modelos heredarán de esta clase
@@ -25,9 +100,69 @@ Base = declarative_base()
 
 # Función para obtener una sesión de base de datos
 # Se usa en cada endpoint para conectarse a la BD
+# Las escrituras de los endpoints van por run_write: en production hay un solo escritor
 def get_db():
     db = SessionLocal()
     try:
-        yield db  
+        yield db
+    finally:
+        db.close()
+
+
+# Sesión para endpoints de solo lectura (búsquedas y catálogo)
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# ============== COLA DE ESCRITURAS ==============
+class WriteQueue:
+    """Un solo hilo con su propia sesión ejecuta en orden todas las escrituras masivas"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn) -> Future:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="sqlite-writer", daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def _work(self):
+        db = WriterSessionLocal()
+        try:
+            while True:
+                fn, future = self._queue.get()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    future.set_result(fn(db))
+                except Exception as e:
+                    future.set_exception(e)
+                finally:
+                    # fn debe hacer commit; lo pendiente se descarta y la conexión queda libre
+                    db.close()
+        finally:
+            db.close()
+
+
+write_queue = WriteQueue()
+
+
+'ejecutar fn(db) como escritura (fn hace su commit): en el hilo escritor (production) o en línea con una sesión nueva'
+def run_write(fn):
+    if PRODUCTION:
+        return write_queue.submit(fn).result()
+    db = SessionLocal()
+    try:
+        return fn(db)
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
@@ -1,75 +1,160 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-import schemas, models
-from database import get_db
-import math
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+import schemas
+import columnar
+import ingest
+import responses
+import settings
+import json
+import zlib
 
 router = APIRouter()
 
 @router.post("/api/emails/bulk", response_model=schemas.EmailBulkResponse, status_code=201)
-def create_bulk_emails(bulk_data: schemas.EmailBulkCreate, db: Session = Depends(get_db)):
+def create_bulk_emails(bulk_data: schemas.EmailBulkCreate):
     """Registra múltiples emails de forma masiva"""
-    success = 0
-    failed = 0
-    errors = []
+    return responses.json_response(ingest.write_items(list(enumerate(bulk_data.emails))), status_code=201)
+
+
+# ============== INGESTA COLUMNAR (JSON POR COLUMNAS O CSV) ==============
+def _gunzip(body: bytes, limit: int) -> bytes:
+    """Descomprime un lote gzip sin pasar de limit bytes (un gzip chico no se expande a GBs)"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = decompressor.decompress(body, limit + 1)
+    if len(data) > limit:
+        raise HTTPException(status_code=413, detail=f"Lote de más de {limit} bytes descomprimido")
+    if not decompressor.eof:
+        raise ValueError("gzip incompleto")
+    return data
+
+
+@router.post("/api/emails/bulk/columnar", response_model=schemas.EmailBulkResponse, status_code=201)
+async def create_bulk_emails_columnar(request: Request):
+    """
+    Registra un lote enviado por columnas: Content-Type application/json con
+    {"recipient": [...], "sender": [...], "date": [...], "company_name": [...],
+    "smtp_code": [...], "content": [...]} o text/csv con esas columnas en el encabezado
+    (opcionalmente con Content-Encoding: gzip). Los índices de los errores son las filas del lote.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in columnar.JSON_TYPES + columnar.CSV_TYPES:
+        raise HTTPException(status_code=415, detail="Se espera Content-Type: application/json o text/csv")
+    body = await request.body()
+    try:
+        if request.headers.get("content-encoding", "").lower() == "gzip":
+            body = await run_in_threadpool(_gunzip, body, settings.COLUMNAR_MAX_BYTES)
+        items, errors = await run_in_threadpool(columnar.parse, body, content_type)
+    except (ValueError, zlib.error) as e:
+        raise HTTPException(status_code=400, detail=f"Lote inválido: {e}")
     
-    for i, email_data in enumerate(bulk_data.emails):
-        try:
-            # 1. Buscar empresa por nombre
-            empresa = db.query(models.Company).filter(
-                models.Company.name == email_data.company_name
-            ).first()
-            
-            if not empresa:
-                errors.append({
-                    "indice": i,
-                    "smtp_code": email_data.smtp_code,
-                    "error": f"Empresa no parametrizada: {email_data.company_name}"
-                })
-                failed += 1
-                continue
-            
-            # 2. Verificar que smtp_code no exista
-            existe = db.query(models.Email).filter(
-                models.Email.smtp_code == email_data.smtp_code
-            ).first()
-            
-            if existe:
-                errors.append({
-                    "indice": i,
-                    "smtp_code": email_data.smtp_code,
-                    "error": "Código SMTP duplicado"
-                })
-                failed += 1
+    report = await run_in_threadpool(ingest.write_items, items)
+    report["failed"] += len(errors)
+    report["errors"] = sorted(report["errors"] + errors, key=lambda error: error["indice"])
+    return responses.json_response(report, status_code=201)
+
+
+# ============== INGESTA EN STREAMING (NDJSON) ==============
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# Bytes descomprimidos por paso: unos KB de gzip no se expanden de una sola vez en memoria
+INFLATE_STEP = 64 * 1024
+
+
+def _inflate(decompressor, data: bytes):
+    """Descomprime data en pedazos de hasta INFLATE_STEP bytes"""
+    while data:
+        yield decompressor.decompress(data, INFLATE_STEP)
+        data = decompressor.unconsumed_tail
+
+
+async def _ndjson_lines(request: Request, gzipped: bool):
+    """Lee el cuerpo a medida que llega y entrega una línea a la vez (descomprime gzip si aplica)"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    buffer = b""
+    async for data in request.stream():
+        for piece in (_inflate(decompressor, data) if decompressor is not None else (data,)):
+            *lines, buffer = (buffer + piece).split(b"\n")
+            for line in lines:
+                yield line
+            # Se revisa en cada pedazo: una línea sin fin corta antes de crecer más
+            if len(buffer) > settings.NDJSON_MAX_LINE_BYTES:
+                raise ValueError(f"Línea de más de {settings.NDJSON_MAX_LINE_BYTES} bytes")
+    if decompressor is not None:
+        buffer += decompressor.flush()
+    yield buffer
+
+
+def _validation_error(index: int, error: ValidationError) -> dict:
+    detail = "; ".join(
+        f"{'.'.join(str(part) for part in err['loc']) or 'linea'}: {err['msg']}" for err in error.errors()
+    )
+    return {"indice": index, "smtp_code": None, "error": detail}
+
+
+def _progress(chunk: int, received: int, report: dict) -> bytes:
+    line = {"chunk": chunk, "received": received, **report}
+    return (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+async def _ingest_ndjson(request: Request, gzipped: bool, chunk_size: int):
+    """Valida e inserta por bloques mientras llega el cuerpo; emite el avance de cada bloque"""
+    chunk = 0
+    received = 0
+    totals = {"success": 0, "failed": 0}
+    items = []
+    errors = []
+
+    async def flush():
+        nonlocal chunk, items, errors
+        report = {"success": 0, "failed": 0, "errors": []}
+        if items:
+            batch = items
+            # Un bloque = una transacción (por shard con EMAILS_SHARDING=company)
+            report = await run_in_threadpool(ingest.write_items, batch, 0)
+        report["failed"] += len(errors)
+        report["errors"] = sorted(report["errors"] + errors, key=lambda error: error["indice"])
+        totals["success"] += report["success"]
+        totals["failed"] += report["failed"]
+        chunk += 1
+        items, errors = [], []
+        return _progress(chunk, received, report)
+
+    try:
+        async for line in _ndjson_lines(request, gzipped):
+            if not line.strip():
                 continue
-            
-            # 3. Crear el email
-            nuevo_email = models.Email(
-                recipient=email_data.recipient,
-                sender=email_data.sender,
-                date=email_data.date,
-                company_id=empresa.id,
-                smtp_code=email_data.smtp_code,
-                content=email_data.content
-            )
-            
-            db.add(nuevo_email)
-            db.commit()  # ← CRÍTICO: esto guarda en la BD
-            db.refresh(nuevo_email)  # Obtiene el ID generado
-            success += 1
-            
-        except Exception as e:
-            db.rollback()
-            errors.append({
-                "indice": i,
-                "smtp_code": email_data.smtp_code,
-                "error": str(e)
-            })
-            failed += 1
-    
-    return {
-        "success": success,
-        "failed": failed,
-        "errors": errors
-    }
+            index = received
+            received += 1
+            try:
+                items.append((index, schemas.EmailCreate.model_validate_json(line)))
+            except ValidationError as e:
+                errors.append(_validation_error(index, e))
+            if len(items) + len(errors) >= chunk_size:
+                yield await flush()
+        if items or errors:
+            yield await flush()
+    except (ValueError, zlib.error) as e:
+        # Cuerpo corrupto: se informa y se corta, lo ya insertado queda guardado
+        if items or errors:
+            yield await flush()
+        yield (json.dumps({"error": str(e), "received": received}, ensure_ascii=False) + "\n").encode("utf-8")
+        return
+
+    yield (json.dumps({"done": True, "received": received, **totals}) + "\n").encode("utf-8")
+
+
+@router.post("/api/emails/bulk/stream")
+async def create_bulk_emails_stream(
+    request: Request,
+    chunk_size: int = Query(settings.NDJSON_CHUNK_SIZE, ge=1, le=50000, description="Emails por bloque (una transacción por bloque)")
+):
+    """
+    Registra emails desde un cuerpo NDJSON (un EmailCreate por línea), opcionalmente con
+    Content-Encoding: gzip. Responde en NDJSON una línea de avance por bloque y una final.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in NDJSON_TYPES:
+        raise HTTPException(status_code=415, detail="Se espera Content-Type: application/x-ndjson")
+    gzipped = request.headers.get("content-encoding", "").lower() == "gzip"
+    return responses.BodyStreamingResponse(_ingest_ndjson(request, gzipped, chunk_size), media_type="application/x-ndjson")
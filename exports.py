@@ -0,0 +1,85 @@
+"""
+Exportación en streaming de los resultados de una búsqueda (CSV / NDJSON, opcionalmente gzip)
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Iterator, List
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+import crud
+import schemas
+import settings
+from database import ReadSessionLocal
+
+MEDIA_TYPES = {
+    schemas.ExportFormat.csv: "text/csv; charset=utf-8",
+    schemas.ExportFormat.ndjson: "application/x-ndjson",
+}
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _encode_csv(names: List[str], batch: List[dict], header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(names)
+    for email in batch:
+        writer.writerow([
+            email[name].isoformat() if isinstance(email[name], datetime) else email[name]
+            for name in names
+        ])
+    return buffer.getvalue().encode("utf-8")
+
+
+def _encode_ndjson(batch: List[dict]) -> bytes:
+    return "".join(
+        json.dumps(email, default=_default, ensure_ascii=False) + "\n" for email in batch
+    ).encode("utf-8")
+
+
+'bloques de bytes listos para enviar, uno por cada bloque de filas leído del cursor'
+def export_chunks(names: List[str], format: schemas.ExportFormat, gzipped: bool, **filters) -> Iterator[bytes]:
+    db = ReadSessionLocal()
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if gzipped else None
+    try:
+        header = format == schemas.ExportFormat.csv
+        if header:
+            data = _encode_csv(names, [], header=True)
+            yield compressor.compress(data) if compressor else data
+        for batch in crud.iter_search_results(db, fields=names, batch_size=settings.EXPORT_BATCH_SIZE, **filters):
+            if format == schemas.ExportFormat.csv:
+                data = _encode_csv(names, batch, header=False)
+            else:
+                data = _encode_ndjson(batch)
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                yield data
+        if compressor is not None:
+            yield compressor.flush()
+    finally:
+        db.close()
+
+
+'iterar el generador síncrono en el threadpool y cortarlo si el cliente se desconecta'
+async def until_disconnected(request: Request, chunks: Iterator[bytes]):
+    try:
+        while True:
+            if await request.is_disconnected():
+                break
+            chunk = await run_in_threadpool(next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        # Cierra el cursor y la sesión aunque la descarga quede a medias
+        await run_in_threadpool(chunks.close)
@@ -0,0 +1,223 @@
+"""
+Índices de texto (SQLite FTS5) sobre la tabla emails
+
+- emails_fts: palabras de cada cuerpo distinto de email_bodies (búsqueda por token, frase o prefijo)
+- email_bodies_trigram: trigramas de cada cuerpo distinto (búsqueda por subcadena sin descomprimir
+  los cuerpos). Opt-in con EMAILS_BODY_TRIGRAM_INDEX=1: ocupa más que los cuerpos comprimidos
+  (una BD de 81 MB pasa a 173 MB) y casi duplica el tiempo de carga; sin él la subcadena
+  descomprime cada cuerpo distinto una vez por búsqueda
+- emails_trigram: trigramas de recipient y sender (filtros de subcadena sin recorrer la tabla)
+  Cada partición mensual (partitions.py) tiene el suyo: emails_p202412_trigram
+
+Uso por consola para reconstruir los índices de una BD existente:
+    python fts.py rebuild
+"""
+
+import re
+from sqlalchemy import column, func, literal_column, select, table, text
+from sqlalchemy.engine import Engine
+from typing import Dict, Iterable, Optional
+import schemas
+import settings
+
+FTS_TABLE = "emails_fts"
+TRIGRAM_TABLE = "emails_trigram"
+BODY_TRIGRAM_TABLE = "email_bodies_trigram"
+
+'índice de trigramas de una tabla de emails (emails o una partición), rowid = id del email'
+def trigram_table(source: str) -> str:
+    return TRIGRAM_TABLE if source == "emails" else f"{source}_trigram"
+
+
+def _trigram_spec(source: str):
+    return (source, ("recipient", "sender"), {"recipient": "{row}.recipient", "sender": "{row}.sender"}, "trigram")
+
+
+# Por cada tabla virtual: (tabla origen, columnas origen, {columna indexada: expresión sobre la fila}, tokenizador)
+_INDEXES = {
+    # rowid = email_bodies.id, el texto se descomprime al indexar (función SQL inflate)
+    FTS_TABLE: ("email_bodies", ("data",), {"content": "inflate({row}.data)"}, "unicode61 remove_diacritics 2"),
+    TRIGRAM_TABLE: _trigram_spec("emails"),
+}
+if settings.BODY_TRIGRAM_INDEX:
+    _INDEXES[BODY_TRIGRAM_TABLE] = ("email_bodies", ("data",), {"content": "inflate({row}.data)"}, "trigram")
+
+# El tokenizador trigram no puede buscar textos de menos de 3 caracteres
+MIN_TRIGRAM_LENGTH = 3
+
+# Tablas virtuales sin contenido propio (content=''): solo guardan el índice invertido
+emails_fts = table(FTS_TABLE, column("rowid"))
+
+
+def _create_table(name: str, spec) -> str:
+    _, _, columns, tokenize = spec
+    return f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(
+        {", ".join(columns)},
+        content='',
+        tokenize='{tokenize}'
+    )
+    """
+
+
+def _create_triggers(name: str, spec):
+    """Triggers que mantienen el índice sincronizado con su tabla origen"""
+    source, source_columns, columns, _ = spec
+    names = ", ".join(columns)
+    new = ", ".join(expression.format(row="new") for expression in columns.values())
+    old = ", ".join(expression.format(row="old") for expression in columns.values())
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {source} BEGIN
+            INSERT INTO {name}(rowid, {names}) VALUES (new.id, {new});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {source} BEGIN
+            INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.id, {old});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {", ".join(source_columns)} ON {source} BEGIN
+            INSERT INTO {name}({name}, rowid, {names}) VALUES ('delete', old.id, {old});
+            INSERT INTO {name}(rowid, {names}) VALUES (new.id, {new});
+        END
+        """,
+    ]
+
+
+'crear las tablas FTS y sus triggers si no existen, la primera vez indexa los emails existentes'
+def ensure_fts(engine: Engine):
+    with engine.begin() as conn:
+        for name, spec in _INDEXES.items():
+            _ensure_index(conn, name, spec)
+        if not settings.BODY_TRIGRAM_INDEX:
+            # Desactivado después de usarlo: sin sus triggers la ingesta no lo mantiene (VACUUM devuelve el espacio)
+            drop_index(conn, BODY_TRIGRAM_TABLE)
+
+
+'crear el índice de trigramas de una partición (dentro de la transacción que la crea)'
+def ensure_trigram(conn, source: str):
+    _ensure_index(conn, trigram_table(source), _trigram_spec(source))
+
+
+def _ensure_index(conn, name: str, spec):
+    exists = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": name}
+    ).first()
+    conn.execute(text(_create_table(name, spec)))
+    for trigger in _create_triggers(name, spec):
+        conn.execute(text(trigger))
+    if not exists:
+        _backfill(conn, name, spec)
+
+
+def _backfill(conn, name: str, spec):
+    source, _, columns, _ = spec
+    names = ", ".join(columns)
+    expressions = ", ".join(expression.format(row=source) for expression in columns.values())
+    conn.execute(text(f"INSERT INTO {name}({name}) VALUES ('delete-all')"))
+    conn.execute(text(f"INSERT INTO {name}(rowid, {names}) SELECT id, {expressions} FROM {source}"))
+    conn.execute(text(f"INSERT INTO {name}({name}) VALUES ('optimize')"))
+
+
+'borrar una tabla FTS y sus triggers (ensure_fts la vuelve a crear e indexar)'
+def drop_index(conn, name: str):
+    for suffix in ("ai", "ad", "au"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}_{suffix}"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+
+
+'reconstruir los índices completos desde sus tablas origen (sources: particiones con su índice de trigramas)'
+def rebuild(engine: Engine, sources: Iterable[str] = ()):
+    ensure_fts(engine)
+    with engine.begin() as conn:
+        for name, spec in _INDEXES.items():
+            _backfill(conn, name, spec)
+        for source in sources:
+            ensure_trigram(conn, source)
+            _backfill(conn, trigram_table(source), _trigram_spec(source))
+
+
+def _quote(term: str) -> str:
+    # Cadena FTS5 entre comillas: los operadores del usuario se tratan como texto
+    return '"' + term.replace('"', '""') + '"'
+
+
+'convertir el texto buscado en una expresión MATCH de FTS5 según el modo'
+def build_match(term: str, mode: schemas.SearchMode) -> str:
+    if mode == schemas.SearchMode.phrase:
+        return _quote(term.strip())
+    tokens = term.split()
+    if mode == schemas.SearchMode.prefix:
+        return " ".join(_quote(token) + "*" for token in tokens)
+    return " ".join(_quote(token) for token in tokens)
+
+
+'expresión regular que marca en el texto lo que encontró la búsqueda según el modo (fragmentos)'
+def highlight_pattern(term: str, mode: schemas.SearchMode) -> re.Pattern:
+    """Aproximación en Python del criterio de cada modo: sin distinguir mayúsculas y sin quitar acentos"""
+    tokens = [re.escape(token) for token in term.split()]
+    if mode == schemas.SearchMode.substring or not tokens:
+        return re.compile(re.escape(term), re.IGNORECASE)
+    if mode == schemas.SearchMode.phrase:
+        return re.compile(r"\b" + r"\W+".join(tokens) + r"\b", re.IGNORECASE)
+    suffix = r"\w*" if mode == schemas.SearchMode.prefix else r"\b"
+    return re.compile(r"\b(?:" + "|".join(tokens) + ")" + suffix, re.IGNORECASE)
+
+
+'condición MATCH sobre el índice'
+def match(expression: str):
+    return literal_column(FTS_TABLE).op("MATCH")(expression)
+
+
+'relevancia bm25 (menor = más relevante)'
+def bm25():
+    return func.bm25(literal_column(FTS_TABLE))
+
+
+'subconsulta de candidatos (rowid) por subcadena en recipient/sender, None si ningún texto sirve'
+def trigram_candidates(filters: Dict[str, Optional[str]], source: str = "emails"):
+    """
+    Todos los filtros van en un solo MATCH: la intersección la resuelve el índice
+    antes de mirar la tabla source. Los textos de menos de 3 caracteres se ignoran
+    (el llamador los sigue filtrando con LIKE).
+    """
+    terms = [
+        f"{name} : {_quote(value)}"
+        for name, value in filters.items()
+        if value and len(value) >= MIN_TRIGRAM_LENGTH
+    ]
+    if not terms:
+        return None
+    expression = " AND ".join(terms)
+    name = trigram_table(source)
+    return select(table(name, column("rowid")).c.rowid).where(literal_column(name).op("MATCH")(expression))
+
+
+'subconsulta con los ids de los cuerpos que contienen term (de 3 caracteres o más) según el índice de trigramas'
+def body_candidates(term: str):
+    index = table(BODY_TRIGRAM_TABLE, column("rowid"))
+    return select(index.c.rowid.label("id")).where(literal_column(BODY_TRIGRAM_TABLE).op("MATCH")(_quote(term)))
+
+
+if __name__ == "__main__":
+    import argparse
+    import models
+    import partitions
+    import shards
+    from sqlalchemy.orm import Session
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de los índices FTS5 de emails")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    # Con shards por empresa cada archivo tiene sus índices
+    for target in [engine] + (shards.registry.engines() if shards.SHARDED else []):
+        with Session(target) as db:
+            sources = [table.name for table in partitions.registry.tables(db) if table.name != "emails"]
+        rebuild(target, sources)
+    print("Índices FTS reconstruidos")
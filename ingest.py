@@ -0,0 +1,317 @@
+"""
+Motor de ingesta masiva de emails basado en conjuntos
+"""
+
+import time
+import uuid
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import schemas
+import bodies
+import partitions
+import percolator
+import rollups
+import company_cache
+import metrics
+import models
+import search_cache
+import settings
+import shards
+import smtp_filter
+import suggest
+from database import run_write
+
+# Máximo de parámetros por consulta IN (...)
+# SQLite antiguo limita a 999 variables por sentencia
+IN_CHUNK_SIZE = 500
+
+DUPLICATE = "Código SMTP duplicado"
+
+
+def _chunks(items: Sequence, size: int):
+    for start in range(0, len(items), size):
+        yield start, items[start:start + size]
+
+
+'resolver todas las empresas del lote con el catálogo en memoria (sin SQL), retorna {nombre: id}'
+def resolve_companies(names: Iterable[str]) -> Dict[str, int]:
+    return company_cache.catalog.ids_by_name(names)
+
+
+'buscar que codigos smtp ya existen en la BD (emails y cada partición), retorna el conjunto de codigos existentes'
+def existing_smtp_codes(db: Session, codes: Iterable[str]) -> Set[str]:
+    # Los negativos seguros del filtro de Bloom no se consultan en la BD
+    codes = smtp_filter.codes.candidates(set(codes), db)
+    found = _existing_in(db, codes) if codes else set()
+    smtp_filter.codes.record_confirmed(len(codes), len(found))
+    return found
+
+
+def _existing_in(db: Session, codes: Sequence[str]) -> Set[str]:
+    found = set()
+    for table in partitions.registry.tables(db):
+        for _, chunk in _chunks(codes, IN_CHUNK_SIZE):
+            rows = db.execute(select(table.c.smtp_code).where(table.c.smtp_code.in_(chunk)))
+            found.update(code for (code,) in rows)
+    return found
+
+
+def _error(index: int, smtp_code: str, message: str) -> dict:
+    return {"indice": index, "smtp_code": smtp_code, "error": message}
+
+
+def _validate_chunk(db: Session, items: Sequence[Tuple[int, schemas.EmailCreate]]):
+    """
+    Valida un bloque contra el catálogo y los códigos existentes, retorna (filas, errores,
+    contenidos): contenidos es {smtp_code: contenido} solo de las filas aceptadas (un
+    repetido rechazado en el mismo lote no pisa el contenido del que sí se inserta).
+    """
+    companies = resolve_companies(email.company_name for _, email in items)
+    # Con shards los códigos ya se reservaron en smtp_codes (write_items): solo queda el índice único del shard
+    existing = set() if shards.SHARDED else existing_smtp_codes(db, (email.smtp_code for _, email in items))
+
+    accepted = []
+    errors = []
+    seen = set()
+    for index, email in items:
+        company_id = companies.get(email.company_name)
+        if company_id is None:
+            errors.append(_error(index, email.smtp_code, f"Empresa no parametrizada: {email.company_name}"))
+            continue
+        if email.smtp_code in existing:
+            errors.append(_error(index, email.smtp_code, DUPLICATE))
+            continue
+        if email.smtp_code in seen:
+            errors.append(_error(index, email.smtp_code, "Código SMTP duplicado en el lote"))
+            continue
+        seen.add(email.smtp_code)
+        accepted.append((index, email, company_id))
+    
+    # Cada contenido distinto se guarda comprimido una sola vez (email_bodies)
+    body_ids = bodies.store(db, (email.content for _, email, _ in accepted))
+    rows = [
+        (index, {
+            "recipient": email.recipient,
+            "sender": email.sender,
+            "date": partitions.naive_utc(email.date),
+            "company_id": company_id,
+            "smtp_code": email.smtp_code,
+            "body_id": body_ids[email.content],
+        })
+        for index, email, company_id in accepted
+    ]
+    contents = {email.smtp_code: email.content for _, email, _ in accepted}
+    return rows, errors, contents
+
+
+def _insert_one_by_one(db: Session, rows: List[tuple]) -> List[dict]:
+    """Camino lento: inserta fila por fila con savepoints (solo si otro escritor ganó la carrera)"""
+    errors = []
+    for index, row in rows:
+        try:
+            with db.begin_nested():
+                partitions.insert_rows(db, [row])
+        except IntegrityError:
+            errors.append(_error(index, row["smtp_code"], DUPLICATE))
+    return errors
+
+
+'registrar un bloque de pares (indice, email) en una sola transacción, retorna su reporte'
+def ingest_chunk(
+    db: Session,
+    items: Sequence[Tuple[int, schemas.EmailCreate]],
+    before_commit: Optional[Callable[[Session, dict], None]] = None
+) -> dict:
+    """
+    before_commit(db, reporte) se ejecuta dentro de la misma transacción que los INSERT
+    (por ejemplo para guardar el avance de un trabajo de importación).
+    """
+    started = time.perf_counter()
+    inserted = []
+    contents = {}
+    try:
+        rows, errors, contents = _validate_chunk(db, items)
+        if rows:
+            try:
+                # Un solo executemany para todas las filas válidas del bloque
+                with db.begin_nested():
+                    partitions.insert_rows(db, [row for _, row in rows])
+            except IntegrityError:
+                # Otro proceso insertó alguno de los códigos entre la validación y el INSERT
+                # (el savepoint conserva los cuerpos ya guardados en la transacción)
+                errors.extend(_insert_one_by_one(db, rows))
+            # Acumulados de las estadísticas, en la misma transacción que los INSERT
+            failed = {error["indice"] for error in errors}
+            inserted = [row for index, row in rows if index not in failed]
+            rollups.add(db, inserted)
+            # Antes del commit: si la transacción se revierte solo quedan falsos positivos
+            smtp_filter.codes.add_many(row["smtp_code"] for row in inserted)
+        report = _report(items, errors)
+        if before_commit is not None:
+            before_commit(db, report)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        report = _report(items, [_error(index, email.smtp_code, str(e)) for index, email in items])
+        if before_commit is not None:
+            before_commit(db, report)
+            db.commit()
+        metrics.record_ingest(0, report["failed"], time.perf_counter() - started)
+        return report
+
+    metrics.record_ingest(report["success"], report["failed"], time.perf_counter() - started)
+    # Después del commit: el autocompletado y las búsquedas guardadas solo ven emails confirmados
+    suggest.index.add(inserted)
+    percolator.hub.submit(inserted, contents)
+    if report["success"]:
+        # Hay emails nuevos: las búsquedas cacheadas quedan viejas
+        search_cache.cache.invalidate()
+    return report
+
+
+def _report(items: Sequence, errors: List[dict]) -> dict:
+    errors.sort(key=lambda error: error["indice"])
+    return {"success": len(items) - len(errors), "failed": len(errors), "errors": errors}
+
+
+'registrar un lote de emails, retorna el reporte de EmailBulkResponse'
+def ingest_emails(
+    db: Session,
+    emails: Sequence[schemas.EmailCreate],
+    chunk_size: Optional[int] = None,
+    start_index: int = 0
+) -> dict:
+    return ingest_items(db, list(enumerate(emails, start_index)), chunk_size)
+
+
+'registrar pares (indice, email) ya validados, retorna el reporte de EmailBulkResponse'
+def ingest_items(db: Session, items: Sequence[Tuple[int, schemas.EmailCreate]], chunk_size: Optional[int] = None) -> dict:
+    """
+    Inserta el lote por bloques: una consulta para las empresas, una (por bloques IN)
+    para los smtp_code y un executemany por bloque dentro de una transacción.
+    chunk_size = 0 procesa todo el lote en una sola transacción. Los emails pueden ser
+    EmailCreate o cualquier objeto con sus campos (columnar.EmailRow).
+    """
+    if chunk_size is None:
+        chunk_size = settings.INGEST_CHUNK_SIZE
+    if chunk_size <= 0:
+        chunk_size = max(len(items), 1)
+
+    result = {"success": 0, "failed": 0, "errors": []}
+    for _, chunk in _chunks(items, chunk_size):
+        report = ingest_chunk(db, chunk)
+        result["success"] += report["success"]
+        result["failed"] += report["failed"]
+        result["errors"].extend(report["errors"])
+    return result
+
+
+# ============== REGISTRO GLOBAL CON SHARDS ==============
+'reservar códigos en smtp_codes a nombre de owner, retorna (los que tiene otro dueño, los que ya tenía owner)'
+def _reserve_codes(db: Session, codes: Sequence[str], owner: str) -> Tuple[Set[str], Set[str]]:
+    registry = models.SmtpCode
+    taken, resumed = set(), set()
+    # Dos parámetros por fila
+    for _, chunk in _chunks(codes, IN_CHUNK_SIZE // 2):
+        reserved = set(db.execute(
+            insert(registry)
+            .values([{"code": code, "owner": owner} for code in chunk])
+            .on_conflict_do_nothing()
+            .returning(registry.code)
+        ).scalars())
+        rest = [code for code in chunk if code not in reserved]
+        if rest:
+            mine = set(db.execute(select(registry.code).where(registry.code.in_(rest), registry.owner == owner)).scalars())
+            resumed.update(mine)
+            taken.update(code for code in rest if code not in mine)
+    db.commit()
+    return taken, resumed
+
+
+def _release_codes(db: Session, codes: Sequence[str], owner: str):
+    registry = models.SmtpCode
+    for _, chunk in _chunks(codes, IN_CHUNK_SIZE):
+        db.execute(delete(registry).where(registry.code.in_(chunk), registry.owner == owner))
+    db.commit()
+
+
+'registrar pares (indice, email) en la BD que corresponde, retorna el reporte de EmailBulkResponse'
+def write_items(
+    items: Sequence[Tuple[int, schemas.EmailCreate]],
+    chunk_size: Optional[int] = None,
+    before_commit: Optional[Callable[[Session, dict], None]] = None,
+    owner: Optional[str] = None
+) -> dict:
+    """
+    Sin shards: en el escritor de la BD principal (run_write); con before_commit todo el
+    lote es un bloque y before_commit va en la misma transacción que los INSERT.
+    Con shards (EMAILS_SHARDING=company): primero reserva los códigos en smtp_codes de la
+    BD principal (la unicidad entre shards), agrupa por empresa y escribe cada grupo en su
+    shard en paralelo; los códigos que no se insertaron se liberan y before_commit corre
+    en la BD principal cuando todos confirmaron.
+
+    owner identifica la reserva (el id del trabajo): si el proceso se corta entre el commit
+    de los shards y before_commit, al retomar los códigos reservados por el mismo owner que
+    ya están en su shard cuentan como registrados y no como duplicados. Una escritura sin
+    owner que se corta entre la reserva y el commit de su shard deja esos códigos reservados
+    sin fila (se reportan como duplicados).
+    """
+    if not shards.SHARDED:
+        if before_commit is not None:
+            return run_write(lambda db: ingest_chunk(db, items, before_commit=before_commit))
+        return run_write(lambda db: ingest_items(db, items, chunk_size))
+
+    companies = resolve_companies(email.company_name for _, email in items)
+    groups: Dict[int, list] = {}
+    errors = []
+    seen = set()
+    for index, email in items:
+        company_id = companies.get(email.company_name)
+        if company_id is None:
+            errors.append(_error(index, email.smtp_code, f"Empresa no parametrizada: {email.company_name}"))
+        elif email.smtp_code in seen:
+            # Los grupos se validan por separado: el repetido entre empresas se resuelve acá
+            errors.append(_error(index, email.smtp_code, "Código SMTP duplicado en el lote"))
+        else:
+            seen.add(email.smtp_code)
+            groups.setdefault(company_id, []).append((index, email))
+
+    owner = owner or str(uuid.uuid4())
+    taken, resumed = run_write(lambda db: _reserve_codes(db, list(seen), owner))
+    if taken:
+        for company_id in list(groups):
+            kept = []
+            for index, email in groups[company_id]:
+                if email.smtp_code in taken:
+                    errors.append(_error(index, email.smtp_code, DUPLICATE))
+                else:
+                    kept.append((index, email))
+            if kept:
+                groups[company_id] = kept
+            else:
+                del groups[company_id]
+
+    reports = shards.registry.write(groups, lambda db, group: ingest_items(db, group, chunk_size))
+    released = []
+    for report in reports:
+        for error in report["errors"]:
+            code = error["smtp_code"]
+            if code not in resumed:
+                released.append(code)
+            elif error["error"] == DUPLICATE:
+                # Lo guardó un intento anterior del mismo trabajo
+                continue
+            errors.append(error)
+    if released:
+        run_write(lambda db: _release_codes(db, released, owner))
+    report = _report(items, errors)
+
+    if before_commit is not None:
+        def record(db: Session):
+            before_commit(db, report)
+            db.commit()
+        run_write(record)
+    return report
@@ -0,0 +1,318 @@
+"""
+Trabajos de importación masiva en segundo plano
+
+El POST guarda el lote en la tabla import_jobs y responde de inmediato con el id del trabajo.
+Un pool de hilos locales procesa la cola por bloques; el avance de cada bloque se guarda en la
+misma transacción que sus INSERT, así un trabajo interrumpido continúa donde quedó al reiniciar.
+
+Con varios procesos (workers de uvicorn) cada trabajo se reclama con un UPDATE condicional
+(claimed_by, lease_until): solo un proceso lo ejecuta. Cada bloque renueva el reclamo por
+EMAILS_JOBS_LEASE_SECONDS; al arrancar se retoman los encolados y los que están en curso con
+el reclamo vencido (su proceso murió). Un proceso que perdió el reclamo se detiene sin
+confirmar el bloque.
+"""
+
+import logging
+import os
+import queue
+import socket
+import threading
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, func, insert, inspect, or_, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from typing import Optional
+import schemas, models
+from database import ReadSessionLocal, SessionLocal, get_read_db, run_write
+import ingest
+import settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Estados de un trabajo
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class BacklogFull(Exception):
+    """La cola de trabajos está llena"""
+
+
+class LeaseLost(Exception):
+    """Otro proceso retomó el trabajo (el reclamo de este venció)"""
+
+
+# Identidad de este proceso en claimed_by
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobQueue:
+    """Cola acotada de ids de trabajo drenada por un pool de hilos"""
+
+    def __init__(self, workers: int, max_backlog: int):
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self._queue = queue.Queue()
+        self._backlog = 0  # trabajos encolados que ningún hilo tomó todavía
+        self._lock = threading.Lock()
+        self._threads = []
+
+    @property
+    def backlog(self) -> int:
+        return self._backlog
+
+    def start(self):
+        """Arranca los hilos y reencola los trabajos que quedaron pendientes en la BD"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"import-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for job_id in _pending_jobs():
+            self._put(job_id)
+
+    def stop(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(self, job_id: str):
+        """Encola un trabajo nuevo, lanza BacklogFull si ya hay max_backlog esperando"""
+        with self._lock:
+            if self._backlog >= self.max_backlog:
+                raise BacklogFull()
+        self._put(job_id)
+
+    def reserve(self) -> bool:
+        """True si hay lugar en la cola (para no guardar un trabajo que se va a rechazar)"""
+        with self._lock:
+            return self._backlog < self.max_backlog
+
+    def _put(self, job_id: str):
+        with self._lock:
+            self._backlog += 1
+        self._queue.put(job_id)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            with self._lock:
+                self._backlog -= 1
+            try:
+                run_job(job_id)
+            except Exception:
+                logger.exception("Error procesando el trabajo %s", job_id)
+
+
+worker_pool = JobQueue(workers=settings.JOBS_WORKERS, max_backlog=settings.JOBS_MAX_BACKLOG)
+
+
+def _claimable(now: datetime):
+    # Encolado, o en curso con el reclamo vencido (sin reclamo: de antes de las columnas)
+    job = models.ImportJob
+    return or_(
+        job.status == QUEUED,
+        and_(job.status == RUNNING, or_(job.lease_until.is_(None), job.lease_until < now))
+    )
+
+
+def _pending_jobs():
+    db = SessionLocal()
+    try:
+        jobs = (
+            db.query(models.ImportJob.id)
+            .filter(_claimable(datetime.utcnow()))
+            .order_by(models.ImportJob.created_at)
+            .all()
+        )
+        return [job_id for (job_id,) in jobs]
+    finally:
+        db.close()
+
+
+'agregar claimed_by y lease_until a una tabla import_jobs anterior'
+def ensure_columns(engine: Engine):
+    with engine.begin() as conn:
+        columns = {column["name"] for column in inspect(conn).get_columns("import_jobs")}
+        for name, ddl in (("claimed_by", "VARCHAR(100)"), ("lease_until", "DATETIME")):
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE import_jobs ADD COLUMN {name} {ddl}"))
+
+
+# ============== PROCESAMIENTO ==============
+'crear un trabajo con el lote comprimido, retorna el trabajo guardado'
+def create_job(bulk_data: schemas.EmailBulkCreate) -> models.ImportJob:
+    # Todos los campos se fijan acá: el trabajo se usa después sin releer el lote comprimido
+    job = models.ImportJob(
+        id=str(uuid.uuid4()),
+        status=QUEUED,
+        total=len(bulk_data.emails),
+        processed=0,
+        success=0,
+        failed=0,
+        payload=zlib.compress(bulk_data.model_dump_json().encode("utf-8")),
+        error=None,
+        created_at=datetime.utcnow(),
+        started_at=None,
+        finished_at=None
+    )
+
+    def write(db: Session):
+        db.add(job)
+        db.flush()
+        db.expunge(job)
+        db.commit()
+
+    run_write(write)
+    return job
+
+
+def _lease() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=settings.JOBS_LEASE_SECONDS)
+
+
+'reclamar un trabajo para este proceso, retorna False si otro ya lo tiene o ya terminó'
+def _claim(job_id: str) -> bool:
+    def write(db: Session) -> bool:
+        now = datetime.utcnow()
+        job = models.ImportJob
+        result = db.execute(
+            update(job)
+            .where(job.id == job_id, _claimable(now))
+            .values(status=RUNNING, claimed_by=WORKER_ID, lease_until=_lease(), started_at=func.coalesce(job.started_at, now))
+        )
+        db.commit()
+        return result.rowcount == 1
+    return run_write(write)
+
+
+def _record_progress(job_id: str, processed: int):
+    """Guarda el avance del bloque en la misma transacción que sus INSERT (con shards, apenas confirman)"""
+    def record(db: Session, report: dict):
+        # Solo si el trabajo sigue siendo de este proceso; si no, el bloque se revierte
+        updated = db.query(models.ImportJob).filter(
+            models.ImportJob.id == job_id,
+            models.ImportJob.claimed_by == WORKER_ID
+        ).update({
+            models.ImportJob.processed: models.ImportJob.processed + processed,
+            models.ImportJob.success: models.ImportJob.success + report["success"],
+            models.ImportJob.failed: models.ImportJob.failed + report["failed"],
+            models.ImportJob.lease_until: _lease(),
+        }, synchronize_session=False)
+        if not updated:
+            raise LeaseLost(job_id)
+        if report["errors"]:
+            db.execute(insert(models.ImportJobError), [
+                {"job_id": job_id, "indice": e["indice"], "smtp_code": e["smtp_code"], "error": e["error"]}
+                for e in report["errors"]
+            ])
+    return record
+
+
+'procesar un trabajo desde el último bloque confirmado'
+def run_job(job_id: str):
+    if not _claim(job_id):
+        return
+    
+    try:
+        with ReadSessionLocal() as db:
+            payload, processed = db.execute(
+                select(models.ImportJob.payload, models.ImportJob.processed).where(models.ImportJob.id == job_id)
+            ).one()
+        emails = schemas.EmailBulkCreate.model_validate_json(zlib.decompress(payload)).emails
+        chunk_size = max(settings.JOBS_CHUNK_SIZE, 1)
+        for offset in range(processed, len(emails), chunk_size):
+            chunk = emails[offset:offset + chunk_size]
+            items = list(enumerate(chunk, offset))
+            record = _record_progress(job_id, len(chunk))
+            ingest.write_items(items, before_commit=record, owner=job_id)
+        status, error = DONE, None
+    except LeaseLost:
+        logger.warning("El trabajo %s lo retomó otro proceso", job_id)
+        return
+    except Exception as e:
+        status, error = FAILED, str(e)
+    
+    def finish(db: Session):
+        db.query(models.ImportJob).filter(
+            models.ImportJob.id == job_id,
+            models.ImportJob.claimed_by == WORKER_ID
+        ).update({
+            models.ImportJob.status: status,
+            models.ImportJob.error: error,
+            models.ImportJob.payload: None,
+            models.ImportJob.finished_at: datetime.utcnow(),
+            models.ImportJob.lease_until: None,
+        }, synchronize_session=False)
+        db.commit()
+    run_write(finish)
+
+
+# ============== ENDPOINTS ==============
+def _job_response(db: Optional[Session], job: models.ImportJob, errors_offset: int = 0, errors_limit: int = 0) -> dict:
+    errors = []
+    if errors_limit:
+        errors = [
+            {"indice": e.indice, "smtp_code": e.smtp_code, "error": e.error}
+            for e in db.query(models.ImportJobError)
+            .filter(models.ImportJobError.job_id == job.id)
+            .order_by(models.ImportJobError.indice)
+            .offset(errors_offset)
+            .limit(errors_limit)
+        ]
+    return {
+        "id": job.id,
+        "status": job.status,
+        "total": job.total,
+        "processed": job.processed,
+        "success": job.success,
+        "failed": job.failed,
+        "error": job.error,
+        "errors": errors,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+@router.post("/api/emails/bulk/jobs", response_model=schemas.ImportJobResponse, status_code=202)
+def create_bulk_emails_job(bulk_data: schemas.EmailBulkCreate):
+    """Encola un registro masivo y responde de inmediato con el id del trabajo"""
+    if not worker_pool.reserve():
+        raise HTTPException(status_code=429, detail="Demasiados trabajos en cola, intente más tarde")
+    job = create_job(bulk_data)
+    try:
+        worker_pool.submit(job.id)
+    except BacklogFull:
+        def delete(db: Session):
+            db.query(models.ImportJob).filter(models.ImportJob.id == job.id).delete(synchronize_session=False)
+            db.commit()
+        run_write(delete)
+        raise HTTPException(status_code=429, detail="Demasiados trabajos en cola, intente más tarde")
+    return _job_response(None, job)
+
+
+@router.get("/api/jobs/{job_id}", response_model=schemas.ImportJobResponse)
+def get_job(
+    job_id: str,
+    errors_offset: int = Query(0, ge=0, description="Desde qué error devolver"),
+    errors_limit: int = Query(100, ge=0, le=10000, description="Cantidad máxima de errores a devolver"),
+    db: Session = Depends(get_read_db)
+):
+    """Estado, avance y errores de un trabajo de importación"""
+    job = db.get(models.ImportJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Trabajo '{job_id}' no encontrado")
+    return _job_response(db, job, errors_offset, errors_limit)
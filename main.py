@@ -1,27 +1,75 @@
 
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Union
 from datetime import datetime
+from contextlib import asynccontextmanager
 
 import emails
+import bodies
 import companies
+import exports
+import company_cache
+import jobs
+import metrics
+import percolator
 import models
 import schemas
 import crud
-from database import engine, get_db
+import fts
+import partitions
+import responses
+import rollups
+import search_cache
+import settings
+import shards
+import slow_queries
+import smtp_filter
+import stats
+import suggest
+from database import engine, read_engine, writer_engine, get_db, get_read_db
 
 
 'Archivo principal de la aplicación FastAPI'
 # Crear las tablas en la base de datos
 models.Base.metadata.create_all(bind=engine)
+# BD anterior al reclamo de los trabajos de importación: agregar sus columnas
+jobs.ensure_columns(engine)
+# BD anterior a email_bodies: mover los contenidos a la tabla comprimida (una sola vez)
+if bodies.needs_migration(engine):
+    bodies.migrate(engine)
+# Crear el índice de texto completo (FTS5) y sus triggers
+fts.ensure_fts(engine)
+# Registro global de smtp_code (particiones mensuales) para una BD que ya tenía emails
+partitions.ensure_codes(engine)
+# Acumulados de las estadísticas de una BD que ya tenía emails
+rollups.ensure(engine)
+# Con shards por empresa: abrir (y crear si faltan) los archivos de cada empresa
+if shards.SHARDED:
+    shards.registry.load()
+    # Registro global de smtp_code de una BD que ya tenía emails en los shards
+    shards.ensure_codes()
+
+# Arranque y apagado: catálogo de empresas en memoria, filtro de smtp_code, índice de sugerencias, búsquedas guardadas e hilos de los trabajos de importación
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    company_cache.catalog.start(settings.COMPANY_CACHE_REVALIDATE_SECONDS)
+    smtp_filter.codes.start()
+    suggest.index.start()
+    percolator.hub.start()
+    jobs.worker_pool.start()
+    yield
+    jobs.worker_pool.stop()
+    company_cache.catalog.stop()
 
 # Crear la aplicación FastAPI
 app = FastAPI(
     title="Email Filter API",
     description="API para registrar y buscar emails de forma masiva",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configurar CORS para permitir peticiones desde el frontend
@@ -33,9 +81,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresión br/gzip de las respuestas grandes (EMAILS_COMPRESSION_MIN_BYTES=0 la desactiva)
+if settings.COMPRESSION_MIN_BYTES > 0:
+    app.add_middleware(
+        responses.CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MIN_BYTES,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY
+    )
+
+# Métricas de rendimiento por request (EMAILS_METRICS_ENABLED=0 las desactiva)
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+    metrics.instrument_engines(engine, read_engine, writer_engine)
+
+# Registro de consultas lentas (EMAILS_SLOW_QUERY_ENABLED=1 lo activa)
+slow_queries.instrument_engines(engine, read_engine, writer_engine)
+
 # Registrar routers
 app.include_router(companies.router)
 app.include_router(emails.router)
+app.include_router(jobs.router)
+app.include_router(stats.router)
+app.include_router(suggest.router)
+app.include_router(percolator.router)
 
 # ============== ENDPOINTS DE COMPANIES ==============
 'Registrar nueva empresa en el catálogo'
@@ -59,12 +128,12 @@ def create_company(
 'Listar todas las empresas con paginación'
 @app.get("/api/companies", response_model=List[schemas.CompanyResponse])
 def list_companies(
+    request: Request,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    companies = crud.get_companies(db, skip=skip, limit=limit)
-    return companies
+    return companies.catalog_response(request, db, skip=skip, limit=limit)
 
 
 # ============== ENDPOINTS DE EMAILS ==============
@@ -130,23 +199,59 @@ def create_emails_bulk(
         "errors": errors
     }
 
-'Buscar emails con filtros múltiples y paginación'
-@app.get("/api/emails/search", response_model=schemas.EmailSearchResponse)
-def search_emails(
+'Filtros comunes de la búsqueda y la exportación'
+def search_filters(
     content: str = Query(..., description="Texto a buscar en el contenido del email (OBLIGATORIO)"),
     recipient: Optional[str] = Query(None, description="Filtrar por destinatario (opcional)"),
     sender: Optional[str] = Query(None, description="Filtrar por emisor (opcional)"),
     company_name: Optional[str] = Query(None, description="Filtrar por nombre de empresa (opcional)"),
     date_from: Optional[datetime] = Query(None, description="Filtrar desde fecha (opcional, formato: 2024-12-01T10:30:00)"),
     date_to: Optional[datetime] = Query(None, description="Filtrar hasta fecha (opcional, formato: 2024-12-01T23:59:59)"),
+    mode: schemas.SearchMode = Query(schemas.SearchMode.substring, description="Modo de búsqueda del contenido: substring (LIKE) o token/phrase/prefix (índice FTS5)")
+) -> dict:
+    return {
+        "content": content,
+        "recipient": recipient,
+        "sender": sender,
+        "company_name": company_name,
+        "date_from": date_from,
+        "date_to": date_to,
+        "mode": mode
+    }
+
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    return [name.strip() for name in fields.split(",") if name.strip()] if fields else None
+
+
+'Buscar emails con filtros múltiples y paginación'
+@app.get("/api/emails/search", response_model=Union[schemas.EmailSearchResponse, schemas.EmailCursorSearchResponse])
+def search_emails(
+    request: Request,
+    filters: dict = Depends(search_filters),
     page: int = Query(1, ge=1, description="Número de página (mínimo 1)"),
     page_size: int = Query(10, ge=1, le=100, description="Cantidad de emails por página (máximo 100)"),
-    db: Session = Depends(get_db)
+    rank: bool = Query(False, description="Ordenar por relevancia bm25 (solo modos FTS)"),
+    cursor: Optional[str] = Query(None, description="Paginación por cursor: vacío para la primera página, luego el next_cursor recibido"),
+    with_total: Optional[schemas.TotalMode] = Query(None, description="Calcular el total: false, exact o estimate (por defecto exact con page, false con cursor)"),
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por coma, p. ej. id,sender,date (por defecto todos; id siempre se incluye)"),
+    snippet: bool = Query(False, description="Devolver fragmentos alrededor de las coincidencias en vez del contenido completo (GET /api/emails/{id} lo trae entero)"),
+    snippet_matches: int = Query(3, ge=1, le=10, description="Coincidencias a mostrar por email (con snippet)"),
+    snippet_size: int = Query(160, ge=20, le=2000, description="Caracteres de contexto por coincidencia (con snippet)"),
+    db: Session = Depends(get_read_db)
 ):
     
+    if cursor is not None and rank:
+        raise HTTPException(status_code=400, detail="La paginación por cursor no es compatible con rank")
+    
+    if with_total is None:
+        with_total = schemas.TotalMode.false if cursor is not None else schemas.TotalMode.exact
+    
     # Validar que content no esté vacío
-    if not content or content.strip() == "":
+    if not filters["content"].strip():
         # Según requisitos: sin filtros = lista vacía
+        if cursor is not None:
+            return {"total": 0, "page_size": page_size, "next_cursor": None, "emails": []}
         return {
             "total": 0,
             "page": page,
@@ -155,20 +260,108 @@ def search_emails(
             "emails": []
         }
     
+    # Cambios hechos por otro proceso (retención): nueva generación antes de la caché y el ETag
+    search_cache.cache.sync(search_cache.data_version(db))
+    # El cliente ya tiene esta generación de datos (If-None-Match): 304 sin consultar los emails
+    tag = responses.etag(search_cache.cache.generation)
+    unchanged = responses.not_modified(request, tag)
+    if unchanged is not None:
+        return unchanged
+    
     # Realizar búsqueda
-    result = crud.search_emails(
-        db=db,
-        content=content,
-        recipient=recipient,
-        sender=sender,
-        company_name=company_name,
-        date_from=date_from,
-        date_to=date_to,
-        page=page,
-        page_size=page_size
-    )
+    try:
+        result = crud.search_emails(
+            db=db,
+            page=page,
+            page_size=page_size,
+            rank=rank,
+            cursor=cursor,
+            with_total=with_total,
+            fields=_parse_fields(fields),
+            snippet=snippet,
+            snippet_matches=snippet_matches,
+            snippet_size=snippet_size,
+            **filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Los emails ya vienen como dicts planos: se serializan directo sin revalidar con response_model
+    metrics.record_rows(len(result["emails"]))
+    return responses.json_response(result, etag=tag)
+
+
+'Exportar todos los resultados de una búsqueda (CSV o NDJSON) en streaming'
+@app.get("/api/emails/export")
+async def export_emails(
+    request: Request,
+    filters: dict = Depends(search_filters),
+    format: schemas.ExportFormat = Query(schemas.ExportFormat.ndjson, description="Formato: csv o ndjson"),
+    gzip: bool = Query(False, description="Comprimir la descarga con gzip"),
+    rank: bool = Query(False, description="Ordenar por relevancia bm25 (solo modos FTS)"),
+    fields: Optional[str] = Query(None, description="Campos a exportar separados por coma (por defecto todos)")
+):
+    """
+    Un solo cursor del servidor recorre todos los resultados por bloques (yield_per):
+    la memoria no depende del tamaño del resultado y se corta si el cliente se desconecta.
+    """
+    try:
+        names = crud.resolve_fields(_parse_fields(fields))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not filters["content"].strip():
+        raise HTTPException(status_code=400, detail="El filtro content es obligatorio")
     
-    return result
+    chunks = exports.export_chunks(names, format, gzip, rank=rank, **filters)
+    filename = f"emails.{format.value}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else exports.MEDIA_TYPES[format]
+    return StreamingResponse(
+        exports.until_disconnected(request, chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+'Obtener un email completo por id (el cuerpo que la búsqueda con snippet no trae)'
+@app.get("/api/emails/{email_id:int}", response_model=schemas.EmailResponse)
+def get_email(email_id: int, request: Request, db: Session = Depends(get_read_db)):
+    search_cache.cache.sync(search_cache.data_version(db))
+    tag = responses.etag(search_cache.cache.generation)
+    unchanged = responses.not_modified(request, tag)
+    if unchanged is not None:
+        return unchanged
+    email = crud.get_email(db, email_id)
+    if email is None:
+        raise HTTPException(status_code=404, detail=f"Email {email_id} no encontrado")
+    return responses.json_response(email, etag=tag)
+
+
+# ============== ENDPOINTS DE ADMINISTRACIÓN ==============
+'Estadísticas de la caché de búsquedas'
+@app.get("/api/admin/search-cache")
+def search_cache_stats():
+    return search_cache.cache.stats()
+
+
+'Estado del filtro de Bloom de smtp_code'
+@app.get("/api/admin/smtp-filter")
+def smtp_filter_stats():
+    return smtp_filter.codes.stats()
+
+
+'Peores consultas lentas agrupadas por forma de filtros'
+@app.get("/api/admin/slow-queries")
+def slow_queries_report(limit: int = Query(20, ge=1, le=200, description="Cantidad de grupos a devolver")):
+    return {
+        "enabled": settings.SLOW_QUERY_ENABLED,
+        "threshold_ms": settings.SLOW_QUERY_THRESHOLD_MS,
+        "groups": slow_queries.worst(limit)
+    }
+
+'Vaciar el registro de consultas lentas'
+@app.delete("/api/admin/slow-queries", status_code=204)
+def slow_queries_clear():
+    slow_queries.clear()
 
 
 # ============== ENDPOINT DE SALUD ==============
@@ -181,11 +374,25 @@ def root():
         "endpoints": {
             "companies": "/api/companies",
             "bulk_emails": "/api/emails/bulk",
+            "bulk_jobs": "/api/emails/bulk/jobs",
             "search_emails": "/api/emails/search",
+            "export_emails": "/api/emails/export",
+            "email": "/api/emails/{id}",
+            "stats": "/api/stats/volume",
+            "suggest": "/api/suggest",
+            "saved_searches": "/api/saved-searches",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
 
+'Métricas en formato texto de Prometheus'
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Métricas desactivadas")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 'Verificar el estado de salud de la API'
 @app.get("/health")
 def health_check():
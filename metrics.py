@@ -0,0 +1,216 @@
+"""
+Métricas de rendimiento por request y endpoint /metrics (formato texto de Prometheus)
+
+- Latencia por ruta, bytes de respuesta y filas devueltas (middleware ASGI)
+- Cantidad y tiempo de sentencias SQL por request (eventos del engine de SQLAlchemy)
+- Filas/s y fallos de la ingesta masiva
+
+Se desactiva con EMAILS_METRICS_ENABLED=0.
+"""
+
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence, Tuple
+from sqlalchemy import event
+import settings
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+# ============== TIPOS DE MÉTRICA ==============
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(labels)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple, list] = {}  # labels -> [conteos por bucket..., suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = [(labels, list(data)) for labels, data in self._values.items()]
+        for labels, data in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(labels + (('le', '+Inf'),))} {data[-1]}"
+            yield f"{self.name}_sum{_labels(labels)} {_number(data[-2])}"
+            yield f"{self.name}_count{_labels(labels)} {data[-1]}"
+
+
+def _labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ============== MÉTRICAS ==============
+REQUEST_SECONDS = Histogram("emails_http_request_duration_seconds", "Latencia por ruta", LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram("emails_http_response_bytes", "Tamaño del cuerpo de la respuesta", BYTES_BUCKETS)
+REQUEST_SQL_STATEMENTS = Histogram("emails_http_request_sql_statements", "Sentencias SQL por request", COUNT_BUCKETS)
+REQUEST_SQL_SECONDS = Histogram("emails_http_request_sql_seconds", "Tiempo total de SQL por request", LATENCY_BUCKETS)
+SQL_STATEMENTS = Counter("emails_sql_statements_total", "Sentencias SQL ejecutadas")
+SQL_SECONDS = Counter("emails_sql_seconds_total", "Tiempo total en sentencias SQL")
+ROWS_RETURNED = Histogram("emails_search_rows_returned", "Emails devueltos por búsqueda", COUNT_BUCKETS)
+INGEST_ROWS = Counter("emails_ingest_rows_total", "Emails procesados por la ingesta masiva")
+INGEST_SECONDS = Counter("emails_ingest_seconds_total", "Tiempo en la ingesta masiva (filas/s = rows_total / seconds_total)")
+INGEST_CHUNK_SECONDS = Histogram("emails_ingest_chunk_duration_seconds", "Duración de cada bloque de ingesta", LATENCY_BUCKETS)
+
+REGISTRY = [
+    REQUEST_SECONDS, RESPONSE_BYTES, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS,
+    SQL_STATEMENTS, SQL_SECONDS, ROWS_RETURNED, INGEST_ROWS, INGEST_SECONDS, INGEST_CHUNK_SECONDS,
+]
+
+# Funciones que agregan métricas calculadas al momento de exportar: fn() -> [(nombre, tipo, ayuda, valor)]
+_collectors = []
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+# ============== CONTEXTO POR REQUEST ==============
+class RequestStats:
+    __slots__ = ("sql_statements", "sql_seconds")
+
+    def __init__(self):
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+    SQL_STATEMENTS.inc()
+    SQL_SECONDS.inc(elapsed)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.sql_statements += 1
+        stats.sql_seconds += elapsed
+
+
+'registrar los eventos de SQL en los engines indicados'
+def instrument_engines(*engines):
+    if not settings.METRICS_ENABLED:
+        return
+    for engine in set(engines):
+        if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+'filas devueltas por una búsqueda'
+def record_rows(count: int):
+    if settings.METRICS_ENABLED:
+        ROWS_RETURNED.observe(count)
+
+
+'resultado de un bloque de ingesta'
+def record_ingest(success: int, failed: int, seconds: float):
+    if not settings.METRICS_ENABLED:
+        return
+    INGEST_ROWS.inc(success, result="success")
+    INGEST_ROWS.inc(failed, result="failed")
+    INGEST_SECONDS.inc(seconds)
+    INGEST_CHUNK_SECONDS.observe(seconds)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI puro (no envuelve el cuerpo en memoria, sirve para streaming)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status = {"code": 500, "bytes": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                status["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_stats.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            labels = {"method": scope["method"], "route": path}
+            REQUEST_SECONDS.observe(time.perf_counter() - started, status=status["code"], **labels)
+            RESPONSE_BYTES.observe(status["bytes"], **labels)
+            REQUEST_SQL_STATEMENTS.observe(stats.sql_statements, **labels)
+            REQUEST_SQL_SECONDS.observe(stats.sql_seconds, **labels)
+
+
+'texto de exposición de Prometheus con todas las métricas'
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, help, value in collector():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {_number(value)}")
+    return "\n".join(lines) + "\n"
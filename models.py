@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -36,14 +36,147 @@ class Email(Base):
     # Código único del proveedor SMTP
     smtp_code = Column(String(200), unique=True, nullable=False, index=True)
     
-    # Contenido del correo (puede ser muy largo)
-    content = Column(Text, nullable=False)
+    # Contenido del correo: se guarda comprimido y una sola vez por texto distinto
+    body_id = Column(Integer, ForeignKey("email_bodies.id"), nullable=False, index=True)
     
     # Fecha de creación del registro
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relación: Un email pertenece a una empresa
     company = relationship("Company", back_populates="emails")
+    body = relationship("EmailBody")
+    
+    def __repr__(self):
+        return f"<Email(smtp_code={self.smtp_code}, sender={self.sender})>"
+
+'Modelo para los cuerpos de email: cada contenido distinto una sola vez, comprimido con zlib'
+class EmailBody(Base):
+    __tablename__ = "email_bodies"
+    
+    id = Column(Integer, primary_key=True)
+    # sha256 del contenido sin comprimir
+    hash = Column(LargeBinary(32), unique=True, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    # Tamaño del contenido sin comprimir (bytes UTF-8)
+    size = Column(Integer, nullable=False)
+    
+    def __repr__(self):
+        return f"<EmailBody(id={self.id}, size={self.size})>"
+
+'Siguiente id de email con la tabla particionada por mes (una sola fila, ver partitions.py)'
+class EmailIdSequence(Base):
+    __tablename__ = "email_id_sequence"
+    
+    id = Column(Integer, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
+'smtp_code de todos los emails: el índice único global cuando hay varias tablas de emails (ver partitions.py)'
+class SmtpCode(Base):
+    __tablename__ = "smtp_codes"
+    
+    code = Column(String(200), primary_key=True)
+    # Con shards: quién lo reservó (id del trabajo o de la escritura), ver ingest.write_items
+    owner = Column(String(36), nullable=True)
+
+'Versión de los datos de emails (una sola fila): la suben los cambios hechos fuera del servidor, ver search_cache.py'
+class DataVersion(Base):
+    __tablename__ = "data_version"
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+'Archivo SQLite con los emails de cada empresa (EMAILS_SHARDING=company, ver shards.py)'
+class CompanyShard(Base):
+    __tablename__ = "company_shards"
+    
+    company_id = Column(Integer, ForeignKey("companies.id"), primary_key=True)
+    path = Column(String(500), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+'Modelo para una búsqueda guardada: los emails nuevos que la cumplen se avisan por SSE (ver percolator.py)'
+class SavedSearch(Base):
+    __tablename__ = "saved_searches"
+    
+    # Mismos filtros que /api/emails/search
+    id = Column(Integer, primary_key=True)
+    name = Column(String(200), nullable=False)
+    content = Column(Text, nullable=False)
+    mode = Column(String(20), nullable=False)
+    recipient = Column(String(255), nullable=True)
+    sender = Column(String(255), nullable=True)
+    company_name = Column(String(200), nullable=True)
+    date_from = Column(DateTime, nullable=True)
+    date_to = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
     
     def __repr__(self):
-        return f"<Email(smtp_code={self.smtp_code}, sender={self.sender})>"
\ No newline at end of file
+        return f"<SavedSearch(id={self.id}, name={self.name})>"
+
+'Acumulado diario de emails por empresa (estadísticas, ver rollups.py)'
+class DailyCompanyVolume(Base):
+    __tablename__ = "stats_company_day"
+    
+    company_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True, index=True)
+    total = Column(Integer, nullable=False)
+
+'Acumulado diario de emails por empresa y emisor'
+class DailySenderVolume(Base):
+    __tablename__ = "stats_sender_day"
+    # El top lee el rango de días solo desde este índice (sin ir a la tabla), ver rollups.top
+    __table_args__ = (Index("ix_stats_sender_day_cover", "day", "company_id", "sender", "total"),)
+    
+    company_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    sender = Column(String(200), primary_key=True)
+    total = Column(Integer, nullable=False)
+
+'Acumulado diario de emails por empresa y destinatario'
+class DailyRecipientVolume(Base):
+    __tablename__ = "stats_recipient_day"
+    # El top lee el rango de días solo desde este índice (sin ir a la tabla), ver rollups.top
+    __table_args__ = (Index("ix_stats_recipient_day_cover", "day", "company_id", "recipient", "total"),)
+    
+    company_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    recipient = Column(String(200), primary_key=True)
+    total = Column(Integer, nullable=False)
+
+'Modelo para los trabajos de importación masiva en segundo plano'
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+    
+    # Columnas de la tabla
+    id = Column(String(36), primary_key=True)  # uuid4
+    status = Column(String(20), nullable=False, index=True)  # queued, running, done, failed
+    total = Column(Integer, nullable=False)
+    processed = Column(Integer, nullable=False, default=0)
+    success = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    
+    # Lote pendiente (JSON comprimido con zlib), se borra al terminar
+    payload = Column(LargeBinary, nullable=True)
+    
+    # Error que detuvo el trabajo completo (no los errores por email)
+    error = Column(Text, nullable=True)
+    
+    # Proceso que lo está ejecutando y hasta cuándo vale su reclamo (lo renueva cada bloque)
+    claimed_by = Column(String(100), nullable=True)
+    lease_until = Column(DateTime, nullable=True)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<ImportJob(id={self.id}, status={self.status})>"
+
+'Modelo para los errores por email de un trabajo de importación'
+class ImportJobError(Base):
+    __tablename__ = "import_job_errors"
+    
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(36), ForeignKey("import_jobs.id"), nullable=False, index=True)
+    indice = Column(Integer, nullable=False)
+    smtp_code = Column(String(200), nullable=True)
+    error = Column(Text, nullable=False)
@@ -0,0 +1,296 @@
+"""
+Particiones mensuales de los emails
+
+Con EMAILS_PARTITIONING=monthly cada email se guarda en la tabla del mes de su fecha
+(emails_p202412, ...) con los mismos índices que emails y su propio índice de trigramas.
+La tabla emails queda como partición sin rango: guarda lo registrado antes de particionar
+(`python partitions.py split` la reparte) y es la única tabla con EMAILS_PARTITIONING=none.
+
+- insert_rows: envía cada fila a su partición (la crea si falta); con particiones los ids
+  son globales y salen de email_id_sequence (también con shards por empresa, ver shards.py)
+- registry.for_search: solo las particiones que se cruzan con [date_from, date_to]
+- drop_expired: la retención borra particiones completas con DROP TABLE, sin DELETE fila a fila
+- smtp_codes: cada tabla tiene su índice único de smtp_code; la unicidad entre meses la da
+  la tabla smtp_codes, que recibe cada código en la misma transacción que su fila (con
+  shards la tabla vive en la BD principal y la llena ingest.write_items)
+
+Uso por consola:
+    python partitions.py split              # mover la tabla emails a sus particiones mensuales
+    python partitions.py retain --months 24 # borrar particiones viejas y los cuerpos sin uso
+"""
+
+import re
+import threading
+from datetime import datetime, timezone
+from sqlalchemy import MetaData, Table, delete, func, inspect, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from typing import Dict, List, NamedTuple, Optional
+import fts
+import models
+import search_cache
+import settings
+
+MONTHLY = settings.PARTITIONING == "monthly"
+# Ids explícitos desde email_id_sequence: globales entre particiones y entre shards
+_SEQUENCED_IDS = MONTHLY or settings.SHARDING == "company"
+# Registro global de smtp_code en la misma transacción que las filas (con shards va en la BD principal, ver ingest.py)
+_REGISTERED_CODES = MONTHLY and settings.SHARDING != "company"
+
+PREFIX = "emails_p"
+_NAME = re.compile(r"^emails_p(\d{4})(\d{2})$")
+
+# Tablas de las particiones (mismas columnas e índices que emails, sin llaves foráneas)
+_metadata = MetaData()
+_tables_lock = threading.Lock()
+
+
+'fecha como se guarda en las tablas de emails: sin zona horaria, en UTC'
+def naive_utc(date: Optional[datetime]) -> Optional[datetime]:
+    if date is None or date.tzinfo is None:
+        return date
+    return date.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def month_key(date: datetime) -> str:
+    return f"{date.year:04d}{date.month:02d}"
+
+
+def _add_months(date: datetime, months: int) -> datetime:
+    index = date.year * 12 + date.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def _table(name: str) -> Table:
+    with _tables_lock:
+        table = _metadata.tables.get(name)
+        if table is None:
+            table = Table(name, _metadata, *(column._copy() for column in models.Email.__table__.columns))
+        return table
+
+
+class Partition(NamedTuple):
+    table: Table
+    # [start, end) del mes; None en la tabla emails (sin rango)
+    start: Optional[datetime]
+    end: Optional[datetime]
+
+
+class PartitionRegistry:
+    """Particiones existentes, releídas solo cuando cambia el esquema (PRAGMA schema_version)"""
+
+    def __init__(self):
+        # Por archivo de BD (la principal y cada shard):
+        # (schema_version, particiones de la más nueva a la más vieja, la tabla emails tiene filas)
+        self._states: Dict[str, tuple] = {}
+
+    def _load(self, db: Session):
+        database = db.get_bind().url.database
+        version = db.execute(text("PRAGMA schema_version")).scalar()
+        state = self._states.get(database)
+        if state is not None and state[0] == version:
+            return state
+        names = db.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix"),
+            {"prefix": PREFIX + "%"}
+        ).scalars()
+        partitions = []
+        for name in names:
+            found = _NAME.match(name)
+            if found:
+                start = datetime(int(found.group(1)), int(found.group(2)), 1)
+                partitions.append(Partition(_table(name), start, _add_months(start, 1)))
+        partitions.sort(key=lambda partition: partition.start, reverse=True)
+        legacy_rows = db.execute(select(models.Email.id).limit(1)).first() is not None
+        state = (version, partitions, legacy_rows)
+        self._states[database] = state
+        return state
+
+    def partitions(self, db: Session) -> List[Partition]:
+        """Particiones mensuales existentes, de la más nueva a la más vieja"""
+        return self._load(db)[1]
+
+    def tables(self, db: Session) -> List[Table]:
+        """Todas las tablas con emails: emails y cada partición"""
+        _, partitions, _ = self._load(db)
+        return [models.Email.__table__] + [partition.table for partition in partitions]
+
+    def for_search(self, db: Session, date_from: Optional[datetime], date_to: Optional[datetime]) -> List[Partition]:
+        """Particiones que se cruzan con [date_from, date_to], de la más nueva a la más vieja"""
+        date_from, date_to = naive_utc(date_from), naive_utc(date_to)
+        _, partitions, legacy_rows = self._load(db)
+        selected = [
+            partition for partition in partitions
+            if (date_to is None or partition.start <= date_to) and (date_from is None or partition.end > date_from)
+        ]
+        # La tabla emails no tiene rango: entra siempre que pueda tener filas
+        if not MONTHLY or legacy_rows or not partitions:
+            selected.insert(0, Partition(models.Email.__table__, None, None))
+        return selected
+
+    def ensure(self, db: Session, key: str) -> Table:
+        """Tabla de la partición del mes, creada dentro de la transacción de db si no existe"""
+        name = PREFIX + key
+        table = _table(name)
+        _, partitions, _ = self._load(db)
+        if not any(partition.table.name == name for partition in partitions):
+            conn = db.connection()
+            table.create(conn, checkfirst=True)
+            fts.ensure_trigram(conn, name)
+        return table
+
+
+registry = PartitionRegistry()
+
+
+def _allocate_ids(db: Session, count: int) -> int:
+    """Reserva count ids consecutivos en la transacción de db, retorna el primero"""
+    first_id = db.execute(
+        text("UPDATE email_id_sequence SET next_id = next_id + :count WHERE id = 1 RETURNING next_id - :count"),
+        {"count": count}
+    ).scalar()
+    if first_id is None:
+        # Primera vez: seguir después del id más alto de todas las tablas
+        first_id = max(db.execute(select(func.max(table.c.id))).scalar() or 0 for table in registry.tables(db)) + 1
+        db.execute(insert(models.EmailIdSequence), [{"id": 1, "next_id": first_id + count}])
+    return first_id
+
+
+'insertar filas de emails (dicts de columnas) en la tabla que les corresponde, dentro de la transacción de db'
+def insert_rows(db: Session, rows: List[dict]):
+    if not _SEQUENCED_IDS:
+        db.execute(insert(models.Email), rows)
+        return
+    first_id = _allocate_ids(db, len(rows))
+    if not MONTHLY:
+        db.execute(insert(models.Email), [dict(row, id=first_id + offset) for offset, row in enumerate(rows)])
+        return
+    if _REGISTERED_CODES:
+        # Un código ya guardado en cualquier mes lanza IntegrityError, como el índice único de emails
+        db.execute(insert(models.SmtpCode), [{"code": row["smtp_code"]} for row in rows])
+    groups: Dict[str, List[dict]] = {}
+    for offset, row in enumerate(rows):
+        groups.setdefault(month_key(row["date"]), []).append(dict(row, id=first_id + offset))
+    # Un executemany por partición
+    for key, group in groups.items():
+        db.execute(insert(registry.ensure(db, key)), group)
+
+
+# ============== MANTENIMIENTO ==============
+'llenar smtp_codes con los códigos de emails y sus particiones si está vacía (BD anterior al registro)'
+def ensure_codes(engine: Engine):
+    with engine.begin() as conn:
+        # smtp_codes anterior a la columna owner
+        if "owner" not in {column["name"] for column in inspect(conn).get_columns("smtp_codes")}:
+            conn.execute(text("ALTER TABLE smtp_codes ADD COLUMN owner VARCHAR(36)"))
+    if not _REGISTERED_CODES:
+        return
+    with Session(engine) as db:
+        if db.execute(select(models.SmtpCode.code).limit(1)).first() is not None:
+            return
+        for table in registry.tables(db):
+            db.execute(insert(models.SmtpCode).prefix_with("OR IGNORE").from_select(["code"], select(table.c.smtp_code)))
+        db.commit()
+
+
+'mover las filas de la tabla emails a sus particiones mensuales (conserva los ids), retorna cuántas movió'
+def split(engine: Engine) -> int:
+    """
+    Copia mes por mes con INSERT OR IGNORE y commit por mes: se puede interrumpir y
+    repetir. Al final vacía emails (sin triggers: DELETE sin WHERE trunca la tabla).
+    """
+    emails = models.Email.__table__
+    columns = [column.name for column in emails.columns]
+    moved = 0
+    with Session(engine) as db:
+        months = db.execute(select(func.strftime("%Y%m", emails.c.date)).distinct()).scalars().all()
+        for key in sorted(months):
+            start = datetime(int(key[:4]), int(key[4:]), 1)
+            table = registry.ensure(db, key)
+            result = db.execute(
+                insert(table).prefix_with("OR IGNORE").from_select(
+                    columns,
+                    select(*emails.columns).where(emails.c.date >= start, emails.c.date < _add_months(start, 1))
+                )
+            )
+            db.commit()
+            moved += result.rowcount
+        if moved:
+            # Los próximos ids siguen después de los movidos
+            _allocate_ids(db, 0)
+            db.commit()
+    with engine.begin() as conn:
+        fts.drop_index(conn, fts.TRIGRAM_TABLE)
+        conn.execute(text("DELETE FROM emails"))
+    fts.ensure_fts(engine)
+    return moved
+
+
+'borrar las particiones anteriores a los últimos `months` meses (incluido el actual), retorna sus nombres'
+def drop_expired(
+    engine: Engine,
+    months: int,
+    now: Optional[datetime] = None,
+    codes_engine: Optional[Engine] = None
+) -> List[str]:
+    """
+    codes_engine: con shards, la BD principal; los códigos de las particiones borradas se
+    liberan en su smtp_codes después del DROP (si se corta antes quedan reservados, nunca libres
+    con su fila todavía guardada).
+    """
+    if months <= 0:
+        return []
+    now = now or datetime.utcnow()
+    cutoff = _add_months(datetime(now.year, now.month, 1), -(months - 1))
+    codes = []
+    with Session(engine) as db:
+        expired = [partition.table.name for partition in registry.partitions(db) if partition.end <= cutoff]
+        if codes_engine is not None:
+            for name in expired:
+                codes.extend(db.execute(text(f"SELECT smtp_code FROM {name}")).scalars())
+    if expired:
+        with engine.begin() as conn:
+            for name in expired:
+                if _REGISTERED_CODES:
+                    # Los códigos de la partición se pueden volver a registrar
+                    conn.execute(text(f"DELETE FROM smtp_codes WHERE code IN (SELECT smtp_code FROM {name})"))
+                fts.drop_index(conn, fts.trigram_table(name))
+                conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            # El servidor (otro proceso) ve el cambio por data_version; los shards no tienen la tabla
+            if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_version'")).first():
+                search_cache.bump_data_version(conn)
+        search_cache.cache.invalidate()
+    if codes:
+        with codes_engine.begin() as conn:
+            for start in range(0, len(codes), 500):
+                conn.execute(delete(models.SmtpCode).where(models.SmtpCode.code.in_(codes[start:start + 500])))
+    return expired
+
+
+if __name__ == "__main__":
+    import argparse
+    import bodies
+    import shards
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Particiones mensuales de emails")
+    parser.add_argument("command", choices=["split", "retain"])
+    parser.add_argument("--months", type=int, default=settings.RETENTION_MONTHS, help="Meses a conservar (retain)")
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    fts.ensure_fts(engine)
+    ensure_codes(engine)
+    if args.command == "split":
+        print(f"Emails movidos a particiones: {split(engine)}")
+    else:
+        # Con shards por empresa la retención se aplica en cada archivo
+        for target in [engine] + (shards.registry.engines() if shards.SHARDED else []):
+            dropped = drop_expired(target, args.months, codes_engine=engine if shards.SHARDED else None)
+            if dropped and target is not engine:
+                # La versión de los datos vive en la BD principal
+                with engine.begin() as conn:
+                    search_cache.bump_data_version(conn)
+            print(f"{target.url.database}: particiones borradas: {', '.join(dropped) or 'ninguna'}")
+            with Session(target) as db:
+                print(f"{target.url.database}: cuerpos borrados: {bodies.prune(db)}")
@@ -0,0 +1,485 @@
+"""
+Búsquedas guardadas evaluadas al ingresar los emails (percolador) con aviso por SSE
+
+En vez de repetir /api/emails/search cada pocos segundos, un cliente guarda la búsqueda
+(POST /api/saved-searches) y se suscribe a GET /api/saved-searches/{id}/stream: cada bloque
+que confirma la ingesta se compara en memoria contra las búsquedas guardadas y los emails
+que cumplen una se envían a sus suscriptores. El trabajo es O(emails nuevos), no O(tabla).
+
+- índice invertido por término: token y phrase por su palabra más larga, prefix por el
+  comienzo (hasta 3 letras) de esa palabra, substring por un trigrama del texto; un email
+  solo se compara contra las búsquedas de los términos que contiene (las de menos de 3
+  caracteres en substring se revisan siempre)
+- la comparación final replica los filtros de la búsqueda: palabras sin acentos ni mayúsculas
+  como el índice FTS5, subcadenas sin mayúsculas como LIKE, empresa por el catálogo en memoria
+- un hilo hace la comparación: la ingesta solo encola las filas después del commit y
+  solo si alguna búsqueda tiene suscriptores
+- un suscriptor lento pierde eventos (EMAILS_PERCOLATOR_QUEUE_SIZE) y recibe cuántos
+
+Los avisos son de este proceso: la ingesta de otro proceso no llega a sus suscriptores.
+"""
+
+import asyncio
+import bisect
+import json
+import logging
+import queue
+import re
+import threading
+import unicodedata
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, List, Optional, Set
+import company_cache
+import metrics
+import models
+import partitions
+import schemas
+import settings
+from database import ReadSessionLocal, get_read_db, run_write
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Palabras como las separa el tokenizador unicode61 (el guion bajo también separa)
+_WORD = re.compile(r"[^\W_]+")
+
+# Largo de las claves de prefix y substring en el índice
+_GRAM = 3
+
+
+def _fold(text: str) -> str:
+    # Sin acentos y en minúsculas (unicode61 remove_diacritics)
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(_fold(text))
+
+
+class _Document:
+    """Contenido de un email con sus vistas calculadas a demanda (una vez por cuerpo distinto)"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self._lowered = None
+        self._words = None
+        self._word_set = None
+        self._sorted = None
+        self._phrase = None
+
+    @property
+    def lowered(self) -> str:
+        if self._lowered is None:
+            self._lowered = self.content.lower()
+        return self._lowered
+
+    @property
+    def words(self) -> List[str]:
+        if self._words is None:
+            self._words = _words(self.content)
+        return self._words
+
+    @property
+    def word_set(self) -> Set[str]:
+        if self._word_set is None:
+            self._word_set = set(self.words)
+        return self._word_set
+
+    @property
+    def sorted_words(self) -> List[str]:
+        if self._sorted is None:
+            self._sorted = sorted(self.word_set)
+        return self._sorted
+
+    @property
+    def phrase(self) -> str:
+        if self._phrase is None:
+            self._phrase = f" {' '.join(self.words)} "
+        return self._phrase
+
+    def has_prefix(self, prefix: str) -> bool:
+        words = self.sorted_words
+        position = bisect.bisect_left(words, prefix)
+        return position < len(words) and words[position].startswith(prefix)
+
+
+class _Query:
+    """Una búsqueda guardada lista para comparar"""
+
+    def __init__(self, search: models.SavedSearch):
+        self.id = search.id
+        self.mode = schemas.SearchMode(search.mode)
+        self.term = search.content.lower()
+        self.words = _words(search.content)
+        self.recipient = search.recipient.lower() if search.recipient else None
+        self.sender = search.sender.lower() if search.sender else None
+        self.company_name = search.company_name
+        # Como en la búsqueda: las fechas se comparan sin zona horaria, en UTC
+        self.date_from = partitions.naive_utc(search.date_from)
+        self.date_to = partitions.naive_utc(search.date_to)
+
+    def key(self) -> Optional[str]:
+        """Término por el que entra al índice (None = se revisa con todos los emails)"""
+        if self.mode == schemas.SearchMode.substring:
+            return self.term[:_GRAM] if len(self.term) >= _GRAM else None
+        if not self.words:
+            return None
+        longest = max(self.words, key=len)
+        return longest[:_GRAM] if self.mode == schemas.SearchMode.prefix else longest
+
+    def content_matches(self, document: _Document) -> bool:
+        if self.mode == schemas.SearchMode.substring:
+            return self.term in document.lowered
+        if not self.words:
+            return False
+        if self.mode == schemas.SearchMode.token:
+            return all(word in document.word_set for word in self.words)
+        if self.mode == schemas.SearchMode.prefix:
+            return all(document.has_prefix(word) for word in self.words)
+        return f" {' '.join(self.words)} " in document.phrase
+
+    def matches(self, row: dict, document: _Document, company_ids: Dict[int, Set[int]]) -> bool:
+        # Primero los filtros baratos, el contenido al final
+        date = partitions.naive_utc(row["date"])
+        if self.date_from and date < self.date_from:
+            return False
+        if self.date_to and date > self.date_to:
+            return False
+        if self.recipient and self.recipient not in row["recipient"].lower():
+            return False
+        if self.sender and self.sender not in row["sender"].lower():
+            return False
+        if self.company_name:
+            if self.id not in company_ids:
+                company_ids[self.id] = set(company_cache.catalog.ids_matching(self.company_name))
+            if row["company_id"] not in company_ids[self.id]:
+                return False
+        return self.content_matches(document)
+
+
+class _Index:
+    """Búsquedas guardadas por término; inmutable, cada cambio publica uno nuevo"""
+
+    def __init__(self, queries: Iterable[_Query] = ()):
+        self.queries: Dict[int, _Query] = {}
+        self.exact: Dict[str, List[_Query]] = {}     # token y phrase
+        self.prefixes: Dict[str, List[_Query]] = {}  # prefix
+        self.grams: Dict[str, List[_Query]] = {}     # substring
+        self.always: List[_Query] = []
+        for query in queries:
+            self.queries[query.id] = query
+            key = query.key()
+            if key is None:
+                self.always.append(query)
+            elif query.mode == schemas.SearchMode.substring:
+                self.grams.setdefault(key, []).append(query)
+            elif query.mode == schemas.SearchMode.prefix:
+                self.prefixes.setdefault(key, []).append(query)
+            else:
+                self.exact.setdefault(key, []).append(query)
+
+    def candidates(self, document: _Document) -> List[_Query]:
+        found = list(self.always)
+        if self.exact or self.prefixes:
+            for word in document.word_set:
+                found.extend(self.exact.get(word, ()))
+                if self.prefixes:
+                    for end in range(1, min(len(word), _GRAM) + 1):
+                        found.extend(self.prefixes.get(word[:end], ()))
+        if self.grams:
+            lowered = document.lowered
+            if len(self.grams) * 8 < len(lowered):
+                # Pocas claves: buscar cada una en el texto
+                keys = [gram for gram in self.grams if gram in lowered]
+            else:
+                keys = {lowered[start:start + _GRAM] for start in range(len(lowered) - _GRAM + 1)}
+            for gram in keys:
+                found.extend(self.grams.get(gram, ()))
+        return found
+
+
+class _Subscriber:
+    def __init__(self, search_id: int, loop: asyncio.AbstractEventLoop):
+        self.search_id = search_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.PERCOLATOR_QUEUE_SIZE)
+        self.dropped = 0
+
+    def offer(self, event: dict):
+        # Corre en el loop del suscriptor
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += len(event["emails"])
+
+    def close(self):
+        """La búsqueda se borró: el stream termina después de lo que ya está en la cola"""
+        if self.queue.full():
+            self.dropped += len(self.queue.get_nowait()["emails"])
+        self.queue.put_nowait(None)
+
+
+class Percolator:
+    def __init__(self):
+        self._index = _Index()
+        self._subscribers: Dict[int, List[_Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._pending: "queue.Queue[List[dict]]" = queue.Queue()
+        self._thread = None
+        self.batches = 0
+        self.emails = 0
+        self.candidates = 0
+        self.matches = 0
+
+    # ============== BÚSQUEDAS GUARDADAS ==============
+    def load(self):
+        with ReadSessionLocal() as db:
+            searches = db.execute(select(models.SavedSearch)).scalars().all()
+        self._index = _Index(_Query(search) for search in searches)
+
+    def register(self, search: models.SavedSearch):
+        with self._lock:
+            queries = dict(self._index.queries)
+            queries[search.id] = _Query(search)
+            self._index = _Index(queries.values())
+
+    def unregister(self, search_id: int):
+        with self._lock:
+            queries = dict(self._index.queries)
+            queries.pop(search_id, None)
+            self._index = _Index(queries.values())
+            subscribers = self._subscribers.pop(search_id, [])
+        for subscriber in subscribers:
+            _notify(subscriber, subscriber.close)
+
+    # ============== SUSCRIPTORES ==============
+    def subscribe(self, search_id: int) -> Optional[_Subscriber]:
+        """Suscribir al stream de una búsqueda guardada (None si no existe)"""
+        subscriber = _Subscriber(search_id, asyncio.get_running_loop())
+        with self._lock:
+            if search_id not in self._index.queries:
+                return None
+            self._subscribers.setdefault(search_id, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.search_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(subscriber.search_id, None)
+
+    def subscriber_count(self, search_id: Optional[int] = None) -> int:
+        if search_id is None:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+        return len(self._subscribers.get(search_id, ()))
+
+    # ============== INGESTA ==============
+    def start(self):
+        """Carga las búsquedas guardadas y arranca el hilo que compara los bloques"""
+        self.load()
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="percolator", daemon=True)
+        self._thread.start()
+
+    def submit(self, rows: List[dict], contents: Dict[str, str]):
+        """Encolar filas recién confirmadas con el contenido de cada smtp_code"""
+        # Sin suscriptores no hay a quién avisar
+        if rows and self._subscribers and self._thread is not None:
+            self._pending.put((rows, contents))
+
+    def _run(self):
+        while True:
+            rows, contents = self._pending.get()
+            try:
+                self.percolate(rows, contents)
+            except Exception:
+                logger.exception("Error comparando emails nuevos con las búsquedas guardadas")
+
+    def percolate(self, rows: List[dict], contents: Dict[str, str]) -> Dict[int, List[dict]]:
+        """Emails de rows que cumple cada búsqueda guardada con suscriptores, retorna {id: emails}"""
+        index = self._index
+        documents: Dict[str, _Document] = {}
+        company_ids: Dict[int, Set[int]] = {}
+        found: Dict[int, List[dict]] = {}
+        failed: Set[int] = set()
+        candidates = 0
+        for row in rows:
+            content = contents[row["smtp_code"]]
+            document = documents.get(content)
+            if document is None:
+                document = documents[content] = _Document(content)
+            queries = {query.id: query for query in index.candidates(document) if query.id in self._subscribers}
+            candidates += len(queries)
+            for query in queries.values():
+                if query.id in failed:
+                    continue
+                try:
+                    matched = query.matches(row, document, company_ids)
+                except Exception:
+                    # Una búsqueda que falla se salta en el resto del bloque, las demás siguen
+                    logger.exception("Error comparando emails nuevos con la búsqueda guardada %s", query.id)
+                    failed.add(query.id)
+                    continue
+                if matched:
+                    found.setdefault(query.id, []).append(_event_email(row))
+        with self._lock:
+            self.batches += 1
+            self.emails += len(rows)
+            self.candidates += candidates
+            self.matches += sum(len(emails) for emails in found.values())
+            targets = {search_id: list(self._subscribers.get(search_id, ())) for search_id in found}
+        for search_id, emails in found.items():
+            event = {"search_id": search_id, "emails": emails}
+            for subscriber in targets[search_id]:
+                _notify(subscriber, subscriber.offer, event)
+        return found
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            "saved_searches": len(index.queries),
+            "subscribers": self.subscriber_count(),
+            "batches": self.batches,
+            "emails": self.emails,
+            "candidates": self.candidates,
+            "matches": self.matches,
+        }
+
+
+def _notify(subscriber: _Subscriber, callback, *args):
+    # Desde cualquier hilo: la cola del suscriptor es de su loop
+    try:
+        subscriber.loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        # El loop del suscriptor ya cerró (apagado del servidor)
+        pass
+
+
+def _event_email(row: dict) -> dict:
+    return {
+        "smtp_code": row["smtp_code"],
+        "recipient": row["recipient"],
+        "sender": row["sender"],
+        "date": row["date"].isoformat(),
+        "company_name": company_cache.catalog.name_for(row["company_id"]),
+    }
+
+
+hub = Percolator()
+
+
+def _response(search: models.SavedSearch) -> dict:
+    response = schemas.SavedSearchResponse.model_validate(search).model_dump()
+    response["subscribers"] = hub.subscriber_count(search.id)
+    return response
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def _events(request: Request, subscriber: _Subscriber):
+    """Eventos SSE del suscriptor: emails que cumplen la búsqueda, emails perdidos, pings y el borrado"""
+    loop = asyncio.get_running_loop()
+    # El servidor espera a los streams abiertos al apagarse: cada uno dura un tiempo acotado
+    deadline = loop.time() + settings.PERCOLATOR_STREAM_SECONDS
+    try:
+        # retry: EventSource reconecta al segundo cuando el stream termina
+        yield b"retry: 1000\n" + _sse("ready", {"search_id": subscriber.search_id})
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=min(settings.PERCOLATOR_HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield b": ping\n\n"
+                continue
+            if event is None:
+                yield _sse("deleted", {"search_id": subscriber.search_id})
+                break
+            if subscriber.dropped:
+                yield _sse("dropped", {"search_id": subscriber.search_id, "emails": subscriber.dropped})
+                subscriber.dropped = 0
+            yield _sse("emails", event)
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+@router.post("/api/saved-searches", response_model=schemas.SavedSearchResponse, status_code=201)
+def create_saved_search(search: schemas.SavedSearchCreate):
+    """Guarda una búsqueda; los emails nuevos que la cumplan se avisan en su stream"""
+    if not search.content.strip():
+        raise HTTPException(status_code=400, detail="El filtro content es obligatorio")
+    fields = search.model_dump()
+    fields["date_from"] = partitions.naive_utc(search.date_from)
+    fields["date_to"] = partitions.naive_utc(search.date_to)
+    saved = models.SavedSearch(**fields)
+
+    def write(db: Session):
+        db.add(saved)
+        db.commit()
+        db.refresh(saved)
+
+    run_write(write)
+    hub.register(saved)
+    return _response(saved)
+
+
+@router.get("/api/saved-searches", response_model=List[schemas.SavedSearchResponse])
+def list_saved_searches(db: Session = Depends(get_read_db)):
+    searches = db.execute(select(models.SavedSearch).order_by(models.SavedSearch.id)).scalars().all()
+    return [_response(search) for search in searches]
+
+
+@router.delete("/api/saved-searches/{search_id}", status_code=204)
+def delete_saved_search(search_id: int):
+    def write(db: Session) -> int:
+        deleted = db.query(models.SavedSearch).filter(models.SavedSearch.id == search_id).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+    if not run_write(write):
+        raise HTTPException(status_code=404, detail=f"Búsqueda guardada {search_id} no encontrada")
+    hub.unregister(search_id)
+
+
+@router.get("/api/saved-searches/{search_id}/stream")
+async def stream_saved_search(search_id: int, request: Request):
+    """
+    Server-Sent Events con los emails nuevos que cumplen la búsqueda: un evento "emails"
+    por bloque ingresado ({"search_id", "emails": [...]}), "dropped" si el cliente no
+    alcanzó a leer, un comentario de ping cada EMAILS_PERCOLATOR_HEARTBEAT_SECONDS y
+    "deleted" (fin del stream) si se borra la búsqueda. El stream se cierra después de
+    EMAILS_PERCOLATOR_STREAM_SECONDS y EventSource reconecta solo.
+    """
+    subscriber = hub.subscribe(search_id)
+    if subscriber is None:
+        raise HTTPException(status_code=404, detail=f"Búsqueda guardada {search_id} no encontrada")
+    return StreamingResponse(
+        _events(request, subscriber),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@metrics.register_collector
+def _percolator_metrics():
+    stats = hub.stats()
+    return [
+        ("emails_saved_searches", "gauge", "Búsquedas guardadas", stats["saved_searches"]),
+        ("emails_saved_search_subscribers", "gauge", "Clientes conectados a los streams de búsquedas guardadas", stats["subscribers"]),
+        ("emails_percolator_emails_total", "counter", "Emails nuevos comparados con las búsquedas guardadas", stats["emails"]),
+        ("emails_percolator_candidates_total", "counter", "Comparaciones completas que pidió el índice invertido", stats["candidates"]),
+        ("emails_percolator_matches_total", "counter", "Emails avisados a búsquedas guardadas", stats["matches"]),
+    ]
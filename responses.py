@@ -0,0 +1,199 @@
+"""
+Capa de respuestas: JSON rápido, compresión negociada y GET condicionales
+
+- json_response: serializa con orjson dicts planos ya armados, sin jsonable_encoder ni
+  la validación de response_model (el modelo queda para la documentación)
+- CompressionMiddleware: br (si está instalado el paquete brotli) o gzip según
+  Accept-Encoding, solo para respuestas de un bloque desde EMAILS_COMPRESSION_MIN_BYTES;
+  los streams (exportación, NDJSON, SSE) pasan sin tocar
+- etag / not_modified: ETag débil armado con versiones de datos en memoria (generación
+  de la caché de búsquedas, versión del catálogo); si el cliente ya tiene esa versión se
+  responde 304 sin buscar (las búsquedas solo leen la fila de data_version). Llevan el id de este arranque: una versión no se
+  confunde con la misma de otro proceso o de antes de reiniciar
+"""
+
+import gzip
+import secrets
+import threading
+from datetime import date, datetime
+from typing import Dict, Hashable, Optional, Tuple
+import orjson
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # opcional: sin el paquete solo se ofrece gzip
+    brotli = None
+
+# Id de este arranque para los ETag
+_BOOT = secrets.token_hex(4)
+
+# Cuerpos desde este tamaño se comprimen fuera del loop
+_THREAD_COMPRESS_BYTES = 256 * 1024
+
+# Tipos que no se comprimen (ya comprimidos o streams que deben llegar de inmediato)
+_SKIP_TYPES = ("text/event-stream", "application/gzip", "image/", "video/", "audio/")
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+'serializar un payload de dicts planos a JSON (bytes UTF-8)'
+def dumps(payload) -> bytes:
+    return orjson.dumps(payload, default=_default)
+
+
+'respuesta JSON de un payload ya armado (dicts planos) sin pasar otra vez por pydantic'
+def json_response(payload, status_code: int = 200, etag: Optional[str] = None) -> Response:
+    return encoded_response(dumps(payload), status_code, etag)
+
+
+'respuesta JSON de un cuerpo ya serializado (por ejemplo guardado en un BodyCache)'
+def encoded_response(body: bytes, status_code: int = 200, etag: Optional[str] = None) -> Response:
+    response = Response(content=body, status_code=status_code, media_type="application/json")
+    if etag is not None:
+        _set_etag(response, etag)
+    return response
+
+
+# ============== GET CONDICIONALES ==============
+'ETag débil para una combinación de versiones de datos'
+def etag(*versions) -> str:
+    return 'W/"' + "-".join([_BOOT, *(str(version) for version in versions)]) + '"'
+
+
+def _set_etag(response: Response, tag: str):
+    response.headers["ETag"] = tag
+    # El cliente puede guardarla pero revalida siempre (If-None-Match)
+    response.headers["Cache-Control"] = "no-cache"
+
+
+def _opaque(tag: str) -> str:
+    # Comparación débil: W/"x" y "x" son la misma versión
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+'304 si el cliente ya tiene la versión tag (If-None-Match), si no None'
+def not_modified(request: Request, tag: str) -> Optional[Response]:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return None
+    if header.strip() != "*" and _opaque(tag) not in {_opaque(candidate) for candidate in header.split(",")}:
+        return None
+    response = Response(status_code=304)
+    _set_etag(response, tag)
+    return response
+
+
+class BodyCache:
+    """Cuerpos JSON ya serializados por clave, válidos mientras no cambie su versión de datos"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[Hashable, bytes]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Hashable) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        return entry[1] if entry is not None and entry[0] == version else None
+
+    def put(self, key: Hashable, version: Hashable, body: bytes):
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                self._entries.clear()
+            self._entries[key] = (version, body)
+
+
+# ============== COMPRESIÓN ==============
+def _negotiate(accept_encoding: str) -> Optional[str]:
+    """Codificación preferida entre las que acepta el cliente (q > 0): br, luego gzip"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip()] = quality
+    wildcard = accepted.get("*", 0.0)
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """Middleware ASGI puro: comprime respuestas de un solo bloque, deja pasar los streams"""
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = _negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        held = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Se retiene hasta saber si el cuerpo llega en un solo bloque
+                held["start"] = message
+                return
+            start = held.pop("start", None)
+            if start is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body")
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or headers.get("content-type", "").startswith(_SKIP_TYPES)
+            ):
+                await send(start)
+                await send(message)
+                return
+            headers.add_vary_header("Accept-Encoding")
+            if encoding is not None:
+                if len(body) >= _THREAD_COMPRESS_BYTES:
+                    body = await run_in_threadpool(self._compress, body, encoding)
+                else:
+                    body = self._compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse para generadores que siguen leyendo el cuerpo del request.
+    No escucha http.disconnect en paralelo (eso consumiría los mensajes del cuerpo);
+    una desconexión del cliente llega como ClientDisconnect al leer request.stream().
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
@@ -0,0 +1,179 @@
+"""
+Acumulados diarios de emails para las estadísticas (/api/stats)
+
+- stats_company_day: emails por (empresa, día)
+- stats_sender_day / stats_recipient_day: emails por (empresa, día, dirección)
+
+La ingesta los actualiza con UPSERT en la misma transacción que sus INSERT y un
+dashboard nunca recorre emails: el volumen lee O(días × empresas) filas y el top de
+emisores o destinatarios O(días × empresas × direcciones distintas por día), solo desde
+el índice que cubre el rango de días y las columnas que agrupa y suma (sin ir a la tabla).
+La retención de particiones no los toca: conservan la historia hasta el próximo rebuild.
+
+Uso por consola para recalcularlos desde los emails:
+    python rollups.py rebuild
+"""
+
+from collections import Counter
+from datetime import date
+from sqlalchemy import delete, desc, func, insert, inspect, select, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from typing import Iterable, List, Optional
+import models
+import partitions
+import schemas
+
+# (modelo, columnas además de company_id y day)
+_ROLLUPS = (
+    (models.DailyCompanyVolume, ()),
+    (models.DailySenderVolume, ("sender",)),
+    (models.DailyRecipientVolume, ("recipient",)),
+)
+
+
+'sumar filas de emails recién insertadas a los acumulados (dentro de la transacción de db)'
+def add(db: Session, rows: Iterable[dict]):
+    counters = [Counter() for _ in _ROLLUPS]
+    for row in rows:
+        day = row["date"].date()
+        for (_, keys), counter in zip(_ROLLUPS, counters):
+            counter[(row["company_id"], day) + tuple(row[key] for key in keys)] += 1
+
+    for (model, keys), counter in zip(_ROLLUPS, counters):
+        if not counter:
+            continue
+        names = ("company_id", "day") + keys
+        statement = sqlite_insert(model)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(names),
+            set_={"total": model.total + statement.excluded.total}
+        )
+        db.execute(statement, [dict(zip(names, key), total=total) for key, total in counter.items()])
+
+
+'la primera vez (acumulados vacíos y ya hay emails) los calcula desde los emails existentes'
+def ensure(engine: Engine):
+    ensure_indexes(engine)
+    with Session(engine) as db:
+        if db.execute(select(models.DailyCompanyVolume.day).limit(1)).first() is not None:
+            return
+        empty = all(db.execute(select(table.c.id).limit(1)).first() is None for table in partitions.registry.tables(db))
+    if not empty:
+        rebuild(engine)
+
+
+'crear los índices de los acumulados que falten en tablas ya existentes (create_all solo los crea con la tabla)'
+def ensure_indexes(engine: Engine):
+    with engine.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        for model, _ in _ROLLUPS:
+            if model.__tablename__ in existing:
+                for index in model.__table__.indexes:
+                    index.create(conn, checkfirst=True)
+        # El índice solo por día de los tops quedó cubierto por el índice que cubre el rango
+        for table in ("stats_sender_day", "stats_recipient_day"):
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS ix_{table}_day")
+
+'recalcular todos los acumulados desde emails y sus particiones'
+def rebuild(engine: Engine):
+    with Session(engine) as db:
+        tables = partitions.registry.tables(db)
+        for model, keys in _ROLLUPS:
+            db.execute(delete(model))
+            # Una sola agregación sobre todas las tablas (emails puede compartir días con una partición)
+            source = union_all(*(
+                select(table.c.company_id, func.date(table.c.date).label("day"), *(table.c[key] for key in keys))
+                for table in tables
+            )).subquery()
+            group = [source.c.company_id, source.c.day, *(source.c[key] for key in keys)]
+            db.execute(insert(model).from_select(
+                ["company_id", "day", *keys, "total"],
+                select(*group, func.count()).group_by(*group)
+            ))
+        db.commit()
+
+
+def _filtered(query, model, date_from: Optional[date], date_to: Optional[date], company_ids: Optional[List[int]]):
+    if date_from:
+        query = query.where(model.day >= date_from)
+    if date_to:
+        query = query.where(model.day <= date_to)
+    if company_ids is not None:
+        query = query.where(model.company_id.in_(company_ids))
+    return query
+
+
+'volumen de emails en [date_from, date_to] agrupado por día, empresa o ambos, retorna [(día, company_id, total)]'
+def volume(
+    db: Session,
+    group_by: schemas.StatsGroupBy,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    company_ids: Optional[List[int]] = None
+) -> List[tuple]:
+    model = models.DailyCompanyVolume
+    day = model.day if group_by != schemas.StatsGroupBy.company else None
+    company = model.company_id if group_by != schemas.StatsGroupBy.day else None
+    group = [column for column in (day, company) if column is not None]
+    query = _filtered(select(*group, func.sum(model.total)), model, date_from, date_to, company_ids)
+    rows = db.execute(query.group_by(*group).order_by(*group)).all()
+    return [
+        (row[0] if day is not None else None, row[-2] if company is not None else None, row[-1])
+        for row in rows
+    ]
+
+
+'emisores o destinatarios (field) con más emails en el rango (limit None = todos), retorna [(dirección, total)]'
+def top(
+    db: Session,
+    field: str,
+    limit: Optional[int] = 10,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    company_ids: Optional[List[int]] = None
+) -> List[tuple]:
+    model = models.DailySenderVolume if field == "sender" else models.DailyRecipientVolume
+    address = getattr(model, field)
+    total = func.sum(model.total).label("total")
+    query = _filtered(select(address, total), model, date_from, date_to, company_ids)
+    return db.execute(query.group_by(address).order_by(desc("total"), address).limit(limit)).all()
+
+
+# ============== SHARDS (EMAILS_SHARDING=company) ==============
+'sumar los resultados de volume de varios shards, mismo formato y orden que volume'
+def merge_volume(results: Iterable[List[tuple]]) -> List[tuple]:
+    totals = Counter()
+    for rows in results:
+        for day, company_id, total in rows:
+            totals[(day, company_id)] += total
+    return [
+        (day, company_id, total)
+        for (day, company_id), total in sorted(totals.items(), key=lambda item: (item[0][0] or date.min, item[0][1] or 0))
+    ]
+
+
+'sumar los resultados de top (sin límite) de varios shards, retorna los limit mayores'
+def merge_top(results: Iterable[List[tuple]], limit: int) -> List[tuple]:
+    totals = Counter()
+    for rows in results:
+        for address, total in rows:
+            totals[address] += total
+    return sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+
+if __name__ == "__main__":
+    import argparse
+    import shards
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Acumulados diarios de las estadísticas")
+    parser.add_argument("command", choices=["rebuild"])
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=engine)
+    # Con shards por empresa cada archivo tiene sus acumulados
+    for target in [engine] + (shards.registry.engines() if shards.SHARDED else []):
+        rebuild(target)
+    print("Acumulados recalculados")
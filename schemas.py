@@ -1,6 +1,7 @@
 
 from pydantic import BaseModel, Field, EmailStr
-from datetime import datetime
+from datetime import date, datetime
+from enum import Enum
 from typing import List, Optional
 
 
@@ -72,6 +73,12 @@ class EmailBulkCreate(BaseModel):
             }
         }
 
+'fragmento del cuerpo alrededor de coincidencias de la búsqueda (snippet=true)'
+class SnippetFragment(BaseModel):
+    offset: int = Field(..., description="Posición del fragmento en el cuerpo (caracteres)")
+    text: str = Field(..., description="Texto del fragmento")
+    highlights: List[List[int]] = Field(..., description="Coincidencias [inicio, fin) dentro de text")
+
 'Esquema para RESPONDER con datos de un email'
 class EmailResponse(BaseModel):
     id: int
@@ -82,6 +89,7 @@ class EmailResponse(BaseModel):
     smtp_code: str
     content: str
     created_at: datetime
+    snippet: Optional[List[SnippetFragment]] = None  # Solo con snippet=true (sin content)
     
     class Config:
         from_attributes = True
@@ -93,11 +101,122 @@ class EmailBulkResponse(BaseModel):
     errors: List[dict] = Field(default=[], description="Lista de errores ocurridos")
 
 
+# ============== ESQUEMAS PARA TRABAJOS DE IMPORTACIÓN ==============
+'Esquema para RESPONDER con el estado de un trabajo de importación'
+class ImportJobResponse(BaseModel):
+    id: str
+    status: str = Field(..., description="queued, running, done o failed")
+    total: int = Field(..., description="Cantidad de emails del lote")
+    processed: int = Field(..., description="Emails procesados hasta ahora")
+    success: int = Field(..., description="Emails guardados exitosamente")
+    failed: int = Field(..., description="Emails que fallaron")
+    error: Optional[str] = Field(None, description="Error que detuvo el trabajo completo")
+    errors: List[dict] = Field(default=[], description="Errores por email (paginados)")
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
 # ============== ESQUEMAS PARA BÚSQUEDA ==============
+'modo de búsqueda sobre el contenido: substring (LIKE) o el índice FTS5'
+class SearchMode(str, Enum):
+    substring = "substring"  # LIKE '%texto%' (comportamiento original)
+    token = "token"          # todas las palabras, en cualquier orden
+    phrase = "phrase"        # la frase exacta
+    prefix = "prefix"        # palabras que empiezan por cada término
+
+'formato de la exportación de resultados'
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+
+'cómo calcular el total de resultados de una búsqueda'
+class TotalMode(str, Enum):
+    false = "false"        # no contar (más rápido)
+    exact = "exact"        # count() sobre todo el filtro
+    estimate = "estimate"  # cuenta acotada: cota inferior si hay muchos resultados
+
 'respuesta de la búsqueda con paginación'
 class EmailSearchResponse(BaseModel):
-    total: int = Field(..., description="Total de emails encontrados")
+    total: Optional[int] = Field(..., description="Total de emails encontrados (null con with_total=false)")
+    total_estimated: bool = Field(False, description="True si total es una cota inferior (with_total=estimate)")
     page: int = Field(..., description="Página actual")
     page_size: int = Field(..., description="Cantidad de emails por página")
-    total_pages: int = Field(..., description="Total de páginas disponibles")
-    emails: List[EmailResponse] = Field(..., description="Lista de emails en esta página")
\ No newline at end of file
+    total_pages: Optional[int] = Field(..., description="Total de páginas disponibles (null con with_total=false)")
+    emails: List[EmailResponse] = Field(..., description="Lista de emails en esta página")
+
+'respuesta de la búsqueda con paginación por cursor'
+class EmailCursorSearchResponse(BaseModel):
+    total: Optional[int] = Field(None, description="Total de emails encontrados (solo si se pide with_total)")
+    total_estimated: bool = Field(False, description="True si total es una cota inferior (with_total=estimate)")
+    page_size: int = Field(..., description="Cantidad de emails por página")
+    next_cursor: Optional[str] = Field(..., description="Cursor de la siguiente página (null si es la última)")
+    emails: List[EmailResponse] = Field(..., description="Lista de emails en esta página")
+
+# ============== ESQUEMAS PARA ESTADÍSTICAS ==============
+'cómo agrupar el volumen de emails'
+class StatsGroupBy(str, Enum):
+    day = "day"                  # total por día (todas las empresas filtradas)
+    company = "company"          # total por empresa en el rango
+    company_day = "company_day"  # por empresa y día
+
+'un punto del volumen de emails'
+class VolumePoint(BaseModel):
+    day: Optional[date] = Field(None, description="Día (agrupando por day o company_day)")
+    company_name: Optional[str] = Field(None, description="Empresa (agrupando por company o company_day)")
+    emails: int = Field(..., description="Cantidad de emails")
+
+'respuesta del volumen de emails en un rango de días'
+class StatsVolumeResponse(BaseModel):
+    total: int = Field(..., description="Total de emails en el rango")
+    points: List[VolumePoint] = Field(..., description="Volumen agrupado")
+
+'una dirección con su cantidad de emails'
+class TopAddress(BaseModel):
+    address: str
+    emails: int
+
+'respuesta de los emisores o destinatarios con más emails'
+class StatsTopResponse(BaseModel):
+    items: List[TopAddress] = Field(..., description="Direcciones de mayor a menor cantidad de emails")
+
+
+# ============== ESQUEMAS PARA AUTOCOMPLETADO ==============
+'campos que se pueden autocompletar en /api/suggest'
+class SuggestField(str, Enum):
+    sender = "sender"
+    recipient = "recipient"
+    company = "company"
+
+'un valor sugerido con su cantidad de emails'
+class SuggestItem(BaseModel):
+    value: str
+    emails: int
+
+'respuesta del autocompletado'
+class SuggestResponse(BaseModel):
+    field: SuggestField
+    prefix: str
+    items: List[SuggestItem] = Field(..., description="Valores que empiezan con el prefijo, de más a menos emails")
+
+
+# ============== ESQUEMAS PARA BÚSQUEDAS GUARDADAS ==============
+'esquema para GUARDAR una búsqueda (mismos filtros que /api/emails/search)'
+class SavedSearchCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=200, description="Nombre de la búsqueda")
+    content: str = Field(..., min_length=1, description="Texto a buscar en el contenido (obligatorio)")
+    mode: SearchMode = Field(SearchMode.substring, description="substring, token, phrase o prefix")
+    recipient: Optional[str] = Field(None, max_length=255, description="Filtrar por destinatario")
+    sender: Optional[str] = Field(None, max_length=255, description="Filtrar por emisor")
+    company_name: Optional[str] = Field(None, max_length=200, description="Filtrar por nombre de empresa")
+    date_from: Optional[datetime] = Field(None, description="Desde la fecha")
+    date_to: Optional[datetime] = Field(None, description="Hasta la fecha")
+
+'esquema para RESPONDER con una búsqueda guardada'
+class SavedSearchResponse(SavedSearchCreate):
+    id: int
+    created_at: datetime
+    subscribers: int = Field(0, description="Clientes conectados a su stream")
+    
+    class Config:
+        from_attributes = True
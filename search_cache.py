@@ -0,0 +1,176 @@
+"""
+Caché en memoria de resultados de búsqueda (LRU + TTL)
+
+Cada escritura de emails incrementa un contador de generación que vacía la caché,
+así nunca se sirven resultados anteriores a un lote nuevo.
+Los cambios hechos por otro proceso (la retención desde la consola) suben la versión
+guardada en la tabla data_version; cada búsqueda la compara (sync) antes de usar la caché
+o la generación de los ETag.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Hashable, Optional
+from sqlalchemy import select, update
+import metrics
+import models
+import settings
+
+# Costo fijo aproximado por entrada y por fila (dicts, tuplas, claves)
+_ENTRY_OVERHEAD = 256
+_ROW_OVERHEAD = 64
+
+
+class SearchCache:
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = 0
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._data_version = None  # última versión de data_version vista
+        self._entries = OrderedDict()  # clave -> (expira, tamaño, valor)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Retorna el valor guardado o None (cuenta hit/miss)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, size, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.size_bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, size: int, generation: int):
+        """
+        Guarda un valor calculado durante la generación indicada.
+        Si hubo escrituras mientras se calculaba, el valor ya está viejo y se descarta.
+        """
+        size += _ENTRY_OVERHEAD
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= old[1]
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                self.evictions += 1
+
+    def sync(self, version: int):
+        """Nueva generación si la versión de los datos en la BD cambió desde la última vista"""
+        if version == self._data_version:
+            return
+        with self._lock:
+            first = self._data_version is None
+            self._data_version = version
+        if not first:
+            self.invalidate()
+
+    def invalidate(self):
+        """Nueva generación de datos: descarta todo lo guardado"""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.size_bytes = 0
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "generation": self.generation,
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+'versión de los datos guardada en la BD (0 si nunca se cambió fuera del servidor)'
+def data_version(db) -> int:
+    return db.execute(select(models.DataVersion.version).where(models.DataVersion.id == 1)).scalar() or 0
+
+
+'subir la versión de los datos dentro de la transacción de db (Session o Connection)'
+def bump_data_version(db):
+    table = models.DataVersion.__table__
+    updated = db.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1)).rowcount
+    if not updated:
+        db.execute(table.insert().values(id=1, version=1))
+
+
+cache = SearchCache(
+    max_entries=settings.SEARCH_CACHE_MAX_ENTRIES,
+    max_bytes=settings.SEARCH_CACHE_MAX_BYTES,
+    ttl=settings.SEARCH_CACHE_TTL,
+)
+
+
+@metrics.register_collector
+def _cache_metrics():
+    stats = cache.stats()
+    return [
+        ("emails_search_cache_hits_total", "counter", "Aciertos de la caché de búsquedas", stats["hits"]),
+        ("emails_search_cache_misses_total", "counter", "Fallos de la caché de búsquedas", stats["misses"]),
+        ("emails_search_cache_evictions_total", "counter", "Entradas desalojadas por LRU o presupuesto de memoria", stats["evictions"]),
+        ("emails_search_cache_expirations_total", "counter", "Entradas vencidas por TTL", stats["expirations"]),
+        ("emails_search_cache_invalidations_total", "counter", "Invalidaciones por escrituras (generaciones)", stats["invalidations"]),
+        ("emails_search_cache_entries", "gauge", "Entradas en la caché de búsquedas", stats["entries"]),
+        ("emails_search_cache_bytes", "gauge", "Memoria aproximada de la caché de búsquedas", stats["size_bytes"]),
+    ]
+
+
+def _normalize(value):
+    # Igual que search_emails: un filtro vacío equivale a no filtrar
+    if isinstance(value, str):
+        return value or None
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+'firma normalizada de un conjunto de filtros (misma búsqueda = misma firma)'
+def signature(**filters) -> tuple:
+    return tuple(sorted((name, _normalize(value)) for name, value in filters.items()))
+
+
+'tamaño aproximado en bytes de una lista de filas (dicts)'
+def estimate_size(rows) -> int:
+    size = 0
+    for row in rows:
+        size += _ROW_OVERHEAD
+        for value in row.values():
+            size += len(value) if isinstance(value, str) else 16
+    return size
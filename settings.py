@@ -0,0 +1,85 @@
+
+import os
+
+'Configuración de la aplicación (se puede sobreescribir con variables de entorno)'
+# Tamaño de lote para la ingesta masiva
+# 0 = todo el lote se inserta en una sola transacción
+INGEST_CHUNK_SIZE = int(os.getenv("EMAILS_INGEST_CHUNK_SIZE", "0"))
+
+# Máximo de filas que cuenta la búsqueda con with_total=estimate
+SEARCH_ESTIMATE_CAP = int(os.getenv("EMAILS_SEARCH_ESTIMATE_CAP", "10000"))
+
+# Caché de resultados de búsqueda (max_bytes = 0 la desactiva)
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("EMAILS_SEARCH_CACHE_MAX_ENTRIES", "1024"))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv("EMAILS_SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+SEARCH_CACHE_TTL = float(os.getenv("EMAILS_SEARCH_CACHE_TTL", "60"))
+
+# Ingesta en streaming (NDJSON): emails por bloque y tamaño máximo de una línea
+NDJSON_CHUNK_SIZE = int(os.getenv("EMAILS_NDJSON_CHUNK_SIZE", "1000"))
+NDJSON_MAX_LINE_BYTES = int(os.getenv("EMAILS_NDJSON_MAX_LINE_BYTES", str(16 * 1024 * 1024)))
+
+# Ingesta por columnas: tamaño máximo del lote descomprimido (Content-Encoding: gzip)
+COLUMNAR_MAX_BYTES = int(os.getenv("EMAILS_COLUMNAR_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Trabajos de importación en segundo plano
+JOBS_WORKERS = int(os.getenv("EMAILS_JOBS_WORKERS", "2"))
+JOBS_MAX_BACKLOG = int(os.getenv("EMAILS_JOBS_MAX_BACKLOG", "100"))
+JOBS_CHUNK_SIZE = int(os.getenv("EMAILS_JOBS_CHUNK_SIZE", "1000"))
+# Un trabajo en curso cuyo proceso no renovó el reclamo en este tiempo se puede retomar
+JOBS_LEASE_SECONDS = float(os.getenv("EMAILS_JOBS_LEASE_SECONDS", "120"))
+
+# Base de datos
+DATABASE_URL = os.getenv("EMAILS_DATABASE_URL", "sqlite:///./emails.db")
+
+# Perfil de almacenamiento SQLite
+# default: un solo engine sin pragmas (comportamiento original)
+# production: WAL + pragmas, un hilo escritor con cola de escrituras y un pool de lectura de solo lectura
+STORAGE_PROFILE = os.getenv("EMAILS_STORAGE_PROFILE", "default")
+SQLITE_SYNCHRONOUS = os.getenv("EMAILS_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("EMAILS_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("EMAILS_SQLITE_CACHE_SIZE", "-65536"))  # negativo = KiB
+SQLITE_BUSY_TIMEOUT = int(os.getenv("EMAILS_SQLITE_BUSY_TIMEOUT", "5000"))  # ms
+READ_POOL_SIZE = int(os.getenv("EMAILS_READ_POOL_SIZE", "4"))
+
+# Segundos entre revalidaciones del catálogo de empresas en memoria (0 = no revalidar)
+COMPANY_CACHE_REVALIDATE_SECONDS = float(os.getenv("EMAILS_COMPANY_CACHE_REVALIDATE_SECONDS", "30"))
+
+# Compresión de respuestas: tamaño mínimo (0 = sin compresión), nivel gzip y calidad brotli
+COMPRESSION_MIN_BYTES = int(os.getenv("EMAILS_COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("EMAILS_COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("EMAILS_COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Métricas por request y endpoint /metrics
+METRICS_ENABLED = os.getenv("EMAILS_METRICS_ENABLED", "1") not in ("0", "false", "False")
+
+# Registro de consultas lentas (opt-in)
+SLOW_QUERY_ENABLED = os.getenv("EMAILS_SLOW_QUERY_ENABLED", "0") in ("1", "true", "True")
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("EMAILS_SLOW_QUERY_THRESHOLD_MS", "100"))
+SLOW_QUERY_BUFFER_SIZE = int(os.getenv("EMAILS_SLOW_QUERY_BUFFER_SIZE", "1000"))
+
+# Filas por bloque del cursor de la exportación
+EXPORT_BATCH_SIZE = int(os.getenv("EMAILS_EXPORT_BATCH_SIZE", "1000"))
+
+# Cuerpos de email comprimidos (email_bodies)
+BODY_COMPRESSION_LEVEL = int(os.getenv("EMAILS_BODY_COMPRESSION_LEVEL", "6"))
+BODY_MIGRATION_BATCH_SIZE = int(os.getenv("EMAILS_BODY_MIGRATION_BATCH_SIZE", "5000"))
+# Índice de trigramas de los cuerpos (opt-in): subcadenas sin descomprimir, a cambio de más del doble de espacio
+BODY_TRIGRAM_INDEX = os.getenv("EMAILS_BODY_TRIGRAM_INDEX", "0") in ("1", "true", "True")
+
+# Particiones por mes de la tabla emails (none | monthly) y retención en meses (0 = sin retención)
+PARTITIONING = os.getenv("EMAILS_PARTITIONING", "none")
+RETENTION_MONTHS = int(os.getenv("EMAILS_RETENTION_MONTHS", "0"))
+
+# Filtro de Bloom de smtp_code: capacidad (0 = desactivado) y tasa de falsos positivos
+SMTP_FILTER_CAPACITY = int(os.getenv("EMAILS_SMTP_FILTER_CAPACITY", "10000000"))
+SMTP_FILTER_FP_RATE = float(os.getenv("EMAILS_SMTP_FILTER_FP_RATE", "0.001"))
+
+# Shards por empresa (none | company): carpeta de los archivos e hilos para escribir y buscar en paralelo
+SHARDING = os.getenv("EMAILS_SHARDING", "none")
+SHARD_DIR = os.getenv("EMAILS_SHARD_DIR", "./shards")
+SHARD_WORKERS = int(os.getenv("EMAILS_SHARD_WORKERS", "8"))
+
+# Búsquedas guardadas: eventos pendientes por cliente del stream, segundos entre pings y duración de cada stream
+PERCOLATOR_QUEUE_SIZE = int(os.getenv("EMAILS_PERCOLATOR_QUEUE_SIZE", "1000"))
+PERCOLATOR_HEARTBEAT_SECONDS = float(os.getenv("EMAILS_PERCOLATOR_HEARTBEAT_SECONDS", "15"))
+PERCOLATOR_STREAM_SECONDS = float(os.getenv("EMAILS_PERCOLATOR_STREAM_SECONDS", "300"))
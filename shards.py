@@ -0,0 +1,211 @@
+"""
+Shards por empresa: los emails de cada empresa en su propio archivo SQLite
+
+Con EMAILS_SHARDING=company la BD principal guarda el catálogo (empresas, trabajos y el
+mapa de shards) y los emails de cada empresa van a EMAILS_SHARD_DIR/company_<id>.db, con
+su lock de escritura, sus índices FTS/trigramas y sus acumulados: la importación grande de
+una empresa ya no frena las escrituras ni las búsquedas de las demás.
+
+- company_shards: empresa -> archivo, se asigna al crear la empresa (las empresas de antes
+  de activar los shards reciben el suyo la primera vez que se usan)
+- ids globales: el shard de la empresa N numera desde N * SHARD_ID_SPAN (email_id_sequence),
+  el id de un email no se repite entre shards y dice a qué empresa pertenece
+- write: cada grupo de emails en el shard de su empresa, en paralelo entre shards
+- scatter: una función en cada shard que puede tener resultados (todos o solo los de las
+  empresas pedidas) en un pool de hilos; los emails que quedaron en la BD principal (de
+  antes de activar los shards) entran como un shard más
+- smtp_codes: el registro global de códigos vive en la BD principal (ver ingest.write_items);
+  ensure_codes lo llena desde los shards si es de antes del registro
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, sessionmaker
+from typing import Callable, Dict, Iterable, List, Optional, TypeVar
+import fts
+import metrics
+import models
+import partitions
+import rollups
+import settings
+import slow_queries
+from database import ReadSessionLocal, SessionLocal, create_file_engine, run_write
+
+SHARDED = settings.SHARDING == "company"
+
+# Ids reservados por empresa: el shard de la empresa N numera desde N * SHARD_ID_SPAN
+SHARD_ID_SPAN = 1 << 40
+
+# Tablas de cada shard: los emails y lo que se escribe en su misma transacción
+_SHARD_TABLES = [
+    models.EmailBody.__table__,
+    models.Email.__table__,
+    models.EmailIdSequence.__table__,
+    models.DailyCompanyVolume.__table__,
+    models.DailySenderVolume.__table__,
+    models.DailyRecipientVolume.__table__,
+]
+
+# Pools separados: las lecturas en todos los shards no esperan detrás de las escrituras
+_write_pool = ThreadPoolExecutor(max_workers=settings.SHARD_WORKERS, thread_name_prefix="shard-write")
+_read_pool = ThreadPoolExecutor(max_workers=settings.SHARD_WORKERS, thread_name_prefix="shard-read")
+
+T = TypeVar("T")
+
+
+'empresa dueña de un id de email (None si es de la BD principal)'
+def company_for_id(email_id: int) -> Optional[int]:
+    return email_id // SHARD_ID_SPAN or None
+
+
+def _path(company_id: int) -> str:
+    return os.path.join(settings.SHARD_DIR, f"company_{company_id}.db")
+
+
+class Shard:
+    def __init__(self, company_id: int, path: str):
+        self.company_id = company_id
+        self.path = path
+        self.engine = create_file_engine(f"sqlite:///{path}")
+        self.Session = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        # Un escritor por shard: los shards se escriben en paralelo entre sí
+        self.write_lock = threading.Lock()
+
+    def prepare(self):
+        """Crear las tablas, los índices de texto y la secuencia de ids del shard si faltan"""
+        metrics.instrument_engines(self.engine)
+        slow_queries.instrument_engines(self.engine)
+        models.Base.metadata.create_all(bind=self.engine, tables=_SHARD_TABLES)
+        rollups.ensure_indexes(self.engine)
+        fts.ensure_fts(self.engine)
+        with Session(self.engine) as db:
+            if db.get(models.EmailIdSequence, 1) is None:
+                db.add(models.EmailIdSequence(id=1, next_id=self.company_id * SHARD_ID_SPAN + 1))
+                db.commit()
+
+
+class ShardRegistry:
+    """Shards abiertos por empresa, releídos de company_shards cada COMPANY_CACHE_REVALIDATE_SECONDS"""
+
+    def __init__(self):
+        self._shards: Dict[int, Shard] = {}
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # La BD principal todavía tiene emails (de antes de activar los shards)
+        self._legacy = False
+
+    def _open(self, company_id: int, path: str) -> Shard:
+        # Con self._lock tomado
+        shard = self._shards.get(company_id)
+        if shard is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            shard = Shard(company_id, path)
+            shard.prepare()
+            self._shards[company_id] = shard
+        return shard
+
+    def load(self):
+        with SessionLocal() as db:
+            rows = db.execute(select(models.CompanyShard.company_id, models.CompanyShard.path)).all()
+            legacy = any(
+                db.execute(select(table.c.id).limit(1)).first() is not None
+                for table in partitions.registry.tables(db)
+            )
+        with self._lock:
+            for company_id, path in rows:
+                self._open(company_id, path)
+            self._legacy = legacy
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > settings.COMPANY_CACHE_REVALIDATE_SECONDS:
+            self.load()
+
+    def for_company(self, company_id: int) -> Shard:
+        """Shard de la empresa; si aún no tiene, se le asigna uno"""
+        shard = self._shards.get(company_id)
+        if shard is not None:
+            return shard
+        def assign_missing(db: Session) -> str:
+            entry = db.get(models.CompanyShard, company_id)
+            if entry is None:
+                entry = models.CompanyShard(company_id=company_id, path=_path(company_id))
+                db.add(entry)
+                db.commit()
+            return entry.path
+
+        with self._lock:
+            # En el escritor de la BD principal (run_write), como las demás escrituras
+            return self._open(company_id, run_write(assign_missing))
+
+    def engines(self) -> list:
+        """Motores de todos los shards (mantenimiento por consola)"""
+        self._ensure_loaded()
+        return [shard.engine for shard in sorted(self._shards.values(), key=lambda shard: shard.company_id)]
+
+    def targets(self, company_ids: Optional[Iterable[int]] = None) -> List[sessionmaker]:
+        """Fábricas de sesión de los shards que pueden tener emails de esas empresas (None = todas)"""
+        self._ensure_loaded()
+        if company_ids is None:
+            shards = list(self._shards.values())
+        else:
+            # Una empresa sin shard todavía no tiene emails
+            shards = [self._shards[company_id] for company_id in company_ids if company_id in self._shards]
+        factories = [shard.Session for shard in sorted(shards, key=lambda shard: shard.company_id)]
+        if self._legacy:
+            factories.insert(0, ReadSessionLocal)
+        return factories
+
+    def scatter(self, company_ids: Optional[Iterable[int]], fn: Callable[[Session], T]) -> List[T]:
+        """fn(db) en cada shard que puede tener emails de esas empresas, en paralelo"""
+        def run(factory):
+            with factory() as db:
+                return fn(db)
+        factories = self.targets(company_ids)
+        if len(factories) <= 1:
+            return [run(factory) for factory in factories]
+        return list(_read_pool.map(run, factories))
+
+    def write(self, groups: Dict[int, T], fn: Callable[[Session, T], dict]) -> List[dict]:
+        """fn(db, grupo) en el shard de cada empresa con su lock de escritura, en paralelo entre shards"""
+        def run(company_id, group):
+            shard = self.for_company(company_id)
+            with shard.write_lock, shard.Session() as db:
+                return fn(db, group)
+        futures = [_write_pool.submit(run, company_id, group) for company_id, group in groups.items()]
+        return [future.result() for future in futures]
+
+
+registry = ShardRegistry()
+
+
+'asignar el archivo de emails de una empresa nueva (dentro de la transacción de db que la crea)'
+def assign(db: Session, company_id: int):
+    if SHARDED:
+        db.add(models.CompanyShard(company_id=company_id, path=_path(company_id)))
+
+
+'llenar smtp_codes de la BD principal con los códigos de todos los shards si está vacía (BD anterior al registro)'
+def ensure_codes():
+    if not SHARDED:
+        return
+    with SessionLocal() as db:
+        if db.execute(select(models.SmtpCode.code).limit(1)).first() is not None:
+            return
+
+    def load(db: Session) -> List[str]:
+        return [code for table in partitions.registry.tables(db) for code in db.execute(select(table.c.smtp_code)).scalars()]
+
+    with SessionLocal() as db:
+        for codes in registry.scatter(None, load):
+            for start in range(0, len(codes), 500):
+                db.execute(
+                    insert(models.SmtpCode).on_conflict_do_nothing(),
+                    [{"code": code} for code in codes[start:start + 500]]
+                )
+        db.commit()
@@ -0,0 +1,131 @@
+"""
+Registro de consultas lentas con su plan de SQLite (EXPLAIN QUERY PLAN)
+
+Opt-in con EMAILS_SLOW_QUERY_ENABLED=1. Cada sentencia que supera el umbral se guarda en un
+buffer circular con el SQL normalizado, la forma de los filtros de la búsqueda (qué filtros
+venían, no sus valores), la duración y el plan.
+"""
+
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+from sqlalchemy import event
+import settings
+
+_shape: ContextVar[Optional[str]] = ContextVar("slow_query_shape", default=None)
+
+_entries = deque(maxlen=settings.SLOW_QUERY_BUFFER_SIZE)
+_plans: Dict[str, str] = {}  # SQL normalizado -> plan (se explica una sola vez)
+_lock = threading.Lock()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAM_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_SPACES = re.compile(r"\s+")
+
+
+'SQL sin literales y con las listas IN (?, ?, ...) colapsadas'
+def normalize(statement: str) -> str:
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _PARAM_LIST.sub("?...", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+'marcar las consultas ejecutadas dentro del bloque con la forma de los filtros'
+@contextmanager
+def shape(**filters):
+    present = ",".join(
+        f"{name}={value}" if isinstance(value, str) else name
+        for name, value in filters.items()
+        if value not in (None, False, "")
+    )
+    token = _shape.set(present or "-")
+    try:
+        yield
+    finally:
+        _shape.reset(token)
+
+
+def _explain(connection, statement: str, parameters) -> str:
+    cursor = connection.cursor()
+    try:
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return "\n".join(row[-1] for row in cursor.fetchall())
+    except Exception as e:
+        return f"(sin plan: {e})"
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["slow_query_started"].pop()
+    if elapsed * 1000 < settings.SLOW_QUERY_THRESHOLD_MS:
+        return
+    normalized = normalize(statement)
+    plan = _plans.get(normalized)
+    if plan is None and not executemany and normalized.upper().startswith(("SELECT", "WITH")):
+        plan = _explain(cursor.connection, statement, parameters)
+        with _lock:
+            _plans[normalized] = plan
+    with _lock:
+        _entries.append({
+            "sql": normalized,
+            "shape": _shape.get() or "-",
+            "duration_ms": round(elapsed * 1000, 3),
+            "plan": plan,
+            "at": time.time(),
+        })
+
+
+'registrar el recolector en los engines indicados (solo si está activado)'
+def instrument_engines(*engines):
+    if not settings.SLOW_QUERY_ENABLED:
+        return
+    for engine in set(engines):
+        if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+'peores consultas agrupadas por (forma de filtros, SQL normalizado), ordenadas por tiempo total'
+def worst(limit: int = 20) -> List[dict]:
+    with _lock:
+        entries = list(_entries)
+    groups = {}
+    for entry in entries:
+        key = (entry["shape"], entry["sql"])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {
+                "shape": entry["shape"],
+                "sql": entry["sql"],
+                "count": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "plan": entry["plan"],
+                "last_at": entry["at"],
+            }
+        group["count"] += 1
+        group["total_ms"] += entry["duration_ms"]
+        group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+        group["last_at"] = max(group["last_at"], entry["at"])
+    result = sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)[:limit]
+    for group in result:
+        group["total_ms"] = round(group["total_ms"], 3)
+        group["avg_ms"] = round(group["total_ms"] / group["count"], 3)
+    return result
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _plans.clear()
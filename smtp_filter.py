@@ -0,0 +1,206 @@
+"""
+Filtro de Bloom en memoria con todos los smtp_code guardados
+
+La validación de la ingesta le pregunta primero al filtro: un "no está" es seguro y ese
+código no se consulta en la BD; un "puede estar" se confirma contra el índice único.
+Se construye al arrancar en un hilo con una lectura en streaming de emails y sus
+particiones (mientras tanto todo se confirma en la BD) y cada INSERT agrega sus códigos
+dentro de la transacción: si se revierte solo quedan falsos positivos, nunca negativos falsos.
+Con particiones mensuales el índice único es por tabla, así que antes de cada consulta
+se cargan los códigos que insertaron otros procesos (ids nuevos de email_id_sequence).
+Con shards por empresa no se usa: la unicidad la decide la reserva de cada código en el
+registro smtp_codes de la BD principal (ver ingest.write_items), que ya ven todos los procesos.
+
+Tamaño: EMAILS_SMTP_FILTER_CAPACITY códigos con EMAILS_SMTP_FILTER_FP_RATE de falsos
+positivos (bits = -n·ln p / ln²2). Con capacidad 0 se desactiva. Los códigos de emails
+borrados por la retención siguen en el filtro hasta el próximo arranque (solo falsos positivos).
+"""
+
+import hashlib
+import logging
+import math
+import threading
+from typing import Iterable, List, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+import metrics
+import models
+import partitions
+import settings
+import shards
+from database import ReadSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Filas por lectura al construir el filtro
+BUILD_BATCH_SIZE = 10000
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.bit_count = max(64, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.items = 0
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._bits)
+
+    def _positions(self, key: str):
+        # Doble hashing (Kirsch-Mitzenmacher) sobre un solo blake2b de 128 bits
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        with self._lock:
+            added = False
+            for position in positions:
+                mask = 1 << (position & 7)
+                if not self._bits[position >> 3] & mask:
+                    self._bits[position >> 3] |= mask
+                    added = True
+            if added:
+                self.items += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def estimated_fp_rate(self) -> float:
+        """Tasa de falsos positivos esperada con los códigos cargados hasta ahora"""
+        return (1 - math.exp(-self.hash_count * self.items / self.bit_count)) ** self.hash_count
+
+
+class SmtpCodeFilter:
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self._bloom: Optional[BloomFilter] = None     # publicado cuando termina la carga
+        self._building: Optional[BloomFilter] = None  # en construcción (recibe los INSERT)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._loaded_until = 0  # ids menores ya están en el filtro (particiones)
+        self.lookups = 0
+        self.skipped = 0
+        self.false_positives = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._bloom is not None
+
+    def start(self):
+        """Construye el filtro en segundo plano"""
+        if self.capacity <= 0 or self._thread is not None:
+            return
+        self._building = BloomFilter(self.capacity, self.fp_rate)
+        self._thread = threading.Thread(target=self._build, name="smtp-filter", daemon=True)
+        self._thread.start()
+
+    def _build(self):
+        bloom = self._building
+        db = ReadSessionLocal()
+        try:
+            # Misma transacción de lectura: la secuencia y las filas son del mismo instante
+            next_id = _next_id(db)
+            last_id = _load_codes(db, bloom)
+            self._loaded_until = next_id or last_id + 1
+        except Exception:
+            logger.exception("No se pudo construir el filtro de smtp_code; se consultará siempre la BD")
+            self._building = None
+            return
+        finally:
+            db.close()
+        self._bloom = bloom
+        logger.info("Filtro de smtp_code listo: %d códigos, %d bytes", bloom.items, bloom.size_bytes)
+
+    def _catch_up(self, db: Session, bloom: BloomFilter):
+        """Agregar los emails con id asignado después de la última carga (otros procesos)"""
+        next_id = _next_id(db)
+        loaded_until = self._loaded_until
+        if next_id is None or next_id <= loaded_until:
+            return
+        for table in partitions.registry.tables(db):
+            for code in db.execute(select(table.c.smtp_code).where(table.c.id >= loaded_until)).scalars():
+                bloom.add(code)
+        self._loaded_until = max(self._loaded_until, next_id)
+
+    def candidates(self, codes: Iterable[str], db: Optional[Session] = None) -> List[str]:
+        """Códigos que pueden estar guardados (los demás seguro que no)"""
+        codes = list(codes)
+        bloom = self._bloom
+        if bloom is not None and db is not None and partitions.MONTHLY:
+            self._catch_up(db, bloom)
+        possible = codes if bloom is None else [code for code in codes if code in bloom]
+        with self._lock:
+            self.lookups += len(codes)
+            self.skipped += len(codes) - len(possible)
+        return possible
+
+    def add_many(self, codes: Iterable[str]):
+        bloom = self._building
+        if bloom is None:
+            return
+        for code in codes:
+            bloom.add(code)
+
+    def record_confirmed(self, positives: int, found: int):
+        """positives códigos con "puede estar" de los que found existían de verdad"""
+        if self.ready:
+            with self._lock:
+                self.false_positives += positives - found
+
+    def stats(self) -> dict:
+        bloom = self._bloom or self._building
+        return {
+            "enabled": self.capacity > 0,
+            "ready": self.ready,
+            "capacity": self.capacity,
+            "items": bloom.items if bloom else 0,
+            "size_bytes": bloom.size_bytes if bloom else 0,
+            "hash_count": bloom.hash_count if bloom else 0,
+            "target_fp_rate": self.fp_rate,
+            "estimated_fp_rate": bloom.estimated_fp_rate() if bloom else 0.0,
+            "lookups": self.lookups,
+            "skipped": self.skipped,
+            "false_positives": self.false_positives,
+        }
+
+
+def _load_codes(db: Session, bloom: BloomFilter) -> int:
+    """Agregar los smtp_code de emails y sus particiones, retorna el id más alto leído"""
+    last_id = 0
+    for table in partitions.registry.tables(db):
+        result = db.execute(select(table.c.id, table.c.smtp_code).execution_options(yield_per=BUILD_BATCH_SIZE))
+        for email_id, code in result:
+            bloom.add(code)
+            last_id = max(last_id, email_id)
+    return last_id
+
+
+def _next_id(db: Session) -> Optional[int]:
+    return db.execute(select(models.EmailIdSequence.next_id).where(models.EmailIdSequence.id == 1)).scalar()
+
+
+codes = SmtpCodeFilter(0 if shards.SHARDED else settings.SMTP_FILTER_CAPACITY, settings.SMTP_FILTER_FP_RATE)
+
+
+@metrics.register_collector
+def _filter_metrics():
+    stats = codes.stats()
+    return [
+        ("emails_smtp_filter_ready", "gauge", "1 si el filtro de smtp_code terminó de cargarse", int(stats["ready"])),
+        ("emails_smtp_filter_bytes", "gauge", "Memoria del filtro de smtp_code", stats["size_bytes"]),
+        ("emails_smtp_filter_items", "gauge", "Códigos cargados en el filtro", stats["items"]),
+        ("emails_smtp_filter_capacity", "gauge", "Capacidad configurada del filtro", stats["capacity"]),
+        ("emails_smtp_filter_estimated_fp_rate", "gauge", "Tasa de falsos positivos esperada con la carga actual", stats["estimated_fp_rate"]),
+        ("emails_smtp_filter_lookups_total", "counter", "Códigos consultados al filtro", stats["lookups"]),
+        ("emails_smtp_filter_skipped_total", "counter", "Negativos seguros que no consultaron la BD", stats["skipped"]),
+        ("emails_smtp_filter_false_positives_total", "counter", "Positivos del filtro que no estaban en la BD", stats["false_positives"]),
+    ]
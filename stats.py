@@ -0,0 +1,87 @@
+"""
+Endpoints de estadísticas para dashboards
+
+Responden desde los acumulados diarios (rollups.py), sin recorrer la tabla emails: el
+volumen depende de días × empresas del rango y el top de días × empresas × direcciones
+distintas por día, no de la cantidad de emails.
+Con shards por empresa cada shard tiene sus acumulados y los resultados se suman.
+"""
+
+from datetime import date
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+import schemas
+import company_cache
+import rollups
+import shards
+from database import get_read_db
+
+router = APIRouter()
+
+
+def _company_ids(company_name: Optional[str]) -> Optional[List[int]]:
+    # Mismo criterio que la búsqueda: subcadena del nombre, resuelta en el catálogo en memoria
+    return company_cache.catalog.ids_matching(company_name) if company_name else None
+
+
+def _volume(db: Session, group_by: schemas.StatsGroupBy, date_from, date_to, company_ids) -> List[tuple]:
+    if not shards.SHARDED:
+        return rollups.volume(db, group_by, date_from, date_to, company_ids)
+    return rollups.merge_volume(shards.registry.scatter(
+        company_ids, lambda shard_db: rollups.volume(shard_db, group_by, date_from, date_to, company_ids)
+    ))
+
+
+def _top(db: Session, field: str, limit: int, date_from, date_to, company_ids) -> List[tuple]:
+    if not shards.SHARDED:
+        return rollups.top(db, field, limit, date_from, date_to, company_ids)
+    # Una dirección puede estar en varios shards: con más de uno se suman los totales completos
+    shard_limit = limit if len(shards.registry.targets(company_ids)) == 1 else None
+    return rollups.merge_top(shards.registry.scatter(
+        company_ids, lambda shard_db: rollups.top(shard_db, field, shard_limit, date_from, date_to, company_ids)
+    ), limit)
+
+
+@router.get("/api/stats/volume", response_model=schemas.StatsVolumeResponse)
+def stats_volume(
+    date_from: Optional[date] = Query(None, description="Desde el día (inclusive, formato: 2024-12-01)"),
+    date_to: Optional[date] = Query(None, description="Hasta el día (inclusive)"),
+    company_name: Optional[str] = Query(None, description="Filtrar por nombre de empresa (opcional)"),
+    group_by: schemas.StatsGroupBy = Query(schemas.StatsGroupBy.day, description="Agrupar por day, company o company_day"),
+    db: Session = Depends(get_read_db)
+):
+    rows = _volume(db, group_by, date_from, date_to, _company_ids(company_name))
+    points = [
+        {
+            "day": day,
+            "company_name": company_cache.catalog.name_for(company_id) if company_id is not None else None,
+            "emails": total
+        }
+        for day, company_id, total in rows
+    ]
+    return {"total": sum(point["emails"] for point in points), "points": points}
+
+
+@router.get("/api/stats/top-senders", response_model=schemas.StatsTopResponse)
+def stats_top_senders(
+    date_from: Optional[date] = Query(None, description="Desde el día (inclusive, formato: 2024-12-01)"),
+    date_to: Optional[date] = Query(None, description="Hasta el día (inclusive)"),
+    company_name: Optional[str] = Query(None, description="Filtrar por nombre de empresa (opcional)"),
+    limit: int = Query(10, ge=1, le=100, description="Cantidad de emisores"),
+    db: Session = Depends(get_read_db)
+):
+    rows = _top(db, "sender", limit, date_from, date_to, _company_ids(company_name))
+    return {"items": [{"address": address, "emails": total} for address, total in rows]}
+
+
+@router.get("/api/stats/top-recipients", response_model=schemas.StatsTopResponse)
+def stats_top_recipients(
+    date_from: Optional[date] = Query(None, description="Desde el día (inclusive, formato: 2024-12-01)"),
+    date_to: Optional[date] = Query(None, description="Hasta el día (inclusive)"),
+    company_name: Optional[str] = Query(None, description="Filtrar por nombre de empresa (opcional)"),
+    limit: int = Query(10, ge=1, le=100, description="Cantidad de destinatarios"),
+    db: Session = Depends(get_read_db)
+):
+    rows = _top(db, "recipient", limit, date_from, date_to, _company_ids(company_name))
+    return {"items": [{"address": address, "emails": total} for address, total in rows]}
@@ -0,0 +1,291 @@
+"""
+Autocompletado por prefijo de emisor, destinatario y empresa (/api/suggest)
+
+Los valores distintos de cada campo viven en memoria en una lista ordenada (en minúsculas,
+como compara LIKE) con su cantidad de emails: un prefijo es un rango de la lista que se
+encuentra con bisect y de ahí salen los más frecuentes. El tecleo nunca consulta la BD.
+
+- carga: al arrancar, en un hilo, desde los acumulados diarios (rollups.py) de la BD
+  principal y de cada shard; mientras tanto /api/suggest responde 503
+- escritura: cada email insertado suma a su emisor, destinatario y empresa después del
+  commit; las empresas nuevas entran con 0 al crearse
+- prefijos cortos (rango de más de CACHE_MIN_RANGE valores): se guarda su top; como las
+  frecuencias solo suben, cada escritura reubica el valor en el top de sus propios prefijos
+- la lista ordenada va por bloques (_SortedKeys): un valor nuevo se inserta en su bloque,
+  sin mover la lista entera; las escrituras se aplican en un hilo aparte, fuera de la ingesta
+
+Como los acumulados, no descuenta los emails borrados por la retención hasta el próximo
+arranque; un email insertado mientras se carga puede contarse dos veces (solo cambia el orden).
+"""
+
+import bisect
+import heapq
+import logging
+import queue
+import threading
+from collections import Counter
+from fastapi import APIRouter, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Dict, Iterable, Iterator, List, Tuple
+import company_cache
+import metrics
+import responses
+import rollups
+import schemas
+import shards
+from database import ReadSessionLocal
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Máximo de sugerencias por consulta (también el tamaño del top guardado por prefijo)
+MAX_LIMIT = 50
+
+# Rangos de más valores que esto guardan su top (prefijos cortos como "a" o "ve")
+CACHE_MIN_RANGE = 2000
+
+# Encima de cualquier carácter: (prefijo + _END) acota el rango del prefijo
+_END = "\U0010ffff"
+
+# Claves por bloque de _SortedKeys (un bloque se parte en dos al llegar al doble)
+CHUNK_SIZE = 1000
+
+
+def _rank(item: Tuple[str, int]):
+    # Más emails primero; a igual cantidad, orden alfabético
+    return (-item[1], item[0])
+
+
+class _SortedKeys:
+    """Lista ordenada partida en bloques: insertar cuesta O(log n + CHUNK_SIZE), no O(n)"""
+
+    def __init__(self, keys: Iterable = ()):
+        keys = sorted(keys)
+        self._chunks = [keys[start:start + CHUNK_SIZE] for start in range(0, len(keys), CHUNK_SIZE)]
+        self._maxes = [chunk[-1] for chunk in self._chunks]  # última clave de cada bloque
+        self._len = len(keys)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def add(self, key):
+        if not self._chunks:
+            self._chunks, self._maxes = [[key]], [key]
+        else:
+            # El primer bloque cuya última clave no es menor; más allá del final, el último
+            position = min(bisect.bisect_left(self._maxes, key), len(self._maxes) - 1)
+            chunk = self._chunks[position]
+            bisect.insort(chunk, key)
+            self._maxes[position] = chunk[-1]
+            if len(chunk) > 2 * CHUNK_SIZE:
+                self._chunks[position:position + 1] = [chunk[:CHUNK_SIZE], chunk[CHUNK_SIZE:]]
+                self._maxes[position:position + 1] = [chunk[CHUNK_SIZE - 1], chunk[-1]]
+        self._len += 1
+
+    def _spans(self, low, high) -> Iterator[Tuple[list, int, int]]:
+        # (bloque, inicio, fin) con las claves de [low, high)
+        for position in range(bisect.bisect_left(self._maxes, low), len(self._chunks)):
+            chunk = self._chunks[position]
+            start = bisect.bisect_left(chunk, low)
+            stop = bisect.bisect_left(chunk, high, start)
+            yield chunk, start, stop
+            if stop < len(chunk):
+                return
+
+    def count(self, low, high) -> int:
+        return sum(stop - start for _, start, stop in self._spans(low, high))
+
+    def range(self, low, high) -> Iterator:
+        for chunk, start, stop in self._spans(low, high):
+            yield from chunk[start:stop]
+
+
+class PrefixIndex:
+    """Valores distintos de un campo ordenados sin distinguir mayúsculas, con su frecuencia"""
+
+    def __init__(self):
+        self._keys = _SortedKeys()  # (valor en minúsculas, valor) ordenados
+        self._counts: Dict[str, int] = {}
+        self._top: Dict[str, List[Tuple[str, int]]] = {}  # prefijo -> MAX_LIMIT más frecuentes
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def load(self, counts: Dict[str, int]):
+        """Carga inicial: reemplaza el contenido conservando lo sumado mientras se leía"""
+        counts = Counter(counts)
+        with self._lock:
+            counts.update(self._counts)
+            self._keys = _SortedKeys((value.lower(), value) for value in counts)
+            self._counts = dict(counts)
+            self._top = {}
+
+    def add(self, counts: Dict[str, int]):
+        """Sumar emails a cada valor (los nuevos se insertan en su lugar)"""
+        with self._lock:
+            for value, count in counts.items():
+                key = value.lower()
+                if value not in self._counts:
+                    self._keys.add((key, value))
+                    self._counts[value] = 0
+                self._counts[value] += count
+                # Solo los tops de los prefijos de este valor pueden cambiar
+                if self._top:
+                    item = (value, self._counts[value])
+                    for end in range(len(key) + 1):
+                        top = self._top.get(key[:end])
+                        if top is not None:
+                            top = [entry for entry in top if entry[0] != value] + [item]
+                            top.sort(key=_rank)
+                            self._top[key[:end]] = top[:MAX_LIMIT]
+
+    def suggest(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """Los limit valores más frecuentes que empiezan con prefix, retorna [(valor, emails)]"""
+        prefix = prefix.lower()
+        with self._lock:
+            top = self._top.get(prefix)
+            if top is None:
+                low, high = (prefix,), (prefix + _END,)
+                cached = self._keys.count(low, high) > CACHE_MIN_RANGE
+                counts = self._counts
+                top = heapq.nsmallest(
+                    MAX_LIMIT if cached else limit,
+                    ((value, counts[value]) for _, value in self._keys.range(low, high)),
+                    key=_rank
+                )
+                if cached:
+                    self._top[prefix] = top
+        return top[:limit]
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._fields = {field: PrefixIndex() for field in schemas.SuggestField}
+        self._thread = None
+        self._updater = None
+        self._pending = queue.Queue()  # filas confirmadas que falta sumar
+        self.ready = False
+
+    def start(self):
+        """Carga los valores desde los acumulados y aplica las escrituras, en segundo plano"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._build, name="suggest-index", daemon=True)
+        self._thread.start()
+        self._updater = threading.Thread(target=self._run, name="suggest-updates", daemon=True)
+        self._updater.start()
+
+    def _run(self):
+        while True:
+            rows = self._pending.get()
+            # Lo que se juntó mientras tanto se suma de una vez
+            while True:
+                try:
+                    rows = rows + self._pending.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._apply(rows)
+            except Exception:
+                logger.exception("Error actualizando el índice de sugerencias")
+
+    def _build(self):
+        try:
+            if shards.SHARDED:
+                totals = shards.registry.scatter(None, _rollup_totals)
+            else:
+                with ReadSessionLocal() as db:
+                    totals = [_rollup_totals(db)]
+        except Exception:
+            logger.exception("No se pudo cargar el índice de sugerencias")
+            return
+        merged = {field: Counter() for field in self._fields}
+        for shard_totals in totals:
+            for field, counts in shard_totals.items():
+                merged[field].update(counts)
+        # Las empresas sin emails también se sugieren
+        for name in company_cache.catalog.names():
+            merged[schemas.SuggestField.company].setdefault(name, 0)
+        for field, counts in merged.items():
+            self._fields[field].load(counts)
+        self.ready = True
+        logger.info("Índice de sugerencias listo: %s", {field.value: len(index) for field, index in self._fields.items()})
+
+    def add(self, rows: Iterable[dict]):
+        """Sumar filas de emails ya confirmadas (con sender, recipient y company_id)"""
+        rows = list(rows)
+        if not rows:
+            return
+        if self._updater is None:
+            # Sin hilo (consola, pruebas): se aplica acá mismo
+            self._apply(rows)
+        else:
+            self._pending.put(rows)
+
+    def _apply(self, rows: List[dict]):
+        counters = {field: Counter() for field in self._fields}
+        for row in rows:
+            counters[schemas.SuggestField.sender][row["sender"]] += 1
+            counters[schemas.SuggestField.recipient][row["recipient"]] += 1
+            name = company_cache.catalog.name_for(row["company_id"])
+            if name is not None:
+                counters[schemas.SuggestField.company][name] += 1
+        for field, counts in counters.items():
+            if counts:
+                self._fields[field].add(counts)
+
+    def add_company(self, name: str):
+        self._fields[schemas.SuggestField.company].add({name: 0})
+
+    def suggest(self, field: schemas.SuggestField, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        return self._fields[field].suggest(prefix, limit)
+
+    def pending(self) -> int:
+        return self._pending.qsize()
+
+    def sizes(self) -> Dict[str, int]:
+        return {field.value: len(index) for field, index in self._fields.items()}
+
+
+def _rollup_totals(db: Session) -> Dict[schemas.SuggestField, Dict[str, int]]:
+    """Emails por emisor, destinatario y empresa según los acumulados de una BD"""
+    companies = Counter()
+    for _, company_id, total in rollups.volume(db, schemas.StatsGroupBy.company):
+        name = company_cache.catalog.name_for(company_id)
+        if name is not None:
+            companies[name] += total
+    return {
+        schemas.SuggestField.sender: dict(rollups.top(db, "sender", None)),
+        schemas.SuggestField.recipient: dict(rollups.top(db, "recipient", None)),
+        schemas.SuggestField.company: companies,
+    }
+
+
+index = SuggestIndex()
+
+
+@router.get("/api/suggest", response_model=schemas.SuggestResponse)
+def suggest(
+    field: schemas.SuggestField = Query(..., description="Campo a completar: sender, recipient o company"),
+    prefix: str = Query("", max_length=200, description="Lo que lleva escrito el usuario (sin distinguir mayúsculas)"),
+    limit: int = Query(10, ge=1, le=MAX_LIMIT, description="Cantidad de sugerencias")
+):
+    """Valores del campo que empiezan con el prefijo, de más a menos emails (sin consultar la BD)"""
+    if not index.ready:
+        raise HTTPException(status_code=503, detail="El índice de sugerencias se está cargando")
+    items = index.suggest(field, prefix, limit)
+    return responses.json_response({"field": field, "prefix": prefix, "items": [{"value": value, "emails": total} for value, total in items]})
+
+
+@metrics.register_collector
+def _suggest_metrics():
+    sizes = index.sizes()
+    return [
+        ("emails_suggest_ready", "gauge", "1 si el índice de sugerencias terminó de cargarse", int(index.ready)),
+        ("emails_suggest_pending_batches", "gauge", "Lotes de emails confirmados que falta sumar al índice", index.pending()),
+    ] + [
+        (f"emails_suggest_{field}_values", "gauge", f"Valores distintos de {field} en el índice de sugerencias", size)
+        for field, size in sizes.items()
+    ]
@@ -0,0 +1,11 @@
+"""
+Configuración común de las pruebas: una BD SQLite temporal por sesión (antes de importar
+los módulos de la aplicación, que leen settings al importarse) y la raíz del repo en sys.path
+"""
+
+import os
+import sys
+import tempfile
+
+os.environ["EMAILS_DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="emails-tests-"), "emails.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
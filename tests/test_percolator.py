@@ -0,0 +1,33 @@
+import asyncio
+from fastapi.testclient import TestClient
+import main
+import percolator
+
+
+def test_rejected_duplicate_does_not_replace_inserted_content(monkeypatch):
+    """Un smtp_code repetido en el lote se rechaza sin pisar el contenido del que se insertó"""
+    submitted = []
+    monkeypatch.setattr(percolator.hub, "submit", lambda rows, contents: submitted.append((rows, contents)))
+    with TestClient(main.app) as client:
+        assert client.post("/api/companies", json={"name": "Banco Percolador", "client_id": "perc"}).status_code == 201
+        search_id = client.post("/api/saved-searches", json={"name": "fraude", "content": "fraude"}).json()["id"]
+        email = {"recipient": "a@banco.com", "sender": "b@banco.com", "date": "2024-12-01T10:00:00", "company_name": "Banco Percolador"}
+        report = client.post("/api/emails/bulk", json={"emails": [
+            {**email, "smtp_code": "DUP1", "content": "alerta de fraude"},
+            {**email, "smtp_code": "DUP1", "content": "hola mundo"},
+        ]}).json()
+        assert (report["success"], report["failed"]) == (1, 1)
+
+        rows, contents = submitted[-1]
+        assert [row["smtp_code"] for row in rows] == ["DUP1"]
+        assert contents == {"DUP1": "alerta de fraude"}
+
+        async def percolate():
+            subscriber = percolator.hub.subscribe(search_id)
+            try:
+                return percolator.hub.percolate(rows, contents)
+            finally:
+                percolator.hub.unsubscribe(subscriber)
+
+        found = asyncio.run(percolate())
+        assert [email["smtp_code"] for email in found[search_id]] == ["DUP1"]